@@ -0,0 +1,29 @@
+schema = {
+  "name": "area_summary",
+  "version": "1.0",
+  "fields": [
+    {
+      "name": "ar_id",
+      "type": "int",
+      "doc": "Area identifier"
+    },
+    {
+      "name": "n_hits",
+      "type": "int",
+      "doc": "Number of rows in area_hits for the area"
+    },
+    {
+      "name": "last_hit",
+      "type": "date",
+      "doc": "UTC time the most recent hit was found"
+    },
+    {
+      "name": "recent",
+      "type": "JSON",
+      "doc": "List of the most recent hits, newest first, each with objectId"
+    }
+  ],
+  "indexes": [
+    "PRIMARY KEY (`ar_id`)"
+  ]
+}
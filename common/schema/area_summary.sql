@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS area_summary(
+`ar_id` int,
+`n_hits` int,
+`last_hit` datetime(6),
+`recent` JSON,
+PRIMARY KEY (`ar_id`)
+)
\ No newline at end of file
@@ -0,0 +1,29 @@
+schema = {
+  "name": "lasair_status",
+  "version": "1.0",
+  "fields": [
+    {
+      "name": "nid",
+      "type": "int",
+      "doc": "Night identifier the status is for"
+    },
+    {
+      "name": "name",
+      "type": "bigstring",
+      "doc": "Key of the status value, e.g. today_alert"
+    },
+    {
+      "name": "value",
+      "type": "double",
+      "doc": "Value if it is a number, so that it can be incremented"
+    },
+    {
+      "name": "text",
+      "type": "text",
+      "doc": "Value as JSON if it is not a number"
+    }
+  ],
+  "indexes": [
+    "PRIMARY KEY (`nid`, `name`)"
+  ]
+}
@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS lasair_status(
+`nid` int,
+`name` varchar(80),
+`value` double,
+`text` text,
+PRIMARY KEY (`nid`, `name`)
+)
\ No newline at end of file
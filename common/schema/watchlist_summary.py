@@ -0,0 +1,29 @@
+schema = {
+  "name": "watchlist_summary",
+  "version": "1.0",
+  "fields": [
+    {
+      "name": "wl_id",
+      "type": "int",
+      "doc": "Watchlist identifier in watchlists"
+    },
+    {
+      "name": "n_hits",
+      "type": "int",
+      "doc": "Number of rows in watchlist_hits for the watchlist"
+    },
+    {
+      "name": "last_hit",
+      "type": "date",
+      "doc": "UTC time the most recent hit was found"
+    },
+    {
+      "name": "recent",
+      "type": "JSON",
+      "doc": "List of the most recent hits, newest first, each with objectId, cone_id, name and arcsec"
+    }
+  ],
+  "indexes": [
+    "PRIMARY KEY (`wl_id`)"
+  ]
+}
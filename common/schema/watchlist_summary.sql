@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS watchlist_summary(
+`wl_id` int,
+`n_hits` int,
+`last_hit` datetime(6),
+`recent` JSON,
+PRIMARY KEY (`wl_id`)
+)
\ No newline at end of file
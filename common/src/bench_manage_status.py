@@ -0,0 +1,120 @@
+"""Benchmark of manage_status with many processes adding to the same status at once.
+
+32 writers, as many ingest and filter processes would be, each call add a
+number of times on one file_id, and the total time and the time per call are
+reported with a check that no increment was lost. Before: the status file
+renamed to .lock, with the writers polling every 0.1 seconds until the rename
+succeeds. After: the files with a blocking fcntl lock, and with --db, the
+lasair_status table through db_connect.remote, which needs the settings and
+the table. The files go in a temporary directory, or in the given directory,
+which should be on the shared storage to be realistic.
+
+Usage: python3 bench_manage_status.py [--db] [nwriters] [nadd] [directory]
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+from multiprocessing import Process
+from manage_status import manage_status, now
+
+SLEEPTIME = 0.1
+FILE_ID = 1
+
+
+class Before(manage_status):
+    "the files with the rename lock, as manage_status was"
+    def lock_read(self, file_id):
+        status_file = '%s_%s.json' % (self.status_file_root, str(file_id))
+        lock_file   = '%s_%s.lock' % (self.status_file_root, str(file_id))
+        if not os.path.exists(status_file) and not os.path.exists(lock_file):
+            f = open(status_file, 'w')
+            f.write('{}')
+            f.close()
+        while 1:
+            try:
+                os.rename(status_file, lock_file)
+                break
+            except:
+                time.sleep(SLEEPTIME)
+        f = open(lock_file)
+        status = json.loads(f.read())
+        f.close()
+        return status
+
+    def write_unlock(self, status, file_id):
+        status['update_time'] = now()
+        status_file = '%s_%s.json' % (self.status_file_root, str(file_id))
+        lock_file   = '%s_%s.lock' % (self.status_file_root, str(file_id))
+        f = open(lock_file, 'w')
+        f.write(json.dumps(status))
+        f.close()
+        while 1:
+            try:
+                os.rename(lock_file, status_file)
+                break
+            except:
+                time.sleep(SLEEPTIME)
+
+    def add(self, dictionary, file_id):
+        status = self.lock_read(file_id)
+        for key,value in dictionary.items():
+            if key in status: status[key] += value
+            else:             status[key]  = value
+        self.write_unlock(status, file_id)
+
+
+def make(kind, root):
+    if kind == 'before':
+        return Before(root)
+    if kind == 'db':
+        sys.path.append('..')
+        import db_connect
+        return manage_status(root, db_connect.remote)
+    return manage_status(root)
+
+
+def writer(kind, root, nadd):
+    ms = make(kind, root)
+    for i in range(nadd):
+        ms.add({'bench_alert': 250, 'bench_batch': 1}, FILE_ID)
+    ms.close()
+
+
+def run(kind, root, nwriters, nadd):
+    ms = make(kind, root)
+    ms.set({'bench_alert': 0, 'bench_batch': 0}, FILE_ID)
+    writers = [Process(target=writer, args=(kind, root, nadd)) for i in range(nwriters)]
+    t = time.perf_counter()
+    for p in writers:
+        p.start()
+    for p in writers:
+        p.join()
+    elapsed = time.perf_counter() - t
+    status = ms.read(FILE_ID)
+    ms.close()
+    lost = nwriters * nadd - status['bench_batch']
+    return elapsed, lost
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    kinds = ['before', 'after']
+    if '--db' in args:
+        args.remove('--db')
+        kinds.append('db')
+    nwriters = int(args[0]) if len(args) > 0 else 32
+    nadd = int(args[1]) if len(args) > 1 else 20
+    directory = tempfile.mkdtemp(dir=args[2] if len(args) > 2 else None)
+
+    print('%d writers, %d adds each' % (nwriters, nadd))
+    print('%8s %12s %12s %8s' % ('store', 'total s', 'ms/add', 'lost'))
+    try:
+        for kind in kinds:
+            root = os.path.join(directory, kind)
+            elapsed, lost = run(kind, root, nwriters, nadd)
+            print('%8s %12.2f %12.2f %8d' % (kind, elapsed, 1000 * elapsed / (nwriters * nadd), lost))
+    finally:
+        shutil.rmtree(directory)
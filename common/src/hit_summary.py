@@ -0,0 +1,199 @@
+"""
+hit_summary.py
+Summaries of the watchlist and area hits, one row per watchlist or watchmap in
+watchlist_summary and area_summary: the number of hits, when the latest was
+found, and the most recent hits. The web pages read these instead of counting
+and joining the hits tables, which grow without limit.
+The filter keeps them up to date a batch at a time: new_hits finds which hits
+of the batch are not yet in the main database, before the batch is sent there,
+and add_hits adds those to the summaries afterwards. Anything that remakes all
+the hits of a watchlist or watchmap calls rebuild.
+"""
+import json
+from datetime import datetime, timedelta
+
+RECENT = 1000       # most recent hits kept in each summary, as shown on the web pages
+LOOKUP_CHUNK = 1000 # objectIds looked up in one query
+
+KINDS = {
+    'watchlist': {
+        'hits': 'watchlist_hits',
+        'summary': 'watchlist_summary',
+        'id': 'wl_id',
+        'key': ('objectId', 'cone_id'),
+        'fields': (('objectId', str), ('cone_id', int), ('name', str), ('arcsec', float)),
+    },
+    'area': {
+        'hits': 'area_hits',
+        'summary': 'area_summary',
+        'id': 'ar_id',
+        'key': ('objectId', 'ar_id'),
+        'fields': (('objectId', str),),
+    },
+}
+
+
+def entry(kind, hit):
+    """ entry.
+        What the summary keeps of a hit, as plain types for JSON
+        Args:
+            kind: 'watchlist' or 'area'
+            hit: dictionary as made by the filter
+    """
+    e = {f: t(hit[f]) for (f, t) in KINDS[kind]['fields']}
+    if 'arcsec' in e:
+        e['arcsec'] = round(e['arcsec'], 3)
+    return e
+
+
+def new_hits(msl, kind, hits):
+    """ new_hits.
+        The hits that are not already in the hits table, so that an object
+        seen again in a later batch is only counted once
+        Args:
+            msl: connection to the main database
+            kind: 'watchlist' or 'area'
+            hits: list of dictionaries as made by the filter
+    """
+    k = KINDS[kind]
+    objectIds = sorted(set(hit['objectId'] for hit in hits))
+    known = set()
+    cursor = msl.cursor(buffered=True)
+    for i in range(0, len(objectIds), LOOKUP_CHUNK):
+        chunk = objectIds[i:i + LOOKUP_CHUNK]
+        # the primary key of the hits table starts with objectId
+        query = 'SELECT %s FROM %s WHERE objectId IN (%s)' % \
+            (', '.join(k['key']), k['hits'], ', '.join(['%s'] * len(chunk)))
+        cursor.execute(query, chunk)
+        known.update(tuple(row) for row in cursor.fetchall())
+    cursor.close()
+
+    new = []
+    for hit in hits:
+        key = tuple(hit[c] for c in k['key'])
+        if key not in known:
+            known.add(key)
+            new.append(hit)
+    return new
+
+
+def add_hits(msl, kind, hits, when=None):
+    """ add_hits.
+        Add new hits to the summaries
+        Args:
+            msl: connection to the main database
+            kind: 'watchlist' or 'area'
+            hits: list of dictionaries from new_hits
+            when: UTC time of the hits, default now
+    """
+    k = KINDS[kind]
+    by_id = {}
+    for hit in hits:
+        by_id.setdefault(int(hit[k['id']]), []).append(entry(kind, hit))
+    if not by_id:
+        return
+    when = when or datetime.utcnow()
+    ids = sorted(by_id)
+
+    # lock the rows in order, so filters running at once wait rather than lose each other's recent hits
+    cursor = msl.cursor(buffered=True, dictionary=True)
+    old = {}
+    for i in range(0, len(ids), LOOKUP_CHUNK):
+        chunk = ids[i:i + LOOKUP_CHUNK]
+        query = 'SELECT %s AS id, recent FROM %s WHERE %s IN (%s) ORDER BY %s FOR UPDATE' % \
+            (k['id'], k['summary'], k['id'], ', '.join(['%s'] * len(chunk)), k['id'])
+        cursor.execute(query, chunk)
+        for row in cursor.fetchall():
+            old[row['id']] = json.loads(row['recent'] or '[]')
+
+    rows = []
+    for id in ids:
+        recent = (by_id[id] + old.get(id, []))[:RECENT]
+        rows.append((id, len(by_id[id]), when, json.dumps(recent)))
+    query = 'INSERT INTO %s (%s, n_hits, last_hit, recent) VALUES (%%s, %%s, %%s, %%s) ' % (k['summary'], k['id'])
+    query += 'ON DUPLICATE KEY UPDATE n_hits=n_hits+VALUES(n_hits), last_hit=VALUES(last_hit), recent=VALUES(recent)'
+    cursor.executemany(query, rows)
+    msl.commit()
+    cursor.close()
+
+
+def rebuild(msl, kind, ids):
+    """ rebuild.
+        Remake the summaries from the hits table, after the hits have been remade.
+        The recent hits are taken to be those of the most recently detected objects.
+        Args:
+            msl: connection to the main database
+            kind: 'watchlist' or 'area'
+            ids: the watchlists or watchmaps
+    """
+    k = KINDS[kind]
+    cursor = msl.cursor(buffered=True, dictionary=True)
+    for id in ids:
+        query = 'SELECT count(*) AS n_hits FROM %s WHERE %s=%%s' % (k['hits'], k['id'])
+        cursor.execute(query, (id,))
+        n_hits = cursor.fetchone()['n_hits']
+        if n_hits == 0:
+            cursor.execute('DELETE FROM %s WHERE %s=%%s' % (k['summary'], k['id']), (id,))
+            continue
+
+        fields = ', '.join('h.' + f for (f, t) in k['fields'])
+        query = 'SELECT %s, o.jdmax FROM %s AS h JOIN objects AS o ON o.objectId=h.objectId ' % (fields, k['hits'])
+        query += 'WHERE h.%s=%%s ORDER BY o.jdmax DESC LIMIT %d' % (k['id'], RECENT)
+        cursor.execute(query, (id,))
+        rows = cursor.fetchall()
+        recent = [entry(kind, row) for row in rows]
+        last_hit = jd_to_datetime(rows[0]['jdmax']) if rows and rows[0]['jdmax'] else None
+
+        query = 'REPLACE INTO %s (%s, n_hits, last_hit, recent) VALUES (%%s, %%s, %%s, %%s)' % (k['summary'], k['id'])
+        cursor.execute(query, (id, n_hits, last_hit, json.dumps(recent)))
+    msl.commit()
+    cursor.close()
+
+
+def delete(msl, kind, id):
+    """ delete.
+        Remove the summary of a watchlist or watchmap that has gone
+        Args:
+            msl: connection to the main database
+            kind: 'watchlist' or 'area'
+            id: the watchlist or watchmap
+    """
+    k = KINDS[kind]
+    cursor = msl.cursor(buffered=True)
+    cursor.execute('DELETE FROM %s WHERE %s=%%s' % (k['summary'], k['id']), (id,))
+    msl.commit()
+    cursor.close()
+
+
+def read(msl, kind, ids):
+    """ read.
+        The summaries of some watchlists or watchmaps, with one query
+        Args:
+            msl: database connection
+            kind: 'watchlist' or 'area'
+            ids: the watchlists or watchmaps
+        Returns:
+            dictionary of id to {'n_hits', 'last_hit', 'recent'}, with zero hits for those without a summary
+    """
+    k = KINDS[kind]
+    ids = [int(id) for id in ids]
+    result = {id: {'n_hits': 0, 'last_hit': None, 'recent': []} for id in ids}
+    if not ids:
+        return result
+    cursor = msl.cursor(buffered=True, dictionary=True)
+    query = 'SELECT %s AS id, n_hits, last_hit, recent FROM %s WHERE %s IN (%s)' % \
+        (k['id'], k['summary'], k['id'], ', '.join(['%s'] * len(ids)))
+    cursor.execute(query, ids)
+    for row in cursor.fetchall():
+        result[row['id']] = {
+            'n_hits': row['n_hits'],
+            'last_hit': row['last_hit'],
+            'recent': json.loads(row['recent'] or '[]'),
+        }
+    cursor.close()
+    return result
+
+
+def jd_to_datetime(jd):
+    """ UTC datetime of a Julian date """
+    return datetime(1970, 1, 1) + timedelta(days=jd - 2440587.5)
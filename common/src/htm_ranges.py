@@ -0,0 +1,40 @@
+"""
+htm_ranges.py
+The htm16 ranges that cover a cone, from htmCircleRegion, and merging of
+ranges, so that the cones of many positions go in one query of the htm16
+index. Used by the TNS delta, the web cone search and the skymap pages.
+"""
+import re
+from gkhtm import _gkhtm as htmCircle
+
+# one range in the output of htmCircleRegion
+HTM_BETWEEN = re.compile(r'between\s+(\d+)\s+and\s+(\d+)', re.IGNORECASE)
+
+def htm16_ranges(ra, dec, radius):
+    """ htm16_ranges.
+        The htm16 ranges covering a cone
+        Args:
+            ra, dec: centre of the cone in degrees
+            radius: radius in arcsec
+        Returns:
+            list of (lo, hi)
+    """
+    clause = htmCircle.htmCircleRegion(16, ra, dec, radius)
+    return [(int(lo), int(hi)) for (lo, hi) in HTM_BETWEEN.findall(clause)]
+
+def merge_ranges(ranges):
+    """ merge_ranges.
+        Sorts a list of ranges and merges those that overlap or are adjacent
+        Args:
+            ranges: list of (lo, hi)
+        Returns:
+            sorted list of (lo, hi) with no two overlapping or adjacent
+    """
+    merged = []
+    for (lo, hi) in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            if hi > merged[-1][1]:
+                merged[-1][1] = hi
+        else:
+            merged.append([lo, hi])
+    return [(lo, hi) for (lo, hi) in merged]
@@ -1,97 +1,102 @@
 """
 manage_status.py
-Manage a set of status files that is a set of key-value pairs in JSON. 
+Manage a set of status records, each a set of key-value pairs.
 Different processes/cores/threads can change key value or increment values.
-There is a "file_id" to determine which file we are working with
+There is a "file_id" to determine which record we are working with.
+
+There are two stores behind the same set/add/read/tostr calls:
+  - a table lasair_status in the database, one row per key, where add is a
+    single INSERT ... ON DUPLICATE KEY UPDATE value=value+VALUES(value), so
+    the increments are atomic and writers only wait on the row locks.
+  - JSON files <status_file_root>_<file_id>.json, as before, for a single
+    machine or testing. Writers take a blocking fcntl lock on a
+    side file, rather than renaming the status file and polling until it
+    comes back, and the new status is written to a temporary file and renamed
+    over the old one, so readers never see a half written file and need no lock.
+status_for chooses between them from the settings.
 """
 
 import datetime
+import fcntl
 import json
-import time
-import os, sys
-SLEEPTIME = 0.1
+import os
+from contextlib import contextmanager
+
+# the status table, see common/schema/lasair_status.sql
+TABLE = 'lasair_status'
+
+# times an increment is tried again if the database chooses it to break a deadlock
+DEADLOCK_RETRIES = 5
+ER_LOCK_DEADLOCK = 1213
+
+def status_for(settings, connect):
+    """ status_for.
+        The status store the settings ask for: the database table if
+        SYSTEM_STATUS_DB is true, else the JSON files at SYSTEM_STATUS
+        Args:
+            settings: the settings module
+            connect: function returning a database connection, e.g. db_connect.remote
+    """
+    if getattr(settings, 'SYSTEM_STATUS_DB', False):
+        return manage_status(settings.SYSTEM_STATUS, connect)
+    return manage_status(settings.SYSTEM_STATUS)
+
+def now():
+    update_time = datetime.datetime.utcnow().isoformat()
+    return update_time.split('.')[0]
 
 class manage_status():
     """ manage_status.
         Args:
-            file_id: The special key, when its value changes, increment from zero
-            status_file: Name of the status file
+            status_file_root: Name of the status files, without the _<file_id>.json
+            connect: if given, function returning a database connection,
+                and the status is kept in the database table instead of the files
     """
-    def __init__(self, status_file_root):
+    def __init__(self, status_file_root, connect=None):
         self.status_file_root  = status_file_root
+        self.connect = connect
+        self.msl = None
 
     def read(self, file_id):
-        status_file = '%s_%s.json' % (self.status_file_root, str(file_id))
-        f = open(status_file)
-        status = json.loads(f.read())
-        f.close()
-        return status
-
-    def lock_read(self, file_id):
-        """ lock_read.
-            If status file not present, make an empty one
-            Waits for lock, then locks and returns the status
-            Must be quickly followed with write_unlock!
+        """ read.
+            Returns the status as a dictionary
             Args:
                 file_id: which file to use
         """
+        if self.connect:
+            return self.db_read(file_id)
         status_file = '%s_%s.json' % (self.status_file_root, str(file_id))
-        lock_file   = '%s_%s.lock' % (self.status_file_root, str(file_id))
-
-        if not os.path.exists(status_file) and not os.path.exists(lock_file):
-#            print('Status file not present!')
-            f = open(status_file, 'w')
-            f.write('{}')
-            f.close()
-        # rename as lock file while we modify values
-        while 1:
-            try:
-                os.rename(status_file, lock_file)
-                break
-            except:
-                time.sleep(SLEEPTIME)
-
-        # return contents
-        f = open(lock_file)
+        f = open(status_file)
         status = json.loads(f.read())
         f.close()
         return status
 
-    def write_unlock(self, status, file_id):
-        """ write_status:
-            Writes the status file, then unlocks
+    def get(self, key, file_id, default=None):
+        """ get.
+            Returns the value of one key, reading only that from the database
             Args:
-                status: dictionary of key-value pairs
+                key: the key
                 file_id: which file to use
+                default: returned if the key is not there
         """
-        update_time = datetime.datetime.utcnow().isoformat()
-        update_time = update_time.split('.')[0]
-        status['update_time'] = update_time
-
-        status_file = '%s_%s.json' % (self.status_file_root, str(file_id))
-        lock_file   = '%s_%s.lock' % (self.status_file_root, str(file_id))
-
-        # dump the status to the lock file
-        f = open(lock_file, 'w')
-        f.write(json.dumps(status))
-        f.close()
-        # rename lock file as atatus file
-        while 1:
+        if not self.connect:
             try:
-                os.rename(lock_file, status_file)
-                break
-            except:
-                time.sleep(SLEEPTIME)
+                return self.read(file_id).get(key, default)
+            except Exception:
+                return default
+        rows = self.db_execute(
+            'SELECT name, value, text FROM %s WHERE nid=%%s AND name=%%s' % TABLE,
+            [(int(file_id), key)], fetch=True)
+        if not rows:
+            return default
+        return decode(rows[0][1], rows[0][2])
 
     def tostr(self, file_id):
         """ __repr__:
             Write out the status file
         """
-        status_file = '%s_%s.json' % (self.status_file_root, str(file_id))
         try:
-            f = open(status_file)
-            status = json.loads(f.read())
-            f.close()
+            status = self.read(file_id)
         except:
             status = {}
         return json.dumps(status, indent=2)
@@ -103,10 +108,12 @@ class manage_status():
                 dictionary: set of key-value pairs
                 file_id: which file to use
         """
-        status = self.lock_read(file_id)
-        for key,value in dictionary.items():
-            status[key] = value
-        self.write_unlock(status, file_id)
+        if self.connect:
+            self.db_write(dictionary, file_id, increment=False)
+            return
+        with self.locked(file_id) as status:
+            for key,value in dictionary.items():
+                status[key] = value
 
     def add(self, dictionary, file_id):
         """ add
@@ -115,10 +122,118 @@ class manage_status():
                 dictionary: set of key-value pairs
                 file_id: if same as in status file, increment, else set
         """
-        status = self.lock_read(file_id)
+        if self.connect:
+            self.db_write(dictionary, file_id, increment=True)
+            return
+        with self.locked(file_id) as status:
+            for key,value in dictionary.items():
+                if key in status: status[key] += value
+                else:             status[key]  = value
+
+    @contextmanager
+    def locked(self, file_id):
+        """ locked.
+            Holds the lock on a status file while its status is changed,
+            then writes it with the update time. The lock is a blocking
+            fcntl lock on <status_file_root>_<file_id>.flock, so a waiting
+            writer sleeps in the kernel until it is free.
+            Args:
+                file_id: which file to use
+        """
+        status_file = '%s_%s.json' % (self.status_file_root, str(file_id))
+        lock_file   = '%s_%s.flock' % (self.status_file_root, str(file_id))
+        with open(lock_file, 'a') as lock:
+            fcntl.lockf(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    f = open(status_file)
+                    status = json.loads(f.read())
+                    f.close()
+                except FileNotFoundError:
+                    status = {}
+                yield status
+                status['update_time'] = now()
+
+                # readers never see a partly written file
+                tmp_file = '%s.%d.tmp' % (status_file, os.getpid())
+                f = open(tmp_file, 'w')
+                f.write(json.dumps(status))
+                f.close()
+                os.replace(tmp_file, status_file)
+            finally:
+                fcntl.lockf(lock, fcntl.LOCK_UN)
+
+    def close(self):
+        """ close.
+            Closes the database connection, if there is one
+        """
+        if self.msl is not None:
+            self.msl.close()
+            self.msl = None
+
+    def db_read(self, file_id):
+        rows = self.db_execute(
+            'SELECT name, value, text FROM %s WHERE nid=%%s' % TABLE,
+            [(int(file_id),)], fetch=True)
+        if not rows:
+            raise KeyError('No status for %s' % str(file_id))
+        return {name: decode(value, text) for (name, value, text) in rows}
+
+    def db_write(self, dictionary, file_id, increment):
+        """ db_write.
+            Sets or increments the keys with one statement, and sets the update time
+            Args:
+                dictionary: set of key-value pairs
+                file_id: which status
+                increment: add to numbers already there rather than replace them
+        """
+        nid = int(file_id)
+        dictionary = dict(dictionary, update_time=now())
+        # rows are locked in the order of the keys, the same for every writer
+        rows = [(nid, key) + encode(value) for (key, value) in sorted(dictionary.items())]
+        query = 'INSERT INTO %s (nid, name, value, text) VALUES %s ' % \
+            (TABLE, ','.join(['(%s,%s,%s,%s)'] * len(rows)))
+        if increment:
+            query += 'ON DUPLICATE KEY UPDATE value=IF(VALUES(value) IS NULL, NULL, COALESCE(value,0)+VALUES(value)), text=VALUES(text)'
+        else:
+            query += 'ON DUPLICATE KEY UPDATE value=VALUES(value), text=VALUES(text)'
+        self.db_execute(query, [sum(rows, ())])
+
+    def db_execute(self, query, arglist, fetch=False):
+        """ db_execute.
+            Runs the query once for each set of arguments and commits. The
+            connection is made when first needed and made again if it has
+            gone, and a deadlock is tried again.
+        """
+        import mysql.connector
+        for attempt in range(DEADLOCK_RETRIES):
+            try:
+                if self.msl is None or not self.msl.is_connected():
+                    self.msl = self.connect()
+                cursor = self.msl.cursor(buffered=True)
+                rows = []
+                for args in arglist:
+                    cursor.execute(query, args)
+                    if fetch:
+                        rows += cursor.fetchall()
+                self.msl.commit()
+                cursor.close()
+                return rows
+            except mysql.connector.Error as e:
+                if e.errno != ER_LOCK_DEADLOCK or attempt == DEADLOCK_RETRIES - 1:
+                    raise
+                self.msl.rollback()
 
-        for key,value in dictionary.items():
-            if key in status: status[key] += value
-            else:             status[key]  = value
+def encode(value):
+    """ the value and text columns for a value: numbers go in value so they can be added to """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (value, None)
+    return (None, json.dumps(value))
 
-        self.write_unlock(status, file_id)
+def decode(value, text):
+    """ the value from the value and text columns """
+    if text is not None:
+        return json.loads(text)
+    if value is not None and float(value).is_integer():
+        return int(value)
+    return value
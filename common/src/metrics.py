@@ -0,0 +1,419 @@
+"""
+metrics.py
+Counters, gauges and histograms in the Prometheus text format, shared by the
+pipeline stages, the services and the web server.
+A metric is made once at module level, then changed with its labels:
+    BATCH_SECONDS = metrics.histogram('lasair_x_seconds', 'Time of x', ('stage',))
+    with BATCH_SECONDS.time(stage='watchlist'):
+        ...
+The metrics of a process are exposed either by writing them with write(job)
+to the directory of the node exporter's textfile collector, as
+<job>.prom, or by serve(port) on a local HTTP endpoint, for processes
+that run in a container. A job that runs as several processes, such as the
+web server workers, uses write_shared(job), which adds up their values. Nothing here raises if the metrics cannot be written,
+so instrumentation never stops the pipeline.
+"""
+
+import os
+import re
+import copy
+import json
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+    import settings
+except ImportError:
+    settings = None
+
+# the directory the node exporter's textfile collector reads
+METRICS_DIR = getattr(settings, 'METRICS_DIR', '/var/lib/prometheus/node-exporter')
+
+# seconds between writes of the textfile, for write(job, every=True)
+METRICS_INTERVAL = getattr(settings, 'METRICS_INTERVAL', 15)
+
+# upper bounds of the histogram buckets, seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+
+# name -> metric, in the order they were made
+REGISTRY = {}
+lock = threading.Lock()
+last_write = {}
+
+# job -> (pid, file of its values) for write_shared, made again after a fork
+process_files = {}
+# the threads of a process take turns in write_shared, as the file lock is per process
+shared_lock = threading.Lock()
+
+# the file of the values of one process in write_shared, <pid>_<microseconds>.json
+PROCESS_FILE = re.compile(r'(\d+)_\d+\.json')
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (n, escape(v)) for (n, v) in pairs) + '}'
+
+def format_value(value):
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric():
+    """ Metric.
+        A metric with a value for each combination of its labels
+        Args:
+            name: the Prometheus name, lasair_<what>_<unit>
+            doc: the help text
+            labels: names of the labels
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def key(self, labels):
+        if len(labels) != len(self.labels) or set(labels) != set(self.labels):
+            raise ValueError('%s has labels %s, not %s' % (self.name, self.labels, tuple(labels)))
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def samples(self):
+        """ (suffix, label values, extra labels, value) for each line of the text format """
+        for (key, value) in sorted(self.values.items()):
+            yield ('', key, (), value)
+
+    def text(self):
+        lines = ['# HELP %s %s' % (self.name, self.doc.replace('\\', '\\\\').replace('\n', '\\n')),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        for (suffix, key, extra, value) in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix, format_labels(self.labels, key, extra), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """ inc.
+            Adds to the counter, which only goes up
+        """
+        if amount < 0:
+            raise ValueError('%s can only go up' % self.name)
+        key = self.key(labels)
+        with lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=BUCKETS):
+        Metric.__init__(self, name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """ observe.
+            Counts a value, usually a time in seconds, into the buckets
+        """
+        key = self.key(labels)
+        with lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = self.values[key]
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+            counts[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """ time.
+            Observes the seconds taken by the body of a with statement
+        """
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, **labels)
+
+    def samples(self):
+        for (key, (counts, total, count)) in sorted(self.values.items()):
+            cumulative = 0
+            for (bound, n) in zip(self.buckets, counts):
+                cumulative += n
+                yield ('_bucket', key, (('le', format_value(float(bound))),), cumulative)
+            yield ('_bucket', key, (('le', '+Inf'),), count)
+            yield ('_sum', key, (), total)
+            yield ('_count', key, (), count)
+
+def register(cls, name, doc, labels, **args):
+    with lock:
+        metric = REGISTRY.get(name)
+        if metric is None:
+            metric = REGISTRY[name] = cls(name, doc, labels, **args)
+        elif type(metric) is not cls or metric.labels != tuple(labels):
+            raise ValueError('%s is already a %s with labels %s' % (name, metric.kind, metric.labels))
+    return metric
+
+def counter(name, doc, labels=()):
+    """ counter.
+        The counter of this name, made if it is new
+        Args:
+            name: the Prometheus name, ending in _total
+            doc: the help text
+            labels: names of the labels
+    """
+    return register(Counter, name, doc, labels)
+
+def gauge(name, doc, labels=()):
+    """ gauge.
+        The gauge of this name, made if it is new
+        Args:
+            name: the Prometheus name
+            doc: the help text
+            labels: names of the labels
+    """
+    return register(Gauge, name, doc, labels)
+
+def histogram(name, doc, labels=(), buckets=BUCKETS):
+    """ histogram.
+        The histogram of this name, made if it is new
+        Args:
+            name: the Prometheus name, ending in the unit, usually _seconds
+            doc: the help text
+            labels: names of the labels
+            buckets: upper bounds of the buckets
+    """
+    return register(Histogram, name, doc, labels, buckets=buckets)
+
+def exposition(values=None):
+    """ exposition.
+        All the metrics of this process in the Prometheus text format
+        Args:
+            values: name -> values of the metrics to use instead, from add_values
+    """
+    with lock:
+        if values is None:
+            return ''.join(metric.text() for metric in REGISTRY.values() if metric.values)
+        text = ''
+        for metric in REGISTRY.values():
+            if values.get(metric.name):
+                shared = copy.copy(metric)
+                shared.values = values[metric.name]
+                text += shared.text()
+        return text
+
+def write_file(filename, text):
+    """ writes through a temporary file, so it is never read half written """
+    tmpname = '%s.%d.tmp' % (filename, os.getpid())
+    f = open(tmpname, 'w')
+    f.write(text)
+    f.close()
+    os.replace(tmpname, filename)
+
+def write(job, every=False, directory=None):
+    """ write.
+        Writes the metrics to <directory>/<job>.prom for the textfile
+        collector, through a temporary file so it is never read half written
+        Args:
+            job: name of the process, e.g. lasair_ingest
+            every: only write if METRICS_INTERVAL seconds have passed since the last write
+            directory: default METRICS_DIR
+    """
+    now = time.time()
+    if every and now - last_write.get(job, 0) < METRICS_INTERVAL:
+        return False
+    last_write[job] = now
+    try:
+        write_file(os.path.join(directory or METRICS_DIR, '%s.prom' % job), exposition())
+        return True
+    except OSError:
+        return False
+
+def dump_values(values):
+    """ name -> values of the metrics as JSON, from the values of add_values """
+    return {name: [[list(key), value] for (key, value) in pairs.items()] for (name, pairs) in values.items()}
+
+def add_values(total, dumped):
+    """ add_values.
+        Adds the values of the metrics of a process, as JSON, into a total
+        Args:
+            total: name -> {label values: value}, the form of Metric.values
+            dumped: from dump_values
+    """
+    for (name, pairs) in dumped.items():
+        into = total.setdefault(name, {})
+        for (key, value) in pairs:
+            key = tuple(key)
+            old = into.get(key)
+            if old is None:
+                into[key] = value
+            elif isinstance(value, list):
+                # a histogram, [bucket counts, sum, count]
+                into[key] = [[a + b for (a, b) in zip(old[0], value[0])], old[1] + value[1], old[2] + value[2]]
+            else:
+                into[key] = old + value
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+def write_shared(job, every=False, directory=None):
+    """ write_shared.
+        Writes the metrics of a job that runs as several processes as one
+        <directory>/<job>.prom, with the values of all the processes added up,
+        so no label is needed for the process. Each process keeps its values in
+        <directory>/<job>.d/<pid>_<microseconds>.json, named when it first
+        writes, so a forked process has its own. The values of processes that
+        have ended are moved into ended.json, so their counts are kept and
+        their files do not pile up. The processes take turns with a lock.
+        Args:
+            job: name of the job, e.g. lasair_api
+            every: only write if METRICS_INTERVAL seconds have passed since this process last wrote
+            directory: default METRICS_DIR
+    """
+    now = time.time()
+    pid = os.getpid()
+    if every and process_files.get(job, (None,))[0] == pid \
+            and now - last_write.get(job, 0) < METRICS_INTERVAL:
+        return False
+    last_write[job] = now
+    if process_files.get(job, (None,))[0] != pid:
+        process_files[job] = (pid, '%d_%d.json' % (pid, int(now * 1e6)))
+    directory = directory or METRICS_DIR
+    shared = os.path.join(directory, '%s.d' % job)
+    ended_file = os.path.join(shared, 'ended.json')
+    try:
+        os.makedirs(shared, exist_ok=True)
+        with shared_lock, open(os.path.join(shared, 'lock'), 'a') as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            with lock:
+                values = {metric.name: metric.values for metric in REGISTRY.values() if metric.values}
+                own = json.dumps(dump_values(values))
+            write_file(os.path.join(shared, process_files[job][1]), own)
+
+            ended = {}
+            try:
+                with open(ended_file) as f:
+                    add_values(ended, json.load(f))
+            except FileNotFoundError:
+                pass
+            total = {}
+            add_values(total, dump_values(ended))
+            gone = []
+            for name in os.listdir(shared):
+                match = PROCESS_FILE.fullmatch(name)
+                if match is None:
+                    continue
+                with open(os.path.join(shared, name)) as f:
+                    dumped = json.load(f)
+                add_values(total, dumped)
+                if not alive(int(match.group(1))):
+                    add_values(ended, dumped)
+                    gone.append(name)
+            if gone:
+                write_file(ended_file, json.dumps(dump_values(ended)))
+                for name in gone:
+                    os.remove(os.path.join(shared, name))
+            write_file(os.path.join(directory, '%s.prom' % job), exposition(total))
+        return True
+    except (OSError, ValueError):
+        return False
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = exposition().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port, address=''):
+    """ serve.
+        Serves the metrics over HTTP from a background thread
+        Args:
+            port: the port, e.g. 9101
+            address: address to listen on, default all
+    """
+    server = ThreadingHTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+# the metrics that all the stages have
+STAGE_SECONDS = histogram('lasair_stage_seconds',
+    'Time taken by a stage of the pipeline for one batch', ('stage',))
+ALERTS = counter('lasair_alerts_total',
+    'Alerts handled by a stage of the pipeline', ('stage',))
+KAFKA_LAG = gauge('lasair_kafka_consumer_lag',
+    'Messages in the partition not yet read by the consumer', ('stage', 'topic', 'partition'))
+SERVICE_SECONDS = gauge('lasair_service_seconds',
+    'Time taken by the last successful run of a service', ('service',))
+SERVICE_DONE = gauge('lasair_service_done_timestamp_seconds',
+    'Unix time the last successful run of a service ended', ('service',))
+
+def service_done(service, started):
+    """ service_done.
+        Records a successful run of a service, and writes its textfile at
+        once, as services run and exit
+        Args:
+            service: name of the service, e.g. make_watchlist_files
+            started: time.time() when the run started
+    """
+    now = time.time()
+    SERVICE_SECONDS.set(now - started, service=service)
+    SERVICE_DONE.set(now, service=service)
+    write('lasair_service_' + service)
+
+def kafka_lag(consumer, stage, timeout=1):
+    """ kafka_lag.
+        Sets the consumer lag of each partition assigned to a Kafka consumer,
+        the high watermark less the consumer's position, which costs a request
+        to the broker for each partition
+        Args:
+            consumer: confluent_kafka Consumer
+            stage: the stage of the pipeline, e.g. ingest
+            timeout: seconds to wait for each watermark
+    """
+    try:
+        for tp in consumer.position(consumer.assignment()):
+            (low, high) = consumer.get_watermark_offsets(tp, timeout=timeout)
+            offset = tp.offset if tp.offset >= 0 else low
+            KAFKA_LAG.set(max(0, high - offset), stage=stage, topic=tp.topic, partition=tp.partition)
+    except Exception:
+        pass
@@ -0,0 +1,202 @@
+"""
+profiling.py
+Profiling hooks on the hot paths of the pipeline, and sampled tracing of
+alerts from ingest through Sherlock to the filter.
+
+Profiling: a function decorated with @hook('name') is run under cProfile
+when its hook is on, and the profile is written to PROFILE_DIR as
+<name>_<host>_<pid>_<UTC time>.prof, for pstats or snakeviz. Hooks named in
+the setting PROFILE_HOOKS are on from the start, and a process that has
+called install() switches all its hooks on with SIGUSR2, or all of them off
+if any are on:
+    kill -USR2 <pid>
+A function that runs for a long time, like run_ingest, calls
+checkpoint('name') in its loop. This starts the profile if the hook was
+switched on after the function started, writes a snapshot every
+PROFILE_SNAPSHOT seconds, and writes the last one when the hook is switched
+off. Only one profile runs at a time in a process.
+
+Tracing: ingest starts a trace for a fraction TRACE_FRACTION of the alerts,
+a list of [event, unix time] carried in the Kafka header lasair_trace. Each
+stage adds its events with mark, and passes the trace on with headers when it
+produces the alert. The filter ends the trace with finish, which logs it and
+puts the time between each pair of events into the histogram
+lasair_trace_seconds.
+"""
+
+import os
+import json
+import time
+import random
+import signal
+import socket
+import cProfile
+import tempfile
+import datetime
+import functools
+import metrics
+
+try:
+    import settings
+except ImportError:
+    settings = None
+
+# where the profiles are written
+PROFILE_DIR = getattr(settings, 'PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'lasair_profiles'))
+
+# hooks that are on when the process starts, e.g. ['kafka_consume', 'run_queries']
+PROFILE_HOOKS = getattr(settings, 'PROFILE_HOOKS', [])
+
+# seconds between the snapshots of a long running function
+PROFILE_SNAPSHOT = getattr(settings, 'PROFILE_SNAPSHOT', 300)
+
+# fraction of the alerts that ingest traces, 0 for none
+TRACE_FRACTION = getattr(settings, 'TRACE_FRACTION', 0.0)
+
+TRACE_HEADER = 'lasair_trace'
+
+TRACE_SECONDS = metrics.histogram('lasair_trace_seconds',
+    'Time between two events in the trace of an alert', ('step',))
+
+# all: every hook is on; hooks: the hooks that are on otherwise; name and profile: the profile running
+state = {'all': False, 'hooks': set(PROFILE_HOOKS), 'name': None, 'profile': None, 'started': 0.0}
+
+def is_on(name):
+    return state['all'] or name in state['hooks']
+
+def switch(signum=None, frame=None):
+    """ switch.
+        Switches all the hooks on, or all off if any are on; the handler for SIGUSR2
+    """
+    if state['all'] or state['hooks']:
+        state['all'] = False
+        state['hooks'] = set()
+    else:
+        state['all'] = True
+
+def install(signum=signal.SIGUSR2):
+    """ install.
+        Lets the hooks of this process be switched on and off with a signal.
+        Must be called from the main thread.
+    """
+    signal.signal(signum, switch)
+
+def start(name):
+    state['name'] = name
+    state['profile'] = cProfile.Profile()
+    state['started'] = time.time()
+    state['profile'].enable()
+
+def stop():
+    """ stop.
+        Stops the profile and writes it, returning the file name, or None if it cannot be written
+    """
+    profile = state['profile']
+    profile.disable()
+    name = state['name']
+    state['name'] = state['profile'] = None
+    utc = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+    filename = os.path.join(PROFILE_DIR, '%s_%s_%d_%s.prof' % (name, socket.gethostname(), os.getpid(), utc))
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile.dump_stats(filename)
+        return filename
+    except OSError:
+        return None
+
+def hook(name):
+    """ hook.
+        Decorator that profiles the function while the hook of that name is on
+        Args:
+            name: name of the hook, usually that of the function
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if state['profile'] is not None or not is_on(name):
+                return function(*args, **kwargs)
+            start(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if state['name'] == name:
+                    stop()
+        return wrapper
+    return decorator
+
+def checkpoint(name):
+    """ checkpoint.
+        Called in the loop of a long running hooked function, to start,
+        snapshot or stop its profile as the hook is switched on and off
+        Args:
+            name: name of the hook
+    """
+    if state['profile'] is None:
+        if is_on(name):
+            start(name)
+    elif state['name'] == name:
+        if not is_on(name):
+            stop()
+        elif time.time() - state['started'] > PROFILE_SNAPSHOT:
+            stop()
+            start(name)
+
+def begin(kafka_timestamp=None):
+    """ begin.
+        Starts the trace of an alert for a fraction TRACE_FRACTION of the calls, else None
+        Args:
+            kafka_timestamp: the (type, milliseconds) timestamp of the Kafka
+                message the alert came in, which becomes the first event
+    """
+    if TRACE_FRACTION <= 0 or random.random() >= TRACE_FRACTION:
+        return None
+    trace = []
+    if kafka_timestamp and kafka_timestamp[0] != 0 and kafka_timestamp[1] > 0:
+        trace.append(['kafka', kafka_timestamp[1] / 1000.0])
+    return trace
+
+def read(headers):
+    """ read.
+        The trace in the headers of a Kafka message, or None if it is not traced
+        Args:
+            headers: msg.headers(), a list of (key, bytes) or None
+    """
+    for (key, value) in headers or []:
+        if key == TRACE_HEADER:
+            try:
+                return json.loads(value)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+def mark(trace, event):
+    """ mark.
+        Adds an event at the time now to a trace, if there is one
+    """
+    if trace is not None:
+        trace.append([event, time.time()])
+
+def headers(trace):
+    """ headers.
+        Kafka headers to produce with the alert, carrying its trace
+    """
+    if trace is None:
+        return None
+    return [(TRACE_HEADER, json.dumps(trace).encode())]
+
+def finish(trace, log=None, name=''):
+    """ finish.
+        Ends a trace: the time between each pair of events goes in the
+        lasair_trace_seconds histogram, and the trace is logged
+        Args:
+            trace: list of [event, unix time]
+            log: logger, if the trace should be logged
+            name: of the alert, for the log
+    """
+    steps = []
+    for ((event0, t0), (event1, t1)) in zip(trace, trace[1:]):
+        step = '%s_to_%s' % (event0, event1)
+        TRACE_SECONDS.observe(max(0.0, t1 - t0), step=step)
+        steps.append('%s %.3f' % (step, t1 - t0))
+    if log and trace:
+        log.info('TRACE %s %.3f seconds: %s' % (name, trace[-1][1] - trace[0][1], ', '.join(steps)))
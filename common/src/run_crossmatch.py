@@ -2,7 +2,7 @@ import sys
 sys.path.append('../common')
 import math
 import settings
-from src import db_connect
+from src import db_connect, hit_summary
 from gkhtm import _gkhtm as htmCircle
 
 def distance(ra1, de1, ra2, de2):
@@ -26,6 +26,7 @@ def run_crossmatch(msl, radius, wl_id):
     for row in cursor:
         n_cones += 1
         n_hits += crossmatch(msl, wl_id, row['cone_id'], row['ra'], row['decl'], row['name'], radius)
+    hit_summary.rebuild(msl, 'watchlist', [wl_id])
     print("%d cones, %d hits" % (n_cones, n_hits))
     return n_hits
 
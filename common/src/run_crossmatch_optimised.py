@@ -1,120 +1,186 @@
-import math
+"""
+run_crossmatch_optimised.py
+Match a watchlist against the whole history of objects, replacing its hits.
+The cones are held in memory, sorted by RA within declination zones as tall as
+the largest cone radius, so the cones near an object are found with a binary
+search in three zones. The objects table is read once, streamed a chunk at a
+time, and each chunk is matched with numpy. The hits are then swapped in with
+multi-row inserts in one transaction.
+"""
 import sys
+import time
+import numpy as np
 sys.path.append('../../common')
-import settings
 
-def run_crossmatch(msl, radius, wl_id, batchSize=5000, wlMax=False):
-    """ Delete all the hits and remake.
-    """
+OBJECT_CHUNK = 100000   # objects fetched and matched at a time
+INSERT_CHUNK = 10000    # rows in each multi-row insert of hits
+
+# each cone is in the index at ra, ra+360 and ra+720 within its zone,
+# so a search box centred on ra+360 never has to wrap
+ZONE_WIDTH = 1080.0
 
-    from HMpTy.mysql import conesearch
-    from fundamentals.logs import emptyLogger
-    from fundamentals.mysql import database, readquery, writequery, insert_list_of_dictionaries_into_database_tables
-
-    dbSettings = {
-        'host': settings.DB_HOST,
-        'user': settings.DB_USER_READWRITE,
-        'port': settings.DB_PORT,
-        'password': settings.DB_PASS_READWRITE,
-        'db': 'ztf'
-    }
-    dbConn = database(
-        log=emptyLogger(),
-        dbSettings=dbSettings
-    ).connect()
-
-    # GRAB ALL SOURCES IN THE WATCHLIST
-    sqlQuery = f"""
-        SELECT cone_id, ra,decl, name FROM watchlist_cones WHERE wl_id={wl_id}
+
+class ConeIndex():
+    """ ConeIndex.
+        The cones of a watchlist, sorted for matching many positions at once
+        Args:
+            ra, de: cone centres in degrees
+            radius: cone radii in arcsec
+    """
+    def __init__(self, ra, de, radius):
+        ra = np.asarray(ra, dtype=float) % 360.0
+        de = np.asarray(de, dtype=float)
+        self.radius = np.asarray(radius, dtype=float)
+        self.height = max(self.radius.max() / 3600.0, 1.0 / 3600.0) if len(ra) else 1.0
+        n = len(ra)
+        zone = np.floor((de + 90.0) / self.height)
+        key = np.concatenate([zone * ZONE_WIDTH + ra + shift for shift in (0.0, 360.0, 720.0)])
+        cone = np.concatenate([np.arange(n)] * 3)
+        order = np.argsort(key, kind='stable')
+        self.key = key[order]
+        self.cone = cone[order]
+        self.ra = ra
+        self.de = de
+
+    def match(self, ra, de):
+        """ match.
+            All the cones that contain each position
+            Args:
+                ra, de: numpy arrays of positions in degrees
+            Returns:
+                (index of position, index of cone, separation in arcsec) as numpy arrays
+        """
+        ra = np.asarray(ra, dtype=float) % 360.0
+        de = np.asarray(de, dtype=float)
+        zone = np.floor((de + 90.0) / self.height)
+        # half width in RA of the search box, the whole circle near the poles
+        top = np.minimum(np.abs(de) + self.height, 90.0)
+        with np.errstate(divide='ignore'):
+            alpha = np.where(top < 89.0, self.height / np.cos(np.radians(top)), 180.0)
+        alpha = np.minimum(alpha, 180.0)
+
+        ipos = []
+        icone = []
+        for dz in (-1, 0, 1):
+            centre = (zone + dz) * ZONE_WIDTH + ra + 360.0
+            lo = np.searchsorted(self.key, centre - alpha, 'left')
+            hi = np.searchsorted(self.key, centre + alpha, 'left')
+            n = hi - lo
+            total = n.sum()
+            if total == 0:
+                continue
+            offsets = np.cumsum(n) - n
+            ipos.append(np.repeat(np.arange(len(ra)), n))
+            icone.append(self.cone[np.arange(total) - np.repeat(offsets, n) + np.repeat(lo, n)])
+        if not ipos:
+            empty = np.zeros(0, dtype=int)
+            return empty, empty, np.zeros(0)
+        ipos = np.concatenate(ipos)
+        icone = np.concatenate(icone)
+
+        arcsec = 3600 * angular_separation(ra[ipos], de[ipos], self.ra[icone], self.de[icone])
+        keep = arcsec < self.radius[icone]
+        return ipos[keep], icone[keep], arcsec[keep]
+
+
+def angular_separation(ra1, de1, ra2, de2):
+    """ Great circle distance in degrees, by the haversine formula """
+    ra1, de1, ra2, de2 = map(np.radians, (ra1, de1, ra2, de2))
+    s = np.sin((de2 - de1) / 2)**2 + np.cos(de1) * np.cos(de2) * np.sin((ra2 - ra1) / 2)**2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.minimum(s, 1.0))))
+
+
+def match_objects(index, batchSize=OBJECT_CHUNK, progress=None):
+    """ match_objects.
+        Reads the objects table once, limited to the declination band of the
+        cones, and matches it against them a chunk at a time
+        Args:
+            index: ConeIndex of the cones
+            batchSize: objects fetched and matched at a time
+            progress: called with (objects done, estimated total objects) after each chunk
+        Returns:
+            list of (objectId, index of cone, separation in arcsec)
     """
-    wlCones = readquery(
-        log=emptyLogger(),
-        sqlQuery=sqlQuery,
-        dbConn=dbConn
-    )
-    # WATCHLIST COUNT
-    n_cones = len(wlCones)
+    from src import db_connect
+    margin = index.height
+    demin = max(-90.0, float(index.de.min()) - margin)
+    demax = min(90.0, float(index.de.max()) + margin)
+
+    # a separate connection, as the rows are streamed
+    msl_read = db_connect.readonly()
+    cursor = msl_read.cursor(buffered=True)
+    # the row count from the table statistics is enough for progress
+    cursor.execute("SELECT table_rows FROM information_schema.tables WHERE table_schema='ztf' AND table_name='objects'")
+    row = cursor.fetchone()
+    total = int(row[0]) if row and row[0] else 0
+    cursor.close()
+
+    stream = msl_read.cursor(buffered=False)
+    stream.execute('SELECT objectId, ramean, decmean FROM objects WHERE decmean BETWEEN %s AND %s',
+                   (demin, demax))
+    matches = []
+    done = 0
+    while True:
+        rows = stream.fetchmany(batchSize)
+        if not rows:
+            break
+        objectIds, ras, des = zip(*rows)
+        ipos, icone, arcsec = index.match(np.array(ras, dtype=float), np.array(des, dtype=float))
+        for i, j, d in zip(ipos.tolist(), icone.tolist(), arcsec.tolist()):
+            matches.append((objectIds[i], j, d))
+        done += len(rows)
+        if progress:
+            progress(done, max(total, done))
+    stream.close()
+    msl_read.close()
+    return matches
+
+
+def run_crossmatch(msl, radius, wl_id, batchSize=OBJECT_CHUNK, wlMax=False, progress=None):
+    """ Delete all the hits and remake.
+        Args:
+            msl: read-write database connection, used for the hits
+            radius: default radius of the watchlist in arcsec, for cones without their own
+            wl_id: the watchlist
+            batchSize: objects fetched and matched at a time
+            wlMax: refuse watchlists with more cones than this
+            progress: called with (objects done, estimated total objects) after each chunk
+        Returns:
+            (number of hits, message), or (-1, message) if the watchlist is too big
+    """
+    from src import hit_summary
+    t = time.time()
+    cursor = msl.cursor(buffered=True, dictionary=True)
+    cursor.execute('SELECT cone_id, ra, decl, radius, name FROM watchlist_cones WHERE wl_id=%s', (wl_id,))
+    cones = cursor.fetchall()
+    n_cones = len(cones)
 
     if wlMax and n_cones > wlMax:
         return -1, f"A full watchlist match can only be run for watchlists with less than {wlMax} objects."
 
-    # TRASH PREVIOUS MATCHES
-    sqlQuery = f"""DELETE FROM watchlist_hits WHERE wl_id={wl_id}"""
-    writequery(
-        log=emptyLogger(),
-        sqlQuery=sqlQuery,
-        dbConn=dbConn
-    )
-
-    total = len(wlCones[1:])
-    batches = int(total / batchSize)
-
-    start = 0
-    end = 0
-    theseBatches = []
-    for i in range(batches + 1):
-        end = end + batchSize
-        start = i * batchSize
-        thisBatch = wlCones[start:end]
-        theseBatches.append(thisBatch)
-
-    n_hits = 0
-    wlMatches = []
-    for batch in theseBatches:
-        # DO THE CONESEARCH
-        raList, decList, nameList, coneIdList = zip(*[(s["ra"], s["decl"], s["name"], s["cone_id"]) for s in batch])
-        cs = conesearch(
-            log=emptyLogger(),
-            dbConn=dbConn,
-            tableName="objects",
-            columns="objectId",
-            ra=raList,
-            dec=decList,
-            raCol="ramean",
-            decCol="decmean",
-            radiusArcsec=radius,
-            separations=True,
-            distinct=False,
-            sqlWhere="",
-            closest=False,
-            htmColumns="htm16"
-        )
-        matchIndies, matches = cs.search()
-
-        if len(matchIndies):
-            n_hits += len(matchIndies)
-
-            # ADD IN ORIGINAL DATA TO LIST OF MATCHES
-            raList, decList, nameList, coneIdList = zip(*[(raList[i], decList[i], nameList[i], coneIdList[i]) for i in matchIndies])
-            # VALUES TO ADD TO DB
-
-            for r, d, n, c, m in zip(raList, decList, nameList, coneIdList, matches.list):
-                keepDict = {
-                    "wl_id": wl_id,
-                    "cone_id": c,
-                    "arcsec": m["cmSepArcsec"],
-                    "name": n,
-                    "objectId": m["objectId"]
-                }
-                wlMatches.append(keepDict)
-
-            # tableData = matches.table(filepath=None)
-            # print(tableData)
-
-    if len(wlMatches):
-        # USE dbSettings TO ACTIVATE MULTIPROCESSING - INSERT LIST OF DICTIONARIES INTO DATABASE
-        insert_list_of_dictionaries_into_database_tables(
-            dbConn=dbConn,
-            log=emptyLogger(),
-            dictList=wlMatches,
-            dbTableName="watchlist_hits",
-            dateCreated=False,
-            batchSize=200000,
-            dbSettings=dbSettings
-        )
-
+    hits = []
+    if n_cones:
+        index = ConeIndex(
+            [c['ra'] for c in cones],
+            [c['decl'] for c in cones],
+            [c['radius'] or radius for c in cones])
+        for (objectId, j, d) in match_objects(index, batchSize, progress):
+            c = cones[j]
+            hits.append((wl_id, c['cone_id'], objectId, d, c['name']))
+
+    # swap the hits in one transaction, so the watchlist is never seen without them
+    cursor.execute('DELETE FROM watchlist_hits WHERE wl_id=%s', (wl_id,))
+    # REPLACE as the filter may add a hit for a new alert meanwhile
+    query = 'REPLACE INTO watchlist_hits (wl_id, cone_id, objectId, arcsec, name) VALUES (%s, %s, %s, %s, %s)'
+    for i in range(0, len(hits), INSERT_CHUNK):
+        cursor.executemany(query, hits[i:i + INSERT_CHUNK])
+    msl.commit()
+    cursor.close()
+    hit_summary.rebuild(msl, 'watchlist', [wl_id])
+
+    n_hits = len(hits)
     message = f"{n_hits} ZTF objects have been associated with the {n_cones} sources in this watchlist"
-    print(message)
+    print('%s in %.1f seconds' % (message, time.time() - t))
     return n_hits, message
 
 
@@ -122,10 +188,10 @@ if __name__ == "__main__":
     try:
         wl_id = int(sys.argv[1])
     except:
-        print('Usage: python3 run_crossmatch.py wl_id')
+        print('Usage: python3 run_crossmatch_optimised.py wl_id')
         sys.exit()
     radius = 3  # arcseconds
 
-    # SETUP ALL DATABASE CONNECTIONS
-
-    run_crossmatch(None, radius, wl_id)
+    from src import db_connect
+    msl = db_connect.remote()
+    run_crossmatch(msl, radius, wl_id)
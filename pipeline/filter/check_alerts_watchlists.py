@@ -22,7 +22,7 @@ try:
     sys.path.append('../../common')
     import settings
     sys.path.append('../../common/src')
-    import lasairLogging, db_connect
+    import lasairLogging, db_connect, profiling
 except:
     pass
 
@@ -216,6 +216,7 @@ def fetch_alerts(msl):
         delist.append (row['decmean'])
     return {"obj":objlist, "ra":ralist, "de":delist}
 
+@profiling.hook('get_watchlist_hits')
 def get_watchlist_hits(msl, cache_dir, chunk_size):
     """get_watchlist_hits:
     Get all the alerts, then run against the watchlists, return the hits
@@ -7,8 +7,8 @@ from src import date_nid, slack_webhook, db_connect
 import settings
 
 sys.path.append('../../common/src')
-import lasairLogging
-from manage_status import manage_status
+import lasairLogging, metrics, profiling
+from manage_status import status_for
 
 from multiprocessing import Process, Manager
 from features_ZTF import insert_query
@@ -116,11 +116,13 @@ def alert_filter(alert, msl):
                 execute_query(query, msl)
     return {'ss':iq_dict['ss'], 'nalert_out':1}
 
-def kafka_consume(consumer, maxalert):
+@profiling.hook('kafka_consume')
+def kafka_consume(consumer, maxalert, traces=None):
     """ kafka_consume: consume maxalert alerts from the consumer
         Args:
             consumer: confluent_kafka Consumer
             maxalert: how many to consume
+            traces: if given, a list to which the (objectId, trace) of the traced alerts are added
     """
     log = lasairLogging.getLogger("filter")
 
@@ -153,6 +155,10 @@ def kafka_consume(consumer, maxalert):
         # Apply filter to each alert
         alert = json.loads(msg.value())
         nalert_in += 1
+        trace = profiling.read(msg.headers())
+        if trace is not None and traces is not None:
+            profiling.mark(trace, 'filter_in')
+            traces.append((alert.get('objectId'), trace))
         try:
             d = alert_filter(alert, msl)
             nalert_out += d['nalert_out']
@@ -170,7 +176,11 @@ def kafka_consume(consumer, maxalert):
 
     log.info('Finished %d in, %d out, %d solar system' % (nalert_in, nalert_out, nalert_ss))
 
-    ms = manage_status(settings.SYSTEM_STATUS)
+    metrics.ALERTS.inc(nalert_in, stage='filter')
+    metrics.ALERTS.inc(nalert_out, stage='filter_out')
+    metrics.ALERTS.inc(nalert_ss, stage='filter_ss')
+
+    ms = status_for(settings, db_connect.remote)
     nid  = date_nid.nid_now()
     ms.add({
         'today_filter':nalert_in, 
@@ -33,7 +33,10 @@ sys.path.append('../../common')
 import settings
 
 sys.path.append('../../common/src')
-import date_nid, db_connect, manage_status, lasairLogging
+import date_nid, db_connect, manage_status, lasairLogging, hit_summary, metrics, profiling
+
+BATCH_LAG = metrics.gauge('lasair_alert_batch_lag',
+    'Lasair alert batch lag stats, seconds since the telescope', ('type',))
 
 def run_filter(args):
 
@@ -83,7 +86,9 @@ def run_filter(args):
         log.error('ERROR cannot connect to kafka: %s' % str(e))
         return
 
-    rc = kafka_consume(consumer, maxalert)
+    # the alerts traced from ingest, which end when the batch is committed
+    traces = []
+    rc = kafka_consume(consumer, maxalert, traces)
 
     # rc is the return code from ingestion, number of alerts received
     if rc < 0:
@@ -91,6 +96,8 @@ def run_filter(args):
         sys.exit(0)
     
     log.info('FILTER duration %.1f seconds' % (time.time() - t))
+    metrics.STAGE_SECONDS.observe(time.time() - t, stage='filter_consume')
+    metrics.kafka_lag(consumer, 'filter')
     
     try:
         msl_local = db_connect.local()
@@ -98,6 +105,14 @@ def run_filter(args):
         log.error('ERROR in filter/filter: cannot connect to local database')
         sys.exit(0)
     
+    # hits of this batch not yet in the main database, for the hit summaries
+    new_hits = {'watchlist': [], 'area': []}
+    try:
+        msl_main = db_connect.remote()
+    except:
+        log.error('ERROR in filter/filter: cannot connect to main database')
+        sys.exit(0)
+
     ##### run the watchlists
     log.info('WATCHLIST start %s' % datetime.utcnow().strftime("%H:%M:%S"))
     t = time.time()
@@ -115,8 +130,13 @@ def run_filter(args):
         except Exception as e:
             log.error("ERROR in filter/insert_watchlist_hits: %s" % str(e))
             sys.exit(0)
+        try:
+            new_hits['watchlist'] = hit_summary.new_hits(msl_main, 'watchlist', hits)
+        except Exception as e:
+            log.error("ERROR in filter/hit_summary.new_hits: %s" % str(e))
     
     log.info('WATCHLIST %.1f seconds' % (time.time() - t))
+    metrics.STAGE_SECONDS.observe(time.time() - t, stage='filter_watchlist')
     
     ##### run the areas
     log.info('AREA start %s' % datetime.utcnow().strftime("%H:%M:%S"))
@@ -134,7 +154,12 @@ def run_filter(args):
         except Exception as e:
             log.error("ERROR in filter/insert_area_hits: %s" % str(e))
             sys.exit(0)
+        try:
+            new_hits['area'] = hit_summary.new_hits(msl_main, 'area', hits)
+        except Exception as e:
+            log.error("ERROR in filter/hit_summary.new_hits: %s" % str(e))
     log.info('AREA %.1f seconds' % (time.time() - t))
+    metrics.STAGE_SECONDS.observe(time.time() - t, stage='filter_area')
     
     ##### run the user queries
     log.info('QUERIES start %s' % datetime.utcnow().strftime("%H:%M:%S"))
@@ -151,6 +176,7 @@ def run_filter(args):
         log.error("ERROR in filter/run_active_queries.run_queries: %s" % str(e))
         sys.exit(0)
     log.info('QUERIES %.1f seconds' % (time.time() - t))
+    metrics.STAGE_SECONDS.observe(time.time() - t, stage='filter_queries')
     
     ##### run the annotation queries
     log.info('ANNOTATION QUERIES start %s' % datetime.utcnow().strftime("%H:%M:%S"))
@@ -160,6 +186,7 @@ def run_filter(args):
     except Exception as e:
         log.warning("WARNING in filter/run_active_queries.run_annotation_queries: %s" % str(e))
     log.info('ANNOTATION QUERIES %.1f seconds' % (time.time() - t))
+    metrics.STAGE_SECONDS.observe(time.time() - t, stage='filter_annotation_queries')
     
     ##### build CSV file with local database
     t = time.time()
@@ -173,6 +200,7 @@ def run_filter(args):
         sys.exit(0)
     
     tablelist = ['objects', 'sherlock_classifications', 'watchlist_hits', 'area_hits']
+    metrics.STAGE_SECONDS.observe(time.time() - t, stage='filter_csv')
     
     ##### send CSV file to central database
     t = time.time()
@@ -196,20 +224,34 @@ def run_filter(args):
             commit = False
         else:
             log.info('%s table ingested to main db' % table)
+            # once the hits are in, they are summarised whether or not the batch
+            # is run again, as new_hits will then find them already there
+            kind = {'watchlist_hits': 'watchlist', 'area_hits': 'area'}.get(table)
+            if kind and new_hits[kind]:
+                try:
+                    hit_summary.add_hits(msl_main, kind, new_hits[kind])
+                except Exception as e:
+                    log.error("ERROR in filter/hit_summary.add_hits: %s" % str(e))
 
     log.info('Transfer to main database %.1f seconds' % (time.time() - t))
+    metrics.STAGE_SECONDS.observe(time.time() - t, stage='filter_transfer')
+    ms = manage_status.status_for(settings, db_connect.remote)
+    nid = date_nid.nid_now()
     if commit:
         consumer.commit()
         consumer.close()
         log.info('Kafka committed for this batch')
+        # the web query cache is keyed on this, so cached results never predate the batch
+        ms.set({'filter_commit': time.time()}, nid)
+        for (objectId, trace) in traces:
+            profiling.mark(trace, 'filter_done')
+            profiling.finish(trace, log, objectId)
     else:
         log.info('ERROR: No kafka commit')
         consumer.close()
         time.sleep(600)
         sys.exit(1)
 
-    ms = manage_status.manage_status(settings.SYSTEM_STATUS)
-    nid = date_nid.nid_now()
     d = batch_statistics()
     ms.set({
         'today_ztf':grafana_today(), 
@@ -218,25 +260,14 @@ def run_filter(args):
         'min_delay': '%.1f' % d['since'],  # hours since most recent alert
         'nid': nid}, 
         nid)
-    if rc > 0:  # minutes since telescope got it
-
-        min_str = "{:d}".format(int(d['min_delay']*60))
-        avg_str = "{:d}".format(int(d['avg_delay']*60))
-        max_str = "{:d}".format(int(d['max_delay']*60))
-    else:
-        min_str = "NaN"
-        avg_str = "NaN"
-        max_str = "NaN"
-    #t = int(1000*time.time())
-    s  = '#HELP lasair_alert_batch_lag Lasair alert batch lag stats\n'
-    s += '#TYPE gauge\n'
-    s += 'lasair_alert_batch_lag{type="min"} %s\n' % min_str
-    s += 'lasair_alert_batch_lag{type="avg"} %s\n' % avg_str
-    s += 'lasair_alert_batch_lag{type="max"} %s\n' % max_str
-    f = open('/var/lib/prometheus/node-exporter/lasair.prom', 'w')
-    f.write(s)
-    f.close()
-    log.info('\n' + s)
+    for stat in ['min', 'avg', 'max']:
+        if rc > 0:  # seconds since telescope got it
+            BATCH_LAG.set(int(d['%s_delay' % stat]*60), type=stat)
+        else:
+            BATCH_LAG.set(float('nan'), type=stat)
+    # the same file as the batch lag has always been written to
+    metrics.write('lasair')
+    log.info('\n' + metrics.exposition())
     time.sleep(30)
 
     log.info('Return status %d' % rc)
@@ -248,6 +279,7 @@ if __name__ == '__main__':
     log = lasairLogging.getLogger("filter")
 
     args = docopt(__doc__)
+    profiling.install()
     # rc=1: got some alerts
     # rc=0: got no alerts
 
@@ -31,7 +31,7 @@ from datetime import datetime
 
 from subprocess import Popen, PIPE, STDOUT
 sys.path.append('../../common/src')
-import slack_webhook, lasairLogging
+import slack_webhook, lasairLogging, profiling
 
 # if this is True, the runner stops when it can and exits
 stop = False
@@ -42,6 +42,7 @@ def sigterm_handler(signum, frame):
     stop = True
 
 signal.signal(signal.SIGTERM, sigterm_handler)
+profiling.install()
 
 def now():
     # current UTC as string
@@ -44,7 +44,10 @@ sys.path.append('../../common')
 import settings
 
 sys.path.append('../../common/src')
-import db_connect, lasairLogging
+import db_connect, lasairLogging, metrics, profiling
+
+QUERY_SECONDS = metrics.histogram('lasair_query_seconds',
+    'Time to run a streaming filter on a batch, or on one annotated object', ('topic',))
 
 def fetch_queries():
     """fetch_queries.
@@ -101,6 +104,7 @@ def run_annotation_queries(query_list):
     #print('got ', annotation_list)
     run_queries(query_list, annotation_list)
 
+@profiling.hook('run_queries')
 def run_queries(query_list, annotation_list=None):
     """
     When annotation_list is None, it runs all the queries against the local database
@@ -118,14 +122,16 @@ def run_queries(query_list, annotation_list=None):
 
         # normal case of streaming queries
         if annotation_list == None:  
-            query_results = run_query(query, msl_local)
+            with QUERY_SECONDS.time(topic=query['topic_name']):
+                query_results = run_query(query, msl_local)
             n += dispose_query_results(query, query_results)
 
         # immediate response to active=2 annotators
         else:
             for ann in annotation_list:  
                 msl_remote = db_connect.remote()
-                query_results = run_query(query, msl_remote, ann['annotator'], ann['objectId'])
+                with QUERY_SECONDS.time(topic=query['topic_name']):
+                    query_results = run_query(query, msl_remote, ann['annotator'], ann['objectId'])
                 n += dispose_query_results(query, query_results)
 
         t = time.time() - t
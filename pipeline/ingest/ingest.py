@@ -30,7 +30,10 @@ sys.path.append('../../common')
 import settings
 
 sys.path.append('../../common/src')
-import objectStore, manage_status, date_nid, slack_webhook, lasairLogging
+import objectStore, manage_status, date_nid, slack_webhook, lasairLogging, db_connect, metrics, profiling
+
+CASSANDRA_WRITE_SECONDS = metrics.histogram('lasair_cassandra_write_seconds',
+    'Time to write the rows of one alert to a Cassandra table', ('table',))
 
 stop = False
 log = None
@@ -139,17 +142,20 @@ def insert_cassandra(alert, cassandra_session):
         for i in range(len(detectionCandlist)):
             detectionCandlist[i]['htmid16'] = htm16s[i]
 
-        executeLoad(cassandra_session, 'candidates', detectionCandlist)
+        with CASSANDRA_WRITE_SECONDS.time(table='candidates'):
+            executeLoad(cassandra_session, 'candidates', detectionCandlist)
 
     if len(nondetectionCandlist) > 0:
-        executeLoad(cassandra_session, 'noncandidates', nondetectionCandlist)
+        with CASSANDRA_WRITE_SECONDS.time(table='noncandidates'):
+            executeLoad(cassandra_session, 'noncandidates', nondetectionCandlist)
 
     if len(fplist) > 0:
-        executeLoad(cassandra_session, 'forcedphot', fplist)
+        with CASSANDRA_WRITE_SECONDS.time(table='forcedphot'):
+            executeLoad(cassandra_session, 'forcedphot', fplist)
 
     return (len(detectionCandlist), len(nondetectionCandlist), len(fplist))
 
-def handle_alert(alert, image_store, producer, topic_out, cassandra_session):
+def handle_alert(alert, image_store, producer, topic_out, cassandra_session, trace=None):
     """handle_alert.
     Filter to apply to each alert.
        See schemas: https://github.com/ZwickyTransientFacility/ztf-avro-alert
@@ -160,6 +166,7 @@ def handle_alert(alert, image_store, producer, topic_out, cassandra_session):
         producer:
         topic_out:
         cassandra_session
+        trace: the trace of the alert from profiling.begin, or None
     """
     global log
     # here is the part of the alert that has no binary images
@@ -195,7 +202,11 @@ def handle_alert(alert, image_store, producer, topic_out, cassandra_session):
     if producer is not None:
         try:
             s = json.dumps(alert_noimages)
-            producer.produce(topic_out, json.dumps(alert_noimages))
+            if trace is None:
+                producer.produce(topic_out, s)
+            else:
+                profiling.mark(trace, 'ingest_out')
+                producer.produce(topic_out, s, headers=profiling.headers(trace))
         except Exception as e:
             log.error("ERROR in ingest/ingest: Kafka production failed for %s" % topic_out)
             log.error(str(e))
@@ -203,6 +214,7 @@ def handle_alert(alert, image_store, producer, topic_out, cassandra_session):
             return (0,0,0)   # ingest failed
     return (ncandidate, nnoncandidate, nforcedphot)
 
+@profiling.hook('run_ingest')
 def run_ingest(args):
     """run.
     """
@@ -214,6 +226,7 @@ def run_ingest(args):
         log = lasairLogging.getLogger("ingest")
 
     signal.signal(signal.SIGTERM, sigterm_handler)
+    profiling.install()
 
     if args['--topic_in']:
         topic_in = args['--topic_in']
@@ -311,7 +324,7 @@ def run_ingest(args):
     log.info('INGEST starts %s' % now())
 
     # put status on Lasair web page
-    ms = manage_status.manage_status(settings.SYSTEM_STATUS)
+    ms = manage_status.status_for(settings, db_connect.remote)
 
     while ntotalalert < maxalert:
 
@@ -333,6 +346,7 @@ def run_ingest(args):
             continue
 
         # read the avro contents
+        kafka_timestamp = msg.timestamp()
         try:
             bytes_io = io.BytesIO(msg.value())
             msg = fastavro.reader(bytes_io)
@@ -348,8 +362,11 @@ def run_ingest(args):
                 break
 
             # Apply filter to each alert
-            (icandidate, inoncandidate, iforcedphot) = \
-                handle_alert(alert, image_store, producer, topic_out, cassandra_session)
+            trace = profiling.begin(kafka_timestamp)
+            profiling.mark(trace, 'ingest_in')
+            with metrics.STAGE_SECONDS.time(stage='ingest_alert'):
+                (icandidate, inoncandidate, iforcedphot) = \
+                    handle_alert(alert, image_store, producer, topic_out, cassandra_session, trace)
 
             if ncandidate == None:
                 log.info('Ingestion failed ')
@@ -393,6 +410,7 @@ def end_batch(consumer, producer, ms, nalert, ncandidate, nnoncandidate, nforced
     now = datetime.now()
     date = now.strftime("%Y-%m-%d %H:%M:%S")
     log.info('%s %d alerts %d/%d/%d cand/noncand/fp' % (date, nalert, ncandidate, nnoncandidate, nforcedphot))
+    t = time.time()
     # if this is not flushed, it will run out of memory
     if producer is not None:
         producer.flush()
@@ -400,6 +418,11 @@ def end_batch(consumer, producer, ms, nalert, ncandidate, nnoncandidate, nforced
     # commit the alerts we have read
     consumer.commit()
     sys.stdout.flush()
+    metrics.STAGE_SECONDS.observe(time.time() - t, stage='ingest_commit')
+    metrics.ALERTS.inc(nalert, stage='ingest')
+    metrics.kafka_lag(consumer, 'ingest')
+    metrics.write('lasair_ingest', every=True)
+    profiling.checkpoint('run_ingest')
 
     # update the status page
     nid  = date_nid.nid_now()
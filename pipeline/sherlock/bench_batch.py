@@ -0,0 +1,77 @@
+"""Benchmark of Sherlock wrapper batch preparation time against batch size.
+
+Compares the old list-scan preparation of names/ra/dec with AlertBatch,
+on synthetic alerts where about a third of the names repeat and one in
+twenty alerts is a solar system alert. Needs the same environment as wrapper.py.
+
+Usage: python3 bench_batch.py [batch_size ...]
+"""
+import sys
+import time
+import random
+from wrapper import AlertBatch
+
+
+def make_alerts(n):
+    alerts = []
+    for i in range(n):
+        name = 'ZTF%09d' % random.randrange(int(n * 0.7) + 1)
+        ssnamenr = 'null' if random.random() > 0.05 else '%05d' % i
+        alerts.append({'objectId': name, 'candidate': {
+            'ra': random.uniform(0, 360), 'dec': random.uniform(-30, 90), 'ssnamenr': ssnamenr}})
+    return alerts
+
+
+def list_scan(alerts, annotations):
+    "batch preparation as done up to wrapper 0.6.7"
+    names = []
+    ra = []
+    dec = []
+    for alert in alerts:
+        name = alert.get('objectId', alert.get('candid'))
+        if alert['candidate'].get('ssnamenr', "null") != "null":
+            continue
+        if not name in annotations:
+            if not name in names:
+                names.append(name)
+                ra.append(alert['candidate']['ra'])
+                dec.append(alert['candidate']['dec'])
+    for alert in alerts:
+        name = alert.get('objectId', alert.get('candid'))
+        if name in annotations:
+            pass
+    return names
+
+
+def columnar(alerts, annotations):
+    batch = AlertBatch(alerts)
+    batch.mark_cached(annotations.keys())
+    names = [batch.names[row] for row in batch.to_classify()]
+    for i in range(len(alerts)):
+        if batch.names[batch.index[i]] in annotations:
+            pass
+    return names
+
+
+def timeit(func, alerts, annotations, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func(alerts, annotations)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 2000, 5000, 10000, 20000]
+    random.seed(1)
+    print('%8s %14s %14s' % ('batch', 'list scan ms', 'columnar ms'))
+    for n in sizes:
+        alerts = make_alerts(n)
+        # a tenth of the names come from the cache
+        annotations = {a['objectId']: {} for a in alerts[::10]}
+        assert sorted(list_scan(alerts, annotations)) == sorted(columnar(alerts, annotations))
+        print('%8d %14.2f %14.2f' % (n,
+            1000 * timeit(list_scan, alerts, annotations),
+            1000 * timeit(columnar, alerts, annotations)))
@@ -5,7 +5,7 @@ adds the Sherlock classification and crossmatches back into the alert and
 republishes on the output topic.
 """
 
-__version__ = "0.6.7"
+__version__ = "0.6.8"
 
 import warnings
 import json
@@ -19,6 +19,8 @@ from confluent_kafka import Consumer, Producer, KafkaError, KafkaException
 #from mock_sherlock import transient_classifier
 from sherlock import transient_classifier
 from pkg_resources import get_distribution
+import metrics
+import profiling
 
 # use custom info_ log level so we can print info messages for wrapper without having to do so for sherlock
 logging.INFO_ = 25
@@ -26,6 +28,9 @@ logging.addLevelName(logging.INFO_, "INFO_")
 
 sherlock_version = get_distribution("qub-sherlock").version
 
+# traces of the alerts in the batch that came with one, by id of the alert, for produce
+traces = {}
+
 def consume(conf, log, alerts, consumer):
     "fetch a batch of alerts from kafka, return number of alerts consumed"
 
@@ -51,6 +56,10 @@ def consume(conf, log, alerts, consumer):
                 #name = alert.get('objectId', alert.get('candid'))
                 #alerts[name] = alert
                 alerts.append(alert)
+                trace = profiling.read(msg.headers())
+                if trace is not None:
+                    profiling.mark(trace, 'sherlock_in')
+                    traces[id(alert)] = trace
                 n += 1
             else:
                 n_error += 1
@@ -69,13 +78,17 @@ def consume(conf, log, alerts, consumer):
                 else:
                     continue
         log.log(logging.INFO_, "consumed {:d} alerts".format(n))
+        metrics.ALERTS.inc(n, stage='sherlock')
+        metrics.kafka_lag(c, 'sherlock')
         if n > 0:
-            n_classified = classify(conf, log, alerts)
+            with metrics.STAGE_SECONDS.time(stage='sherlock_classify'):
+                n_classified = classify(conf, log, alerts)
             if n_classified != n:
                 # may be different due to SS alerts
                 #raise Exception("Failed to classify all alerts in batch: expected {}, got {}".format(n, n_classified))
                 logging.info("Classified {} of {} alerts".format(n_classified, n))
-            n_produced = produce(conf, log, alerts)
+            with metrics.STAGE_SECONDS.time(stage='sherlock_produce'):
+                n_produced = produce(conf, log, alerts)
             if n_produced != n:
                 raise Exception("Failed to produce all alerts in batch: expected {}, got {}".format(n, n_produced))
             c.commit(asynchronous=False)
@@ -95,6 +108,54 @@ def consume(conf, log, alerts, consumer):
     return n
 
 
+class AlertBatch:
+    """Columnar view of a batch of alerts, built in one pass.
+
+    Each distinct name gets one row in the name table, looked up through a
+    dict. `index[i]` is the row of alert i, so a result for a name is fanned
+    back out to every alert carrying it without rescanning the batch."""
+
+    def __init__(self, alerts):
+        self.alerts = alerts
+        self.row_of = {}      # name -> row in the name table
+        self.names = []       # per row
+        self.ra = []          # per row, from the first non-SS alert
+        self.dec = []         # per row
+        self.has_pos = []     # per row, some non-SS alert has this name
+        self.cached = []      # per row, annotation found in the cache
+        self.index = []       # per alert, row in the name table
+        self.ss = []          # per alert, solar system alert
+        for alert in alerts:
+            name = alert.get('objectId', alert.get('candid'))
+            row = self.row_of.get(name)
+            if row is None:
+                row = len(self.names)
+                self.row_of[name] = row
+                self.names.append(name)
+                self.ra.append(None)
+                self.dec.append(None)
+                self.has_pos.append(False)
+                self.cached.append(False)
+            ss = alert['candidate'].get('ssnamenr', "null") != "null"
+            self.index.append(row)
+            self.ss.append(ss)
+            if not ss and not self.has_pos[row]:
+                self.ra[row] = alert['candidate']['ra']
+                self.dec[row] = alert['candidate']['dec']
+                self.has_pos[row] = True
+
+    def mark_cached(self, names):
+        "flag the rows for names found in the cache"
+        for name in names:
+            row = self.row_of.get(name)
+            if row is not None:
+                self.cached[row] = True
+
+    def to_classify(self):
+        "rows that need Sherlock: not solar system only and not cached"
+        return [row for row in range(len(self.names)) if self.has_pos[row] and not self.cached[row]]
+
+
 def classify(conf, log, alerts):
     "send a batch of alerts to sherlock and add the responses to the alerts, return the number of alerts classified"
     
@@ -110,14 +171,13 @@ def classify(conf, log, alerts):
     except IOError as e:
         log.error(e)
 
+    # one pass over the alerts to build the name table
+    batch = AlertBatch(alerts)
+
     # look up objects in cache
     annotations = {}
     if conf['cache_db']:
-        names = []
-        for alert in alerts:
-            name = alert.get('objectId', alert.get('candid'))
-            names.append(name)
-        query = "SELECT * FROM cache WHERE name IN ('{}');".format("','".join(names))
+        query = "SELECT * FROM cache WHERE name IN ('{}');".format("','".join(batch.names))
         url = urlparse(conf['cache_db'])
         connection = pymysql.connect(
                 host=url.hostname,
@@ -148,23 +208,14 @@ def classify(conf, log, alerts):
             connection.close()
     if len(annotations)>0:
         log.info("got {:d} annotations from cache".format(len(annotations)))
+    batch.mark_cached(annotations.keys())
 
-    # make lists of names, ra, dec
-    names = []
-    ra = []
-    dec = []
-    for alert in alerts:
-        name = alert.get('objectId', alert.get('candid'))
-        # ignore SS alerts
-        ssnamenr = alert['candidate'].get('ssnamenr', "null")
-        if ssnamenr != "null":
-            log.debug("Skipping classification for solar system alert {}".format(name))
-            continue
-        if not name in annotations:
-            if not name in names:
-                names.append(name)
-                ra.append(alert['candidate']['ra'])
-                dec.append(alert['candidate']['dec'])
+    # make lists of names, ra, dec, ignoring SS alerts and cache hits
+    rows = batch.to_classify()
+    names = [batch.names[row] for row in rows]
+    ra = [batch.ra[row] for row in rows]
+    dec = [batch.dec[row] for row in rows]
+    log.debug("Skipping classification for {:d} solar system alerts".format(sum(batch.ss)))
 
     # set up sherlock
     classifier = transient_classifier(
@@ -243,8 +294,8 @@ def classify(conf, log, alerts):
 
     # add the annotations to the alerts
     n = 0
-    for alert in alerts:
-        name = alert.get('objectId', alert.get('candid'))
+    for i, alert in enumerate(alerts):
+        name = batch.names[batch.index[i]]
         if name in annotations:
             annotations[name]['annotator'] = "https://github.com/thespacedoctor/sherlock/releases/tag/v{}".format(sherlock_version)
             annotations[name]['additional_output'] = "http://lasair-ztf.lsst.ac.uk/api/sherlock/object/" + name
@@ -275,7 +326,12 @@ def produce(conf, log, alerts):
     try:
         while alerts:
             alert = alerts.pop(0)
-            p.produce(conf['output_topic'], value=json.dumps(alert))
+            trace = traces.pop(id(alert), None)
+            if trace is None:
+                p.produce(conf['output_topic'], value=json.dumps(alert))
+            else:
+                profiling.mark(trace, 'sherlock_out')
+                p.produce(conf['output_topic'], value=json.dumps(alert), headers=profiling.headers(trace))
             log.debug("produced output:\n{}".format(json.dumps(alert, indent=2)))
             n += 1
     finally:
@@ -304,6 +360,7 @@ def run(conf, log):
                 break
             batch += 1
             alerts = []
+            traces.clear()
             n = consume(conf, log, alerts, consumer)
             if n==0 and conf['stop_at_end']:
                 break
@@ -332,6 +389,7 @@ if __name__ == '__main__':
     parser.add_argument('--version', action='version', version='%(prog)s {}'.format(__version__))
     parser.add_argument('--poll_timeout', type=int, default=30, help='kafka consumer poll timeout in s') # see https://docs.confluent.io/platform/current/clients/confluent-kafka-python/html/index.html
     parser.add_argument('--max_poll_interval', type=int, default=300000, help='kafka max poll interval in ms') # see https://github.com/edenhill/librdkafka/blob/master/CONFIGURATION.md
+    parser.add_argument('--metrics_port', type=int, default=0, help='port to serve Prometheus metrics on') # 0 = don't serve
     conf = vars(parser.parse_args())
 
     # use config file if set
@@ -373,5 +431,8 @@ if __name__ == '__main__':
         log.error("output topic not set")
         sys.exit(2)
 
+    if conf.get('metrics_port'):
+        metrics.serve(conf['metrics_port'])
+
     run(conf, log)
 
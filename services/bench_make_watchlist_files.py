@@ -0,0 +1,67 @@
+"""Benchmark of building the watchlist MOC files.
+
+Before: one hexagon MOC per cone, unioned one at a time, as moc_watchlist did
+up to now; only run for the smaller watchlists as it is roughly quadratic.
+After: one vectorised cone MOC per chunk; then the whole rebuild, with the
+files written and the mocs made in a process pool of one per core,
+and the rebuild after one cone of the watchlist has moved. Synthetic
+watchlists of random cones with radii of a few arcsec. Needs mocpy and the
+same settings as the services, run from this directory.
+
+Usage: python3 bench_make_watchlist_files.py [ncones ...]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import make_watchlist_files as mwf
+
+MAX_DEPTH = 13
+CHUNK = 50000
+BEFORE_MAX = 10000
+
+
+def make_cones(n):
+    rng = np.random.default_rng(n)
+    return {
+        'cone_ids': list(range(n)),
+        'ra': rng.uniform(0, 360, n).tolist(),
+        'de': np.degrees(np.arcsin(rng.uniform(-1, 1, n))).tolist(),
+        'radius': (rng.uniform(1, 10, n) / 3600).tolist(),
+        'names': ['cone%d' % i for i in range(n)],
+    }
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [10000, 100000, 1000000]
+    processes = os.cpu_count()
+    mwf.logf = open(os.devnull, 'w')
+    print('%8s %12s %12s %14s %14s' % ('cones', 'before s', 'after s', 'rebuild s', 'one moved s'))
+    for n in sizes:
+        cones = make_cones(n)
+        if n <= BEFORE_MAX:
+            t = time.perf_counter()
+            for chunk in mwf.watchlist_chunks(cones, CHUNK):
+                mwf.moc_watchlist_polygons(chunk, MAX_DEPTH)
+            before = '%12.1f' % (time.perf_counter() - t)
+        else:
+            before = '%12s' % '-'
+
+        t = time.perf_counter()
+        mwf.moc_watchlists(cones, MAX_DEPTH, CHUNK)
+        after = time.perf_counter() - t
+
+        cache_dir = tempfile.mkdtemp()
+        t = time.perf_counter()
+        mwf.rebuild_caches([(1, 'bench', cones)], MAX_DEPTH, cache_dir, CHUNK, processes)
+        pool = time.perf_counter() - t
+
+        cones['ra'][n // 2] += 0.01
+        t = time.perf_counter()
+        mwf.rebuild_caches([(1, 'bench', cones)], MAX_DEPTH, cache_dir, CHUNK, processes)
+        moved = time.perf_counter() - t
+        shutil.rmtree(cache_dir)
+
+        print('%8d %s %12.1f %14.1f %14.1f' % (n, before, after, pool, moved))
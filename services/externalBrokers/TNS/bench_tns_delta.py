@@ -0,0 +1,161 @@
+"""Benchmark of the daily TNS update on a fixture delta of 5000 rows.
+
+The fixture is a zip in the format TNS sends, made in a temporary directory:
+a delta of which 40% are new names, 40% are changed, half of those moved,
+and 20% are the same as the stored catalogue of 150000 names. Before: the
+zip read whole into a string, then into a list of rows, and each row looked
+up by name. After: the CSV parsed as the zip is read, and the rows split
+into new, changed and moved with one dictionary of the stored rows. The time
+and the peak memory of each are reported. With --db, the lookup of the
+stored rows is also timed against crossmatch_tns in the database, which it
+only reads: one SELECT for each name as getTNSRow did, against one join with
+a temporary table of the names.
+
+Usage: python3 bench_tns_delta.py [--db] [nrows]
+"""
+import io
+import os
+import sys
+import csv
+import time
+import random
+import shutil
+import zipfile
+import datetime
+import tempfile
+import tracemalloc
+sys.path.append('../../../common')
+import tns_bulk
+import tns_delta
+from fetch_from_tns import read_csv
+
+NCATALOGUE = 150000
+DATE = '20260101'
+CSVFILE = 'tns_public_objects_%s.csv' % DATE
+HEADER = ['objid', 'name_prefix', 'name', 'ra', 'declination', 'redshift', 'typeid', 'type',
+          'reporting_groupid', 'reporting_group', 'source_groupid', 'source_group',
+          'discoverydate', 'discoverymag', 'discmagfilter', 'filter', 'reporters',
+          'time_received', 'internal_names', 'creationdate', 'lastmodified']
+
+
+def catalogue_row(i):
+    """ a stored row, as existing_rows returns it """
+    name = '2025%06d' % i
+    lastmodified = datetime.datetime(2025, 6, 1) + datetime.timedelta(seconds=i)
+    return name, ('AT', lastmodified, (i * 0.0024) % 360, (i * 0.0011) % 180 - 90)
+
+
+def csv_row(name, prefix, lastmodified, ra, dec):
+    return [str(random.randrange(100000)), prefix, name, repr(ra), repr(dec), '', '', 'SN Ia',
+            '', 'ZTF', '', 'ZTF', '2025-05-30 01:02:03.456', '18.9', '', 'r',
+            'A. Author, B. Author', '', 'ZTF25abcdefg', '2025-05-30 02:00:00', lastmodified]
+
+
+def make_fixture(directory, nrows):
+    """ the stored catalogue and the zip of a delta of nrows """
+    random.seed(1)
+    existing = dict(catalogue_row(i) for i in range(NCATALOGUE))
+    names = random.sample(sorted(existing), int(0.6 * nrows))
+    rows = []
+    for (k, name) in enumerate(names):
+        (prefix, lastmodified, ra, dec) = existing[name]
+        if k < len(names) // 3:          # unchanged
+            rows.append(csv_row(name, prefix, str(lastmodified), ra, dec))
+        elif k < 2 * len(names) // 3:    # classified
+            rows.append(csv_row(name, 'SN', str(lastmodified + datetime.timedelta(days=1)), ra, dec))
+        else:                            # position changed
+            rows.append(csv_row(name, prefix, str(lastmodified + datetime.timedelta(days=1)), ra + 0.0001, dec))
+    for i in range(nrows - len(rows)):
+        rows.append(csv_row('2026%06d' % i, 'AT', '2026-01-01 00:00:00', random.uniform(0, 360), random.uniform(-90, 90)))
+
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(['%s 00:00:00' % DATE])
+    writer.writerow(HEADER)
+    writer.writerows(rows)
+    filename = os.path.join(directory, CSVFILE + '.zip')
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(CSVFILE, text.getvalue())
+    return existing, filename
+
+
+def before(filename, existing):
+    "the zip read as fetch_csv did, and each row looked up"
+    archive = zipfile.ZipFile(filename, mode='r')
+    content = archive.read(CSVFILE).decode('utf-8')
+    data = [row for row in csv.reader(io.StringIO(content))][1:]
+    header = data[0]
+    new = changed = 0
+    for row in data[1:]:
+        row_dict = {}
+        for i in range(len(header)):
+            row_dict[header[i]] = row[i]
+        tnsEntry = existing.get(row_dict['name'])
+        if tnsEntry:
+            if tnsEntry[0] != row_dict['name_prefix']:
+                changed += 1
+        else:
+            new += 1
+    return new, changed
+
+
+def after(filename, existing):
+    "the zip parsed as it is read, and the changes found as sets"
+    with open(filename, 'rb') as f:
+        row_dicts = tns_bulk.csv_dicts(read_csv(f, CSVFILE))
+    existing = {r['name']: existing[r['name']] for r in row_dicts if r['name'] in existing}
+    new, changed, moved = tns_delta.changes(row_dicts, existing)
+    return len(new), len(changed)
+
+
+def measure(function, *args):
+    "the time, then the peak memory in a second run, as tracing the memory slows it"
+    t = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - t
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def lookup_db(filename):
+    "the stored rows for the names in the delta, by name and by one join"
+    from src import db_connect
+    with open(filename, 'rb') as f:
+        names = [r['name'] for r in tns_bulk.csv_dicts(read_csv(f, CSVFILE))]
+    conn = db_connect.remote(allow_infile=True)
+    cursor = conn.cursor(buffered=True, dictionary=True)
+    t = time.perf_counter()
+    for name in names:
+        cursor.execute('select tns_prefix, tns_name from crossmatch_tns where tns_name = %s', (name,))
+        cursor.fetchone()
+    by_name = time.perf_counter() - t
+    cursor.close()
+    t = time.perf_counter()
+    tns_delta.existing_rows(conn, names)
+    joined = time.perf_counter() - t
+    conn.close()
+    return by_name, joined
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    db = '--db' in args
+    if db:
+        args.remove('--db')
+    nrows = int(args[0]) if args else 5000
+    directory = tempfile.mkdtemp()
+    try:
+        existing, filename = make_fixture(directory, nrows)
+        print('%d rows in the delta, %d stored' % (nrows, len(existing)))
+        print('%8s %10s %10s %8s %8s' % ('', 'ms', 'peak MB', 'new', 'changed'))
+        for (name, function) in (('before', before), ('after', after)):
+            (new, changed), elapsed, peak = measure(function, filename, existing)
+            print('%8s %10.1f %10.2f %8d %8d' % (name, 1000 * elapsed, peak / 1e6, new, changed))
+        if db:
+            by_name, joined = lookup_db(filename)
+            print('lookup in the database: %.1f ms by name, %.1f ms by one join' % (1000 * by_name, 1000 * joined))
+    finally:
+        shutil.rmtree(directory)
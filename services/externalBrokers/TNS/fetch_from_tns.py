@@ -1,53 +1,75 @@
-import os, sys
+import sys
 sys.path.append('../../../common')
 import settings
 import tempfile
 import zipfile
-from io import StringIO
+import shutil
+import io
 import csv
+import urllib.parse
+import urllib.request
 
-def fetch_csv(date):
-    """ Fetches CSV files from TNS
-        If date is present as yyymmdd, just the delta for that date
-        Else id date is 'All' get the whole TNS catalog
-    """
-    filename = tempfile.NamedTemporaryFile().name + '.zip'
-    cmd = 'curl -s -X POST -H \'user-agent: tns_marker{"tns_id":91941,"type": "bot", "name":"Lasair_bot"}\' '
-    cmd += "-d 'api_key=%s' " % settings.TNS_API_KEY
+# the zip is kept in memory up to this size, then spills to a temporary file
+SPOOL_SIZE = 64*1024*1024
 
+USER_AGENT = 'tns_marker{"tns_id":91941,"type": "bot", "name":"Lasair_bot"}'
+
+def csv_name(date):
     if date == 'All':
-        cmd += settings.TNS_URL + 'tns_public_objects.csv.zip '
+        return 'tns_public_objects.csv'
     else:
-        cmd += settings.TNS_URL + 'tns_public_objects_%s.csv.zip ' % date
+        return 'tns_public_objects_%s.csv' % date
 
-    cmd += ' > %s' % filename
-    os.system(cmd)
+def download(date):
+    """ Downloads the zip of a CSV file from TNS, into a file object
+        If date is present as yyymmdd, just the delta for that date
+        Else id date is 'All' get the whole TNS catalog
+    """
+    url = settings.TNS_URL + csv_name(date) + '.zip'
+    data = urllib.parse.urlencode({'api_key': settings.TNS_API_KEY}).encode()
+    request = urllib.request.Request(url, data=data, headers={'User-Agent': USER_AGENT})
+    f = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
     try:
-        archive = zipfile.ZipFile(filename, mode='r')
-    except:
-        print("ERROR with TNS/poll_tns: Cannot download " + cmd)
+        with urllib.request.urlopen(request) as response:
+            shutil.copyfileobj(response, f)
+    except Exception as e:
+        print("ERROR with TNS/poll_tns: Cannot download %s: %s" % (url, str(e)))
         sys.exit()
+    f.seek(0)
+    return f
 
-    if date == 'All':
-        csvfile = 'tns_public_objects.csv'
-    else:
-        csvfile = 'tns_public_objects_%s.csv' % date
+def read_csv(f, csvfile):
+    """ Parses the CSV file in a zip as it is read, yielding each row as
+        a dictionary keyed by the header
+    """
+    try:
+        archive = zipfile.ZipFile(f, mode='r')
+    except zipfile.BadZipFile:
+        print("ERROR with TNS/poll_tns: %s is not in a zip file" % csvfile)
+        sys.exit()
+    with archive.open(csvfile) as member:
+        reader = csv.reader(io.TextIOWrapper(member, encoding='utf-8', newline=''))
+        next(reader, None)     # first row is the date of the file
+        header = next(reader, None)
+        for row in reader:
+            yield dict(zip(header, row))
 
-    content = archive.read(csvfile).decode('utf-8')
-    mockfile = StringIO(content)
-    reader = csv.reader(mockfile)
-    rows = [row for row in reader]
-    return rows[1:]    # first row is now header
+def stream_csv(date):
+    """ Fetches CSV files from TNS, yielding the rows as dictionaries
+        If date is present as yyymmdd, just the delta for that date
+        Else id date is 'All' get the whole TNS catalog
+    """
+    f = download(date)
+    try:
+        yield from read_csv(f, csv_name(date))
+    finally:
+        f.close()
 
 if __name__ == '__main__':
     from datetime import datetime, timedelta
     g = datetime.now() - timedelta(days=1)
     yesterday = str(g).split()[0].replace('-', '')
-    rows = fetch_csv(yesterday)
-    #rows = fetch_csv('All')
-    header = rows[0]
-
-    print(header)
-#    print('----')
-#    for row in rows[1:]:
-#        print(row)
+    rows = stream_csv(yesterday)
+    #rows = stream_csv('All')
+
+    print(list(next(rows, {}).keys()))
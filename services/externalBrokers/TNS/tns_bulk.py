@@ -0,0 +1,178 @@
+"""
+tns_bulk.py
+Rebuild our copy of the TNS catalogue, and the cones and hits of the TNS
+watchlist, from the whole TNS CSV in bulk, for poll_tns --daysAgo=All.
+The HTM IDs are computed in one call, the rows are loaded with LOAD DATA
+into crossmatch_tns_new, and all the positions are matched against one pass
+of the objects table, as run_crossmatch_optimised does for a watchlist. The
+cones and hits are then replaced in one transaction, and crossmatch_tns_new
+renamed over crossmatch_tns, so readers never see the tables empty.
+"""
+import os
+import sys
+import time
+import tempfile
+sys.path.append('../../../common')
+import settings
+from gkhtm import _gkhtm as htmCircle
+from src import run_crossmatch_optimised
+
+# the columns of crossmatch_tns filled from the CSV, in the order of tns_values
+COLUMNS = ('ra', 'decl', 'tns_name', 'tns_prefix', 'disc_mag', 'disc_mag_filter',
+           'type', 'z', 'disc_int_name', 'disc_date', 'lastmodified_date',
+           'sender', 'reporters', 'source_group', 'htm16')
+
+CONE_COLUMNS = ('wl_id', 'name', 'ra', 'decl')
+HIT_COLUMNS = ('wl_id', 'cone_id', 'objectId', 'arcsec', 'name')
+
+def tns_values(row_dict):
+    """ tns_values.
+        The values of COLUMNS for a row of the TNS CSV, cut down to fit them
+        Args:
+            row_dict: the row as a dictionary keyed by the CSV header, with htm16 added
+    """
+    # if its null, want NULL instead of ''
+    disc_mag = row_dict['discoverymag'] or None
+    z = row_dict['redshift'] or None
+
+    # just keep the first 75 characters of this, and convert the unicode to ???
+    internal_names = row_dict['internal_names']
+    if len(internal_names) > 75:
+        internal_names = internal_names[:75].replace("'", '') + '...'
+        internal_names = internal_names.encode('ascii', 'replace').decode('ascii')
+
+    # keep it down to 16 characters
+    sender = row_dict['reporting_group']
+    if len(sender) > 12: sender = sender[:12] + '...'
+
+    reporters = row_dict['reporters'].encode('ascii', 'replace').decode('ascii').replace("'", '')
+    if len(reporters) > 75: reporters = reporters[:75] + '...'
+
+    return (
+        float(row_dict['ra']),
+        float(row_dict['declination']),
+        row_dict['name'],
+        row_dict['name_prefix'],
+        disc_mag,
+        row_dict['filter'],
+        row_dict['type'],
+        z,
+        internal_names,
+        row_dict['discoverydate'],
+        row_dict['lastmodified'],
+        sender,
+        reporters,
+        row_dict['source_group'][:16],
+        row_dict['htm16'])
+
+def add_htm16(row_dicts):
+    """ add_htm16.
+        Puts the htm16 of each row into it, with one call for all of them
+    """
+    if not row_dicts:
+        return
+    htm16s = htmCircle.htmIDBulk(16, [[float(r['ra']), float(r['declination'])] for r in row_dicts])
+    for (r, htm16) in zip(row_dicts, htm16s):
+        r['htm16'] = htm16
+
+def tsv_field(value):
+    """ a value as a field of a file for LOAD DATA, with its default escapes """
+    if value is None:
+        return '\\N'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def load_data(cursor, table, columns, rows, replace=False):
+    """ load_data.
+        Loads rows into a table with LOAD DATA LOCAL INFILE, through a
+        temporary file. The connection must be made with
+        db_connect.remote(allow_infile=True), and nothing is committed.
+        Args:
+            cursor: cursor on the connection
+            table: the table
+            columns: names of the columns of each row
+            rows: tuples of values
+            replace: replace rows with the same key, rather than skip them
+    """
+    f = tempfile.NamedTemporaryFile('w', suffix='.tsv', encoding='utf-8', delete=False)
+    try:
+        for row in rows:
+            f.write('\t'.join(tsv_field(v) for v in row) + '\n')
+        f.close()
+        query = "LOAD DATA LOCAL INFILE %%s %s INTO TABLE %s CHARACTER SET utf8mb4 (%s)" % \
+            ('REPLACE' if replace else 'IGNORE', table, ', '.join(columns))
+        cursor.execute(query, (f.name,))
+    finally:
+        f.close()
+        os.remove(f.name)
+
+def csv_dicts(rows):
+    """ csv_dicts.
+        The rows of the TNS CSV, keeping the last row for each name
+        Args:
+            rows: the rows as dictionaries keyed by the header, from fetch_from_tns.stream_csv
+    """
+    row_dicts = {}
+    for row_dict in rows:
+        row_dicts[row_dict['name']] = row_dict
+    return list(row_dicts.values())
+
+def rebuild(conn, rows, radius):
+    """ rebuild.
+        Replaces crossmatch_tns, and the cones and hits of the TNS watchlist,
+        with the whole of the TNS catalogue
+        Args:
+            conn: read-write connection made with db_connect.remote(allow_infile=True)
+            rows: the rows of the TNS CSV as dictionaries
+            radius: matching radius, arcseconds
+        Returns:
+            (number of TNS objects, number of hits)
+    """
+    wl_id = settings.TNS_WATCHLIST_ID
+    t = time.time()
+    row_dicts = csv_dicts(rows)
+    add_htm16(row_dicts)
+    values = [tns_values(r) for r in row_dicts]
+
+    cursor = conn.cursor(buffered=True)
+    cursor.execute('DROP TABLE IF EXISTS crossmatch_tns_new')
+    cursor.execute('CREATE TABLE crossmatch_tns_new LIKE crossmatch_tns')
+    load_data(cursor, 'crossmatch_tns_new', COLUMNS, values)
+    conn.commit()
+    print('%d TNS objects loaded in %.1f seconds' % (len(values), time.time() - t))
+
+    # one pass of the objects table for all the positions
+    t = time.time()
+    names = [v[2] for v in values]
+    matches = []
+    if values:
+        index = run_crossmatch_optimised.ConeIndex(
+            [v[0] for v in values], [v[1] for v in values], [radius] * len(values))
+        matches = run_crossmatch_optimised.match_objects(index)
+    print('%d hits found in %.1f seconds' % (len(matches), time.time() - t))
+
+    # the cones and hits are swapped in one transaction
+    t = time.time()
+    cursor.execute('DELETE FROM watchlist_hits WHERE wl_id=%s', (wl_id,))
+    cursor.execute('DELETE FROM watchlist_cones WHERE wl_id=%s', (wl_id,))
+    load_data(cursor, 'watchlist_cones', CONE_COLUMNS,
+        [(wl_id, v[2], v[0], v[1]) for v in values])
+    cursor.execute('SELECT name, cone_id FROM watchlist_cones WHERE wl_id=%s', (wl_id,))
+    cone_ids = dict(cursor.fetchall())
+    # REPLACE as the filter may add a hit for a new alert meanwhile
+    load_data(cursor, 'watchlist_hits', HIT_COLUMNS,
+        [(wl_id, cone_ids[names[j]], objectId, round(arcsec, 2), names[j]) for (objectId, j, arcsec) in matches],
+        replace=True)
+    # refresh the watchlist so its MOC file is remade
+    cursor.execute('UPDATE watchlists SET date_modified=NOW() WHERE wl_id=%s', (wl_id,))
+    conn.commit()
+
+    # RENAME is atomic for both tables, but commits, so it comes after the hits;
+    # a crossmatch_tns_old left by a run that failed would stop it
+    cursor.execute('DROP TABLE IF EXISTS crossmatch_tns_old')
+    cursor.execute('RENAME TABLE crossmatch_tns TO crossmatch_tns_old, crossmatch_tns_new TO crossmatch_tns')
+    cursor.execute('DROP TABLE crossmatch_tns_old')
+    cursor.close()
+    print('Cones and hits swapped in %.1f seconds' % (time.time() - t))
+    return len(values), len(matches)
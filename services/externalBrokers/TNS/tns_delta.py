@@ -0,0 +1,206 @@
+"""
+tns_delta.py
+Apply a daily TNS CSV to our copy of the TNS catalogue in bulk, for poll_tns.
+The stored tns_prefix, lastmodified_date and position of every name in the
+delta are fetched with one join against a temporary table of the names, and
+the rows are split into sets: new names, changed names, where the prefix or
+the last modified date differ, and those changed that have moved. Changed
+rows are deleted and the new and changed rows loaded with LOAD DATA. Only the
+new and moved positions get cones and are matched against objects, with the
+HTM ranges of a chunk of positions in each query. It is all one transaction.
+"""
+import sys
+import time
+import datetime
+import numpy as np
+sys.path.append('../../../common')
+import settings
+from src import run_crossmatch_optimised
+from src.htm_ranges import htm16_ranges, merge_ranges
+import tns_bulk
+
+# positions whose HTM ranges go in one query of objects
+MATCH_CHUNK = 200
+
+# names in each IN (...)
+IN_CHUNK = 1000
+
+# a position that changes by less than this, degrees, has not moved
+MOVED = 1e-7
+
+def existing_rows(conn, names):
+    """ existing_rows.
+        What crossmatch_tns has for each of the names, with one query
+        Args:
+            conn: read-write connection made with db_connect.remote(allow_infile=True)
+            names: the TNS names
+        Returns:
+            dictionary of tns_name -> (tns_prefix, lastmodified_date, ra, decl)
+    """
+    cursor = conn.cursor(buffered=True)
+    cursor.execute('DROP TEMPORARY TABLE IF EXISTS tns_delta_names')
+    # the same column as crossmatch_tns, so the join can use its index
+    cursor.execute('CREATE TEMPORARY TABLE tns_delta_names (PRIMARY KEY (tns_name)) '
+                   'SELECT tns_name FROM crossmatch_tns LIMIT 0')
+    tns_bulk.load_data(cursor, 'tns_delta_names', ('tns_name',), [(name,) for name in names])
+    cursor.execute('SELECT tns_name, tns_prefix, lastmodified_date, ra, decl '
+                   'FROM crossmatch_tns JOIN tns_delta_names USING (tns_name)')
+    existing = {row[0]: row[1:] for row in cursor.fetchall()}
+    cursor.execute('DROP TEMPORARY TABLE tns_delta_names')
+    cursor.close()
+    return existing
+
+def parse_time(text):
+    """ parse_time.
+        A time in the TNS CSV as a datetime, with any number of digits of a
+        second rounded to the microsecond, as the datetime(6) columns keep it
+    """
+    (whole, dot, fraction) = text.partition('.')
+    t = datetime.datetime.strptime(whole, '%Y-%m-%d %H:%M:%S')
+    if fraction:
+        if not fraction.isdigit():
+            raise ValueError('bad fraction of a second in %s' % text)
+        t += datetime.timedelta(microseconds=round(int(fraction) * 10 ** (6 - len(fraction))))
+    return t
+
+def same_time(stored, text):
+    """ whether a lastmodified_date from the database is the time in the CSV """
+    if stored is None or not text:
+        return stored is None and not text
+    try:
+        return stored == parse_time(text)
+    except ValueError:
+        return str(stored) == text
+
+def changes(row_dicts, existing):
+    """ changes.
+        Splits the rows of the delta into new and changed, leaving out those
+        that have not changed
+        Args:
+            row_dicts: rows of the CSV as dictionaries, one for each name
+            existing: from existing_rows
+        Returns:
+            (new, changed, moved), lists of rows, where moved are those
+            changed whose position is not the one stored
+    """
+    new = []
+    changed = []
+    moved = []
+    for r in row_dicts:
+        old = existing.get(r['name'])
+        if old is None:
+            new.append(r)
+            continue
+        (prefix, lastmodified, ra, decl) = old
+        if prefix == r['name_prefix'] and same_time(lastmodified, r['lastmodified']):
+            continue
+        changed.append(r)
+        if ra is None or decl is None \
+                or abs(ra - float(r['ra'])) > MOVED or abs(decl - float(r['declination'])) > MOVED:
+            moved.append(r)
+    return new, changed, moved
+
+def in_chunks(cursor, query, names, args=()):
+    """ in_chunks.
+        Runs a query with {} for an IN list, on IN_CHUNK names at a time
+        Returns:
+            the rows, if the query returns any
+    """
+    rows = []
+    for i in range(0, len(names), IN_CHUNK):
+        chunk = names[i:i + IN_CHUNK]
+        cursor.execute(query.format(','.join(['%s'] * len(chunk))), tuple(args) + tuple(chunk))
+        if cursor.with_rows:
+            rows += cursor.fetchall()
+    return rows
+
+def match_positions(cursor, ras, decs, radius, chunk=MATCH_CHUNK):
+    """ match_positions.
+        The objects within the radius of each position. The HTM ranges of
+        a chunk of positions go in one query of objects, and the objects
+        found are matched with the exact distance.
+        Args:
+            cursor: cursor on the database
+            ras, decs: the positions in degrees
+            radius: matching radius, arcseconds
+        Returns:
+            list of (objectId, index of position, separation in arcsec)
+    """
+    matches = []
+    for i in range(0, len(ras), chunk):
+        cras = ras[i:i + chunk]
+        cdecs = decs[i:i + chunk]
+        ranges = []
+        for (ra, dec) in zip(cras, cdecs):
+            ranges += htm16_ranges(ra, dec, radius)
+        if not ranges:
+            continue
+        where = ' OR '.join('htm16 BETWEEN %d AND %d' % r for r in merge_ranges(ranges))
+        cursor.execute('SELECT objectId, ramean, decmean FROM objects WHERE ' + where)
+        rows = cursor.fetchall()
+        if not rows:
+            continue
+        objectIds, oras, odecs = zip(*rows)
+        index = run_crossmatch_optimised.ConeIndex(cras, cdecs, [radius] * len(cras))
+        ipos, icone, arcsec = index.match(np.array(oras, dtype=float), np.array(odecs, dtype=float))
+        for p, j, d in zip(ipos.tolist(), icone.tolist(), arcsec.tolist()):
+            matches.append((objectIds[p], i + j, d))
+    return matches
+
+def sync(conn, rows, radius):
+    """ sync.
+        Applies a delta of the TNS catalogue to crossmatch_tns, and to the
+        cones and hits of the TNS watchlist
+        Args:
+            conn: read-write connection made with db_connect.remote(allow_infile=True)
+            rows: the rows of the TNS CSV as dictionaries
+            radius: matching radius, arcseconds
+        Returns:
+            (number added, number changed, number moved, number of hits)
+    """
+    wl_id = settings.TNS_WATCHLIST_ID
+    t = time.time()
+    row_dicts = tns_bulk.csv_dicts(rows)
+    existing = existing_rows(conn, [r['name'] for r in row_dicts])
+    new, changed, moved = changes(row_dicts, existing)
+    for r in new:
+        print("Object %s has been added" % r['name'])
+    for r in changed:
+        print("Object %s has been updated" % r['name'])
+    print('%d rows checked in %.1f seconds' % (len(row_dicts), time.time() - t))
+
+    # this may be an update of an existing record, so make sure we zap that first
+    t = time.time()
+    cursor = conn.cursor(buffered=True)
+    loaded = new + changed
+    tns_bulk.add_htm16(loaded)
+    in_chunks(cursor, 'DELETE FROM crossmatch_tns WHERE tns_name IN ({})', [r['name'] for r in changed])
+    tns_bulk.load_data(cursor, 'crossmatch_tns', tns_bulk.COLUMNS, [tns_bulk.tns_values(r) for r in loaded])
+
+    # only the new and moved positions are matched
+    matches = []
+    cones = new + moved
+    if cones:
+        in_chunks(cursor, 'DELETE FROM watchlist_hits WHERE wl_id=%s AND name IN ({})',
+            [r['name'] for r in moved], (wl_id,))
+        in_chunks(cursor, 'DELETE FROM watchlist_cones WHERE wl_id=%s AND name IN ({})',
+            [r['name'] for r in moved], (wl_id,))
+        names = [r['name'] for r in cones]
+        ras = [float(r['ra']) for r in cones]
+        decs = [float(r['declination']) for r in cones]
+        tns_bulk.load_data(cursor, 'watchlist_cones', tns_bulk.CONE_COLUMNS,
+            [(wl_id, name, ra, dec) for (name, ra, dec) in zip(names, ras, decs)])
+        cone_ids = dict(in_chunks(cursor,
+            'SELECT name, cone_id FROM watchlist_cones WHERE wl_id=%s AND name IN ({})', names, (wl_id,)))
+
+        matches = match_positions(cursor, ras, decs, radius)
+        # REPLACE as the filter may add a hit for a new alert meanwhile
+        tns_bulk.load_data(cursor, 'watchlist_hits', tns_bulk.HIT_COLUMNS,
+            [(wl_id, cone_ids[names[j]], objectId, round(arcsec, 2), names[j]) for (objectId, j, arcsec) in matches],
+            replace=True)
+        # refresh the watchlist so its MOC file is remade
+        cursor.execute('UPDATE watchlists SET date_modified=NOW() WHERE wl_id=%s', (wl_id,))
+    conn.commit()
+    cursor.close()
+    print('%d rows and %d cones written in %.1f seconds' % (len(loaded), len(cones), time.time() - t))
+    return len(new), len(changed), len(moved), len(matches)
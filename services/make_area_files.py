@@ -9,7 +9,7 @@ import os, sys, stat, time, base64
 from my_cmd import execute_cmd
 sys.path.append('../common')
 from datetime import datetime
-from src import date_nid, db_connect, slack_webhook, bad_fits
+from src import date_nid, db_connect, slack_webhook, bad_fits, metrics
 
 logfile = ''
 logf = None
@@ -92,6 +92,7 @@ if __name__ == "__main__":
     date = date_nid.nid_to_date(nid)
     logfile = settings.SERVICES_LOG +'/'+ date + '.log'
     logf = open(logfile, 'a')
+    started = time.time()
     now = datetime.now()
     logf.write('\n-- make_area_files at %s\n' % now.strftime("%d/%m/%Y %H:%M:%S"))
 
@@ -123,4 +124,5 @@ if __name__ == "__main__":
 
     execute_cmd('rm -r %s'  % cache_dir, logfile)
     execute_cmd('mv %s %s' % (new_cache_dir, cache_dir), logfile)
+    metrics.service_done('make_area_files', started)
     sys.exit(0)
@@ -12,20 +12,48 @@ where the first has the columns
 where cone_id is the id of the cone in the database, at the given position and radius
 (in degrees), with the user-given name of the cone last. The "moc<nnn>.fits" files are 
 "Multi-Order Coverage maps", https://cds-astro.github.io/mocpy/. The union of all the 
-files is the same as the list of cones associated with the watchlist.
+files is the same as the list of cones associated with the watchlist. A file
+chunks.json keeps a digest of the cones in each moc file, so that when a
+watchlist changes only the moc files whose cones have changed are remade.
+The moc files of all the watchlists being rebuilt are made in a process pool.
+A rebuild holds the lock file wl_<nn>.lock while it builds the new directory
+and swaps it in, so two runs never build the same watchlist at once.
+
+Usage: python3 make_watchlist_files.py [--jobs]
+With no argument, the active watchlists newer than their files are rebuilt.
+With --jobs, it runs until stopped, taking the watchlist_files jobs that the
+web server queues in the jobs table when a watchlist is uploaded, and
+rebuilding each of those watchlists at once.
 """
-import os, sys, math, time, stat
+import os, sys, math, time, stat, json, glob, fcntl, shutil, socket, hashlib, tempfile
+from multiprocessing import Pool
+import numpy as np
 from mocpy import MOC
-from my_cmd import execute_cmd
 sys.path.append('../common')
 import astropy.units as u
 from datetime import datetime
-from src import db_connect, slack_webhook
+from src import db_connect, slack_webhook, metrics
 
 logfile = ''
 logf = sys.stdout
 
+# seconds between looks at the jobs table when there is nothing to do
+JOBS_POLL = 2
+
 def moc_watchlist(watchlist, max_depth):
+    """
+    Take a "watchlist" dictionary and build the MOC of all its cones at given max_depth,
+    with one vectorised call that merges the HEALPix cells of the cones.
+    """
+    lon = np.asarray(watchlist['ra'], dtype=float) * u.deg
+    lat = np.asarray(watchlist['de'], dtype=float) * u.deg
+    radius = np.asarray(watchlist['radius'], dtype=float) * u.deg
+    if not hasattr(MOC, 'from_cones'):
+        # mocpy before 0.13
+        return moc_watchlist_polygons(watchlist, max_depth)
+    return MOC.from_cones(lon=lon, lat=lat, radius=radius, max_depth=max_depth, union_strategy='small_cones')
+
+def moc_watchlist_polygons(watchlist, max_depth):
     """
     Take a "watchlist" dictionary and builds a MOC at given max_depth, by approximating the
     disk around a source as a hexagon.
@@ -53,29 +81,50 @@ def moc_watchlist(watchlist, max_depth):
         else:   moc = newmoc
     return moc
 
-def moc_watchlists(watchlist, max_depth, chk):
+def watchlist_chunks(watchlist, chk):
     """
     mocs can be inefficient when they have a lot of points in them
-    so here we make several smaller mocs, each with a max number of cones
+    so the watchlist is split into chunks with a max number of cones, one moc each
     """
-
-    # split the number of points in the watchlist into chunks
     nchunk = len(watchlist['ra'])//chk
     if len(watchlist['ra']) % chk: 
         nchunk += 1
-
-    # split up the watchlist and make a moc for each chunk
-    moclist = []
+    chunks = []
     for ichunk in range(nchunk):
-        watchchunk  = {
-            'ra':     watchlist['ra']    [ichunk*chk:(ichunk+1)*chk],
-            'de':     watchlist['de']    [ichunk*chk:(ichunk+1)*chk],
-            'radius': watchlist['radius'][ichunk*chk:(ichunk+1)*chk]
-        }
-        moclist.append(moc_watchlist(watchchunk, max_depth))
-    # return a list of mocs
-    return moclist
+        chunks.append({
+            'cone_ids': watchlist['cone_ids'][ichunk*chk:(ichunk+1)*chk],
+            'ra':       watchlist['ra']      [ichunk*chk:(ichunk+1)*chk],
+            'de':       watchlist['de']      [ichunk*chk:(ichunk+1)*chk],
+            'radius':   watchlist['radius']  [ichunk*chk:(ichunk+1)*chk]
+        })
+    return chunks
 
+def moc_watchlists(watchlist, max_depth, chk):
+    """
+    Split the watchlist into chunks and make a moc for each chunk
+    """
+    return [moc_watchlist(chunk, max_depth) for chunk in watchlist_chunks(watchlist, chk)]
+
+def chunk_digest(chunk, max_depth):
+    """
+    Digest of the cones in a chunk and the depth, which changes if the moc would
+    """
+    h = hashlib.sha1(('%d\n' % max_depth).encode())
+    for row in zip(chunk['cone_ids'], chunk['ra'], chunk['de'], chunk['radius']):
+        h.update(('%d,%r,%r,%r\n' % row).encode())
+    return h.hexdigest()
+
+def build_moc_file(task):
+    """
+    Make one moc file, in a pool worker
+    """
+    (filename, chunk, max_depth) = task
+    moc_watchlist(chunk, max_depth).save(filename, format='fits', overwrite=True)
+    return filename
+
+def pool_init():
+    # one thread per worker process, as the pool already has one process per core
+    os.environ['RAYON_NUM_THREADS'] = '1'
 
 def fetch_watchlist(msl, wl_id, default_radius):
     """
@@ -84,7 +133,7 @@ def fetch_watchlist(msl, wl_id, default_radius):
     """
     cursor = msl.cursor(buffered=True, dictionary=True)
 
-    cursor.execute('SELECT cone_id, ra, decl, radius, name FROM watchlist_cones WHERE wl_id=%d ' % wl_id)
+    cursor.execute('SELECT cone_id, ra, decl, radius, name FROM watchlist_cones WHERE wl_id=%d ORDER BY cone_id' % wl_id)
     cone_ids = []
     ralist   = []
     delist   = []
@@ -141,8 +190,29 @@ def fetch_active_watchlists(msl, cache_dir):
     # watchlists which will have their caches rebuilt
     return {'keep': keep, 'get':get}
 
-def rebuild_cache(wl_id, name, cones, max_depth, cache_dir, chk):
-    """rebuild_cache.
+def lock_watchlist(wl_id, cache_dir):
+    """lock_watchlist.
+    Take the lock on rebuilding a watchlist's cache, returning the open lock
+    file, or None if another run holds it.
+
+    Args:
+        wl_id:
+        cache_dir:
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    lock = open(cache_dir + '/wl_%d.lock' % wl_id, 'a')
+    try:
+        fcntl.lockf(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+def plan_cache(wl_id, name, cones, max_depth, cache_dir, chk):
+    """plan_cache.
+    Start the new cache directory of a watchlist, reusing the moc files of the
+    chunks whose cones have not changed, and return the moc files still to make,
+    or None if another run is rebuilding the watchlist.
 
     Args:
         wl_id:
@@ -153,35 +223,212 @@ def rebuild_cache(wl_id, name, cones, max_depth, cache_dir, chk):
         chk:
     """
     t = time.time()
-    # make it in a new directory
+    lock = lock_watchlist(wl_id, cache_dir)
+    if lock is None:
+        logf.write('Watchlist "%s" is being rebuilt by another run\n' % name)
+        return None
+
+    # directories left by a run that died
+    for stale in glob.glob(cache_dir + '/wl_%d_new_*' % wl_id) + glob.glob(cache_dir + '/wl_%d_old_*' % wl_id):
+        shutil.rmtree(stale, ignore_errors=True)
+
     watchlist_dir     = cache_dir + '/wl_%d/' % wl_id
-    watchlist_dir_new = cache_dir + '/wl_%d_new/' % wl_id
-    os.mkdir(watchlist_dir_new)
+    watchlist_dir_new = tempfile.mkdtemp(prefix='wl_%d_new_' % wl_id, dir=cache_dir) + '/'
+    os.chmod(watchlist_dir_new, 0o755)
+
+    try:
+        with open(watchlist_dir + 'chunks.json') as f:
+            old_digests = json.loads(f.read())
+    except:
+        old_digests = []
+
+    chunks = watchlist_chunks(cones, chk)
+    digests = [chunk_digest(chunk, max_depth) for chunk in chunks]
+    tasks = []
+    for i in range(len(chunks)):
+        filename = 'moc%03d.fits' % i
+        if i < len(old_digests) and old_digests[i] == digests[i] \
+                and os.path.exists(watchlist_dir + filename):
+            os.link(watchlist_dir + filename, watchlist_dir_new + filename)
+        else:
+            tasks.append((watchlist_dir_new + filename, chunks[i], max_depth))
+
+    return {'wl_id': wl_id, 'name': name, 'cones': cones, 'digests': digests,
+            'tasks': tasks, 'cache_dir': cache_dir, 'dir_new': watchlist_dir_new,
+            'lock': lock, 't': t}
+
+def finish_cache(plan):
+    """finish_cache.
+    Write the cone list and digests of a watchlist once its moc files are made,
+    and swap the new cache directory into place, then let go of the lock.
+
+    Args:
+        plan: from plan_cache
+    """
+    wl_id = plan['wl_id']
+    cache_dir = plan['cache_dir']
+    watchlist_dir     = cache_dir + '/wl_%d' % wl_id
+    watchlist_dir_new = plan['dir_new']
+    cones = plan['cones']
 
-    # compute the list of mocs
-    moclist = moc_watchlists(cones, max_depth, chk)
-    
     # write the watchlist.csv
-    w = open(watchlist_dir_new + 'watchlist.csv', 'w')
     ralist   = cones['ra']
     delist   = cones['de']
     radius   = cones['radius']
     names    = cones['names']
     cone_ids = cones['cone_ids']
-    for i in range(len(ralist)):
-        w.write('%d, %f, %f, %.3e, %s\n' % 
-            (cone_ids[i], ralist[i], delist[i], radius[i], names[i]))
-    w.close()
+    with open(watchlist_dir_new + 'watchlist.csv', 'w') as w:
+        for i in range(len(ralist)):
+            w.write('%d, %f, %f, %.3e, %s\n' % 
+                (cone_ids[i], ralist[i], delist[i], radius[i], names[i]))
 
-    # now write the moc files
-    for i in range(len(moclist)):
-        moclist[i].write(watchlist_dir_new + 'moc%03d.fits'%i)
-    logf.write('Watchlist "%s" with %d cones rebuilt in %.2f seconds\n' 
-            % (name, len(ralist), time.time() - t))
+    with open(watchlist_dir_new + 'chunks.json', 'w') as w:
+        w.write(json.dumps(plan['digests']))
 
-    # move the new stuff into the correct directory name
-    cmd = 'rm -r %s; mv %s %s' % (watchlist_dir, watchlist_dir_new, watchlist_dir)
-    execute_cmd(cmd, logfile)
+    logf.write('Watchlist "%s" with %d cones rebuilt in %.2f seconds, %d of %d mocs remade\n' 
+            % (plan['name'], len(ralist), time.time() - plan['t'], len(plan['tasks']), len(plan['digests'])))
+
+    # move the old directory aside and the new one into its name, then remove the old
+    try:
+        old_dir = None
+        if os.path.exists(watchlist_dir):
+            old_dir = tempfile.mkdtemp(prefix='wl_%d_old_' % wl_id, dir=cache_dir)
+            os.rename(watchlist_dir, old_dir + '/wl')
+        os.rename(watchlist_dir_new.rstrip('/'), watchlist_dir)
+        if old_dir:
+            shutil.rmtree(old_dir)
+    finally:
+        plan['lock'].close()
+
+def rebuild_caches(watchlists, max_depth, cache_dir, chk, processes):
+    """rebuild_caches.
+    Rebuild the caches of several watchlists, with the moc files of all of them
+    made in one process pool.
+
+    Args:
+        watchlists: list of (wl_id, name, cones)
+        max_depth:
+        cache_dir:
+        chk:
+        processes: size of the pool, 1 for no pool
+
+    Returns:
+        the number of watchlists rebuilt, less those another run is rebuilding
+    """
+    plans = [plan_cache(wl_id, name, cones, max_depth, cache_dir, chk) 
+            for (wl_id, name, cones) in watchlists]
+    plans = [plan for plan in plans if plan is not None]
+    tasks = [task for plan in plans for task in plan['tasks']]
+    if processes > 1 and len(tasks) > 1:
+        with Pool(processes, initializer=pool_init) as pool:
+            pool.map(build_moc_file, tasks, chunksize=1)
+    else:
+        for task in tasks:
+            build_moc_file(task)
+    for plan in plans:
+        finish_cache(plan)
+    return len(plans)
+
+def rebuild_cache(wl_id, name, cones, max_depth, cache_dir, chk):
+    """rebuild_cache.
+
+    Args:
+        wl_id:
+        name:
+        cones:
+        max_depth:
+        cache_dir:
+        chk:
+    """
+    rebuild_caches([(wl_id, name, cones)], max_depth, cache_dir, chk, 1)
+
+def claim_job(msl, worker):
+    """claim_job.
+    Take the oldest queued watchlist_files job, returning it as a dictionary,
+    or None if there is none. The UPDATE only takes a job still queued, so two
+    runs never take the same one.
+
+    Args:
+        msl: read-write connection, with autocommit
+        worker: name of this run, recorded on the job
+    """
+    cursor = msl.cursor(buffered=True, dictionary=True)
+    cursor.execute("SELECT job_id, args FROM jobs WHERE state='queued' AND kind='watchlist_files' "
+                   "ORDER BY job_id LIMIT 1")
+    job = cursor.fetchone()
+    if job is None:
+        return None
+    cursor.execute("UPDATE jobs SET state='running', worker=%s, date_started=UTC_TIMESTAMP() "
+                   "WHERE job_id=%s AND state='queued'", (worker, job['job_id']))
+    if cursor.rowcount != 1:
+        return None
+    return job
+
+def finish_job(msl, job, worker, state, message):
+    """finish_job.
+    Record how a job ended, unless the web server failed it meanwhile for taking too long.
+
+    Args:
+        msl: read-write connection, with autocommit
+        job: from claim_job
+        worker: name of this run
+        state: done or failed
+        message: for the user
+    """
+    cursor = msl.cursor(buffered=True)
+    cursor.execute("UPDATE jobs SET state=%s, progress=%s, message=%s, date_finished=UTC_TIMESTAMP() "
+                   "WHERE job_id=%s AND state='running' AND worker=%s",
+                   (state, 1.0 if state == 'done' else 0.0, message, job['job_id'], worker))
+
+def rebuild_watchlist(msl, wl_id, max_depth, cache_dir, chk, processes):
+    """rebuild_watchlist.
+    Rebuild the cache of one watchlist, returning a message for the user.
+
+    Args:
+        msl:
+        wl_id:
+        max_depth:
+        cache_dir:
+        chk:
+        processes: size of the pool, 1 for no pool
+    """
+    cursor = msl.cursor(buffered=True, dictionary=True)
+    cursor.execute('SELECT wl_id, name, radius FROM watchlists WHERE active > 0 AND wl_id=%s', (wl_id,))
+    watchlist = cursor.fetchone()
+    if watchlist is None:
+        return 'The watchlist is not active, so it has no files'
+    cones = fetch_watchlist(msl, wl_id, watchlist['radius'])
+    if rebuild_caches([(wl_id, watchlist['name'], cones)], max_depth, cache_dir, chk, processes) == 0:
+        return 'The watchlist files are being built by another run'
+    return 'The watchlist files have been built'
+
+def run_jobs(max_depth, cache_dir, chk, processes):
+    """run_jobs.
+    Run the watchlist_files jobs from the jobs table until stopped.
+
+    Args:
+        max_depth:
+        cache_dir:
+        chk:
+        processes: size of the pool, 1 for no pool
+    """
+    worker = '%s:%d' % (socket.gethostname(), os.getpid())
+    msl = db_connect.remote()
+    msl.autocommit = True
+    while True:
+        job = claim_job(msl, worker)
+        if job is None:
+            time.sleep(JOBS_POLL)
+            continue
+        try:
+            wl_id = int(json.loads(job['args'] or '{}')['wl_id'])
+            message = rebuild_watchlist(msl, wl_id, max_depth, cache_dir, chk, processes)
+            state = 'done'
+        except Exception as e:
+            (state, message) = ('failed', 'The job failed: %s' % str(e))
+        logf.write('Job %d: %s\n' % (job['job_id'], message))
+        logf.flush()
+        finish_job(msl, job, worker, state, message)
 
 if __name__ == "__main__":
     import sys
@@ -205,6 +452,7 @@ if __name__ == "__main__":
         log.error("ERROR %s" % str(e))
         sys.exit(0)
 
+    started = time.time()
     now = datetime.now()
     message = '\n-- make_watchlist_files at %s\n' % now.strftime("%d/%m/%Y %H:%M:%S")
     logf.write(message)
@@ -213,15 +461,23 @@ if __name__ == "__main__":
     chk       = settings.WATCHLIST_CHUNK
     cache_dir = settings.WATCHLIST_MOCS
 
+    processes = getattr(settings, 'WATCHLIST_PROCESSES', os.cpu_count())
+
+    if '--jobs' in sys.argv[1:]:
+        # each watchlist as soon as it is uploaded
+        run_jobs(max_depth, cache_dir, chk, processes)
+
     # who needs to be recomputed
 #    try:
     msl = db_connect.readonly()
     watchlists = fetch_active_watchlists(msl, cache_dir)
 
+    # get the data from the database
+    rebuild = []
     for watchlist in watchlists['get']:
-        # get the data from the database
         cones = fetch_watchlist(msl, watchlist['wl_id'], watchlist['radius'])
-        rebuild_cache(watchlist['wl_id'], watchlist['name'], \
-            cones, max_depth, cache_dir, chk)
+        rebuild.append((watchlist['wl_id'], watchlist['name'], cones))
+    rebuild_caches(rebuild, max_depth, cache_dir, chk, processes)
 
+    metrics.service_done('make_watchlist_files', started)
     sys.exit(0)
@@ -0,0 +1,69 @@
+import context
+import json
+import unittest, unittest.mock
+from datetime import datetime
+import hit_summary
+
+
+def connection(fetched):
+    """ A mock database connection whose queries all return the given rows """
+    cursor = unittest.mock.MagicMock()
+    cursor.fetchall.return_value = fetched
+    msl = unittest.mock.MagicMock()
+    msl.cursor.return_value = cursor
+    return msl, cursor
+
+
+class CommonHitSummaryTest(unittest.TestCase):
+    def test_new_hits(self):
+        """Hits already in the main database, or twice in the batch, are not new"""
+        msl, cursor = connection([('ZTF1', 1), ('ZTF2', 3)])
+        hits = [
+            {'wl_id': 7, 'cone_id': 1, 'objectId': 'ZTF1', 'arcsec': 1.0, 'name': 'a'},
+            {'wl_id': 7, 'cone_id': 2, 'objectId': 'ZTF1', 'arcsec': 1.0, 'name': 'b'},
+            {'wl_id': 7, 'cone_id': 2, 'objectId': 'ZTF1', 'arcsec': 1.0, 'name': 'b'},
+            {'wl_id': 8, 'cone_id': 3, 'objectId': 'ZTF2', 'arcsec': 1.0, 'name': 'c'},
+        ]
+        new = hit_summary.new_hits(msl, 'watchlist', hits)
+        self.assertEqual(new, [hits[1]])
+        query, args = cursor.execute.call_args[0]
+        self.assertIn('FROM watchlist_hits WHERE objectId IN', query)
+        self.assertEqual(args, ['ZTF1', 'ZTF2'])
+
+    def test_add_hits(self):
+        """Counts are added, and the new hits go in front of the old recent ones"""
+        old = [{'objectId': 'ZTF0'}]
+        msl, cursor = connection([{'id': 5, 'recent': json.dumps(old)}])
+        hits = [{'ar_id': 5, 'objectId': 'ZTF1'}, {'ar_id': 5, 'objectId': 'ZTF2'}, {'ar_id': 6, 'objectId': 'ZTF1'}]
+        when = datetime(2024, 1, 1)
+        hit_summary.add_hits(msl, 'area', hits, when)
+        query, rows = cursor.executemany.call_args[0]
+        self.assertIn('n_hits=n_hits+VALUES(n_hits)', query)
+        self.assertEqual(rows[0][:3], (5, 2, when))
+        self.assertEqual(json.loads(rows[0][3]), [{'objectId': 'ZTF1'}, {'objectId': 'ZTF2'}, {'objectId': 'ZTF0'}])
+        self.assertEqual(rows[1][:3], (6, 1, when))
+        msl.commit.assert_called_once()
+
+    def test_recent_is_limited(self):
+        msl, cursor = connection([])
+        hits = [{'ar_id': 1, 'objectId': 'ZTF%d' % i} for i in range(hit_summary.RECENT + 10)]
+        hit_summary.add_hits(msl, 'area', hits)
+        query, rows = cursor.executemany.call_args[0]
+        self.assertEqual(rows[0][1], hit_summary.RECENT + 10)
+        self.assertEqual(len(json.loads(rows[0][3])), hit_summary.RECENT)
+
+    def test_read_missing(self):
+        """A watchlist without a summary has no hits"""
+        msl, cursor = connection([{'id': 2, 'n_hits': 4, 'last_hit': None, 'recent': '[]'}])
+        summaries = hit_summary.read(msl, 'watchlist', [1, 2])
+        self.assertEqual(summaries[1]['n_hits'], 0)
+        self.assertEqual(summaries[2]['n_hits'], 4)
+
+    def test_jd_to_datetime(self):
+        self.assertEqual(hit_summary.jd_to_datetime(2451545.0), datetime(2000, 1, 1, 12))
+
+
+if __name__ == '__main__':
+    import xmlrunner
+    runner = xmlrunner.XMLTestRunner(output='test-reports')
+    unittest.main(testRunner=runner)
@@ -0,0 +1,27 @@
+import context
+import unittest
+from unittest import mock
+import htm_ranges
+from htm_ranges import htm16_ranges, merge_ranges
+
+class CommonHTMRangesTest(unittest.TestCase):
+    def test_merge_ranges(self):
+        self.assertEqual(merge_ranges([]), [])
+        self.assertEqual(merge_ranges([(5, 9)]), [(5, 9)])
+        # unsorted, overlapping, adjacent and contained
+        self.assertEqual(merge_ranges([(20, 30), (1, 4), (5, 8), (7, 12), (22, 25)]),
+            [(1, 12), (20, 30)])
+        # a gap of one is not merged
+        self.assertEqual(merge_ranges([(1, 4), (6, 8)]), [(1, 4), (6, 8)])
+
+    def test_htm16_ranges(self):
+        clause = ' AND (htm16ID BETWEEN 10 AND 20 OR htm16ID between 40 and 41)'
+        with mock.patch.object(htm_ranges, 'htmCircle') as htm:
+            htm.htmCircleRegion.return_value = clause
+            self.assertEqual(htm16_ranges(180.0, -30.0, 5.0), [(10, 20), (40, 41)])
+        htm.htmCircleRegion.assert_called_once_with(16, 180.0, -30.0, 5.0)
+
+if __name__ == '__main__':
+    import xmlrunner
+    runner = xmlrunner.XMLTestRunner(output='test-reports')
+    unittest.main(testRunner=runner)
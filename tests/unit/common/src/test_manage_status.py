@@ -1,6 +1,6 @@
 import context
 import os, sys, json
-import unittest
+import unittest, unittest.mock
 from manage_status import manage_status
 
 class CommonManageStatusTest(unittest.TestCase):
@@ -34,6 +34,25 @@ class CommonManageStatusTest(unittest.TestCase):
         # delete the play area
         os.system('rm -r play')
 
+    def test_manage_status_db(self):
+        cursor = unittest.mock.MagicMock()
+        cursor.fetchall.return_value = [('apple', 24.0, None), ('banana', None, '"ripe"'), ('pear', 0.5, None)]
+        msl = unittest.mock.MagicMock()
+        msl.cursor.return_value = cursor
+        ms = manage_status('play/status', lambda: msl)
+
+        ms.add({'pear':7, 'apple':12}, 6)
+        query, args = cursor.execute.call_args[0]
+        self.assertIn('value=IF(VALUES(value) IS NULL, NULL, COALESCE(value,0)+VALUES(value))', query)
+        # one statement, keys in order, with the update time
+        self.assertEqual(args[:8], (6, 'apple', 12, None, 6, 'pear', 7, None))
+        self.assertEqual(args[9], 'update_time')
+        msl.commit.assert_called_once()
+
+        status = ms.read(6)
+        self.assertEqual(status, {'apple': 24, 'banana': 'ripe', 'pear': 0.5})
+        self.assertIsInstance(status['apple'], int)
+
 if __name__ == '__main__':
     import xmlrunner
     runner = xmlrunner.XMLTestRunner(output='test-reports')
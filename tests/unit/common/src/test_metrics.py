@@ -0,0 +1,88 @@
+import context
+import os, json, tempfile, subprocess
+import unittest
+import metrics
+
+
+class CommonMetricsTest(unittest.TestCase):
+    def test_counter_and_gauge(self):
+        c = metrics.counter('lasair_test_things_total', 'Things', ('kind',))
+        c.inc(kind='a')
+        c.inc(2, kind='a')
+        c.inc(kind='b"c')
+        g = metrics.gauge('lasair_test_level', 'Level')
+        g.set(float('nan'))
+        text = metrics.exposition()
+        self.assertIn('# TYPE lasair_test_things_total counter\n', text)
+        self.assertIn('lasair_test_things_total{kind="a"} 3\n', text)
+        self.assertIn('lasair_test_things_total{kind="b\\"c"} 1\n', text)
+        self.assertIn('lasair_test_level NaN\n', text)
+        # the same name gives the same metric, but not as another kind
+        self.assertIs(metrics.counter('lasair_test_things_total', 'Things', ('kind',)), c)
+        with self.assertRaises(ValueError):
+            metrics.gauge('lasair_test_things_total', 'Things', ('kind',))
+        with self.assertRaises(ValueError):
+            c.inc(other='a')
+
+    def test_histogram(self):
+        h = metrics.histogram('lasair_test_seconds', 'Time', ('stage',), buckets=(1, 10))
+        for value in [0.5, 5, 50]:
+            h.observe(value, stage='x')
+        text = metrics.exposition()
+        self.assertIn('lasair_test_seconds_bucket{stage="x",le="1"} 1\n', text)
+        self.assertIn('lasair_test_seconds_bucket{stage="x",le="10"} 2\n', text)
+        self.assertIn('lasair_test_seconds_bucket{stage="x",le="+Inf"} 3\n', text)
+        self.assertIn('lasair_test_seconds_sum{stage="x"} 55.5\n', text)
+        self.assertIn('lasair_test_seconds_count{stage="x"} 3\n', text)
+        with h.time(stage='y'):
+            pass
+        self.assertIn('lasair_test_seconds_count{stage="y"} 1\n', metrics.exposition())
+
+    def test_write(self):
+        metrics.counter('lasair_test_written_total', 'Written').inc()
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertTrue(metrics.write('lasair_test', directory=directory))
+            text = open(os.path.join(directory, 'lasair_test.prom')).read()
+            self.assertIn('lasair_test_written_total 1\n', text)
+            self.assertEqual(os.listdir(directory), ['lasair_test.prom'])
+            # too soon to write again
+            self.assertFalse(metrics.write('lasair_test', every=True, directory=directory))
+        # a directory that is not there is not an error
+        self.assertFalse(metrics.write('lasair_test', directory='/nonexistent/metrics'))
+
+    def test_write_shared(self):
+        h = metrics.histogram('lasair_test_shared_seconds', 'Shared', ('route',), buckets=(1, 10))
+        h.observe(0.5, route='a')
+        # the values of another process, one that has ended
+        ended = subprocess.Popen(['true'])
+        ended.wait()
+        other = {'lasair_test_shared_seconds': [[['a'], [[1, 1], 7.0, 3]], [['b'], [[0, 1], 2.0, 1]]]}
+        with tempfile.TemporaryDirectory() as directory:
+            shared = os.path.join(directory, 'lasair_test_api.d')
+            os.makedirs(shared)
+            with open(os.path.join(shared, '%d_1.json' % ended.pid), 'w') as f:
+                json.dump(other, f)
+            self.assertTrue(metrics.write_shared('lasair_test_api', directory=directory))
+            text = open(os.path.join(directory, 'lasair_test_api.prom')).read()
+            self.assertIn('lasair_test_shared_seconds_bucket{route="a",le="1"} 2\n', text)
+            self.assertIn('lasair_test_shared_seconds_bucket{route="a",le="10"} 3\n', text)
+            self.assertIn('lasair_test_shared_seconds_count{route="a"} 4\n', text)
+            self.assertIn('lasair_test_shared_seconds_sum{route="a"} 7.5\n', text)
+            self.assertIn('lasair_test_shared_seconds_count{route="b"} 1\n', text)
+            # the ended process is kept in ended.json, and this one in its own file
+            names = sorted(os.listdir(shared))
+            self.assertEqual(len(names), 3)
+            self.assertEqual(names[1:], ['ended.json', 'lock'])
+            self.assertTrue(names[0].startswith('%d_' % os.getpid()))
+            # the counts of the ended process are still there
+            h.observe(5, route='a')
+            self.assertTrue(metrics.write_shared('lasair_test_api', directory=directory))
+            text = open(os.path.join(directory, 'lasair_test_api.prom')).read()
+            self.assertIn('lasair_test_shared_seconds_count{route="a"} 5\n', text)
+            self.assertEqual(len(os.listdir(shared)), 3)
+
+
+if __name__ == '__main__':
+    import xmlrunner
+    runner = xmlrunner.XMLTestRunner(output='test-reports')
+    unittest.main(testRunner=runner)
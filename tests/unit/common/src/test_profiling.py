@@ -0,0 +1,74 @@
+import context
+import os, tempfile
+import unittest, unittest.mock
+import pstats
+import profiling
+import metrics
+
+
+class CommonProfilingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        profiling.PROFILE_DIR = self.directory.name
+        profiling.state.update({'all': False, 'hooks': set(), 'name': None, 'profile': None})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hook(self):
+        @profiling.hook('work')
+        def work(n):
+            return sum(range(n))
+
+        # off: nothing written
+        self.assertEqual(work(10), 45)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+        # switched on by the signal handler
+        profiling.switch()
+        self.assertEqual(work(10), 45)
+        files = os.listdir(self.directory.name)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith('work_'))
+        pstats.Stats(os.path.join(self.directory.name, files[0]))
+        profiling.switch()
+        self.assertFalse(profiling.is_on('work'))
+
+    def test_checkpoint(self):
+        """A long running function is profiled from when it is switched on until it is switched off"""
+        profiling.checkpoint('loop')
+        self.assertIsNone(profiling.state['profile'])
+        profiling.state['hooks'] = {'loop'}
+        profiling.checkpoint('loop')
+        self.assertEqual(profiling.state['name'], 'loop')
+        profiling.switch()
+        profiling.checkpoint('loop')
+        self.assertIsNone(profiling.state['profile'])
+        self.assertEqual(len(os.listdir(self.directory.name)), 1)
+
+    def test_trace(self):
+        with unittest.mock.patch.object(profiling, 'TRACE_FRACTION', 0):
+            self.assertIsNone(profiling.begin((1, 1000)))
+        with unittest.mock.patch.object(profiling, 'TRACE_FRACTION', 1):
+            trace = profiling.begin((1, 1000))
+        self.assertEqual(trace, [['kafka', 1.0]])
+        profiling.mark(trace, 'ingest_in')
+        profiling.mark(None, 'ingest_in')
+
+        # through the Kafka headers to the next stage
+        headers = profiling.headers(trace)
+        trace = profiling.read([('other', b'x')] + headers)
+        self.assertEqual(trace[1][0], 'ingest_in')
+        self.assertIsNone(profiling.read(None))
+
+        profiling.mark(trace, 'filter_done')
+        profiling.finish(trace)
+        text = metrics.exposition()
+        self.assertIn('lasair_trace_seconds_count{step="kafka_to_ingest_in"} 1\n', text)
+        self.assertIn('lasair_trace_seconds_count{step="ingest_in_to_filter_done"} 1\n', text)
+
+
+if __name__ == '__main__':
+    import xmlrunner
+    runner = xmlrunner.XMLTestRunner(output='test-reports')
+    unittest.main(testRunner=runner)
@@ -0,0 +1,52 @@
+import context
+import unittest
+import numpy as np
+from run_crossmatch_optimised import ConeIndex, angular_separation
+
+class CommonConeIndexTest(unittest.TestCase):
+    def brute_force(self, cra, cde, crad, ra, de):
+        hits = set()
+        for j in range(len(cra)):
+            arcsec = 3600 * angular_separation(ra, de, cra[j], cde[j])
+            for i in np.nonzero(arcsec < crad[j])[0]:
+                hits.add((int(i), j))
+        return hits
+
+    def check(self, cra, cde, crad, ra, de):
+        index = ConeIndex(cra, cde, crad)
+        ipos, icone, arcsec = index.match(ra, de)
+        got = set(zip(ipos.tolist(), icone.tolist()))
+        self.assertEqual(len(got), len(ipos))   # no pair twice
+        self.assertEqual(got, self.brute_force(cra, cde, crad, ra, de))
+        for i, j, d in zip(ipos, icone, arcsec):
+            self.assertLess(d, crad[j])
+
+    def test_random_sky(self):
+        rng = np.random.default_rng(1)
+        ncone = 300
+        cra = rng.uniform(0, 360, ncone)
+        cde = np.degrees(np.arcsin(rng.uniform(-1, 1, ncone)))
+        crad = rng.uniform(2, 60, ncone)
+        # objects scattered near the cones, so there are hits and near misses
+        j = rng.integers(0, ncone, 5000)
+        ra = (cra[j] + rng.normal(0, 0.02, 5000) / np.cos(np.radians(cde[j]))) % 360
+        de = np.clip(cde[j] + rng.normal(0, 0.02, 5000), -90, 90)
+        self.check(cra, cde, crad, ra, de)
+
+    def test_wraparound_and_poles(self):
+        cra = np.array([0.0001, 359.9999, 10.0, 200.0, 0.0])
+        cde = np.array([5.0, -5.0, 89.999, -89.9995, 0.0])
+        crad = np.array([3.0, 3.0, 10.0, 5.0, 3.0])
+        ra = np.array([359.9998, 0.0002, 190.0, 20.0, 0.0, 359.9995, 0.0])
+        de = np.array([5.0, -5.0, 89.999, -89.9995, 0.0, 0.0, 90.0])
+        self.check(cra, cde, crad, ra, de)
+
+    def test_no_hits(self):
+        index = ConeIndex([10.0], [10.0], [3.0])
+        ipos, icone, arcsec = index.match(np.array([100.0]), np.array([-10.0]))
+        self.assertEqual(len(ipos), 0)
+
+if __name__ == '__main__':
+    import xmlrunner
+    runner = xmlrunner.XMLTestRunner(output='test-reports')
+    unittest.main(testRunner=runner)
@@ -3,6 +3,7 @@
 """
 import os, sys
 import unittest.main
+import unittest.mock
 from unittest import TestCase, expectedFailure
 import json
 from time import sleep
@@ -11,7 +12,7 @@ sys.path.append('../../../../common/src')
 sys.path.append('../../../../services')
 import my_cmd
 
-from services.make_watchlist_files import rebuild_cache
+from services.make_watchlist_files import rebuild_cache, claim_job, rebuild_watchlist
 from pipeline.filter.check_alerts_watchlists import check_alerts_against_watchlists
 from pipeline.filter.check_alerts_watchlists import read_watchlist_cache_files
 
@@ -84,6 +85,46 @@ class FilterWatchlistTest(TestCase):
         hits = test_alerts()
         self.assertEqual(len(hits), 49)
 
+    def test3_rebuild_unchanged(self):
+        print('test rebuild unchanged')
+        moc_file = '%s/wl_%d/moc000.fits' % (cache_dir, wl_id)
+        inode = os.stat(moc_file).st_ino
+        test_cache()
+        # the moc of an unchanged chunk is kept, not remade
+        self.assertEqual(os.stat(moc_file).st_ino, inode)
+        hits = test_alerts()
+        self.assertEqual(len(hits), 49)
+
+    def test4_jobs(self):
+        print('test jobs')
+        msl = unittest.mock.MagicMock()
+        cursor = msl.cursor.return_value
+        cursor.fetchone.return_value = {'job_id': 7, 'args': '{"wl_id": %d}' % wl_id}
+        cursor.rowcount = 1
+        self.assertEqual(claim_job(msl, 'host:1')['job_id'], 7)
+        query, args = cursor.execute.call_args[0]
+        self.assertIn("WHERE job_id=%s AND state='queued'", query)
+        self.assertEqual(args, ('host:1', 7))
+        # another run took it first
+        cursor.rowcount = 0
+        self.assertIsNone(claim_job(msl, 'host:1'))
+        cursor.fetchone.return_value = None
+        self.assertIsNone(claim_job(msl, 'host:1'))
+
+    def test5_rebuild_watchlist_locked(self):
+        print('test rebuild watchlist locked')
+        msl = unittest.mock.MagicMock()
+        cursor = msl.cursor.return_value
+        cursor.fetchone.return_value = {'wl_id': wl_id, 'name': 'watchlist_sample', 'radius': 2}
+        cursor.__iter__.return_value = iter([])
+        # the lock is held by another run
+        with unittest.mock.patch('services.make_watchlist_files.lock_watchlist', return_value=None):
+            message = rebuild_watchlist(msl, wl_id, 13, cache_dir, chunk_size, 1)
+        self.assertEqual(message, 'The watchlist files are being built by another run')
+        cursor.fetchone.return_value = None
+        message = rebuild_watchlist(msl, wl_id, 13, cache_dir, chunk_size, 1)
+        self.assertEqual(message, 'The watchlist is not active, so it has no files')
+
 if __name__ == '__main__':
     import xmlrunner
     runner = xmlrunner.XMLTestRunner(output='test-reports')
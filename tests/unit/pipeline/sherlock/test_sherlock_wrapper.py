@@ -413,6 +413,25 @@ class SherlockWrapperClassifierTest(unittest.TestCase):
                 # fetchall should have been called once
                 mock_pymysql.return_value.cursor.return_value.__enter__.return_value.fetchall.assert_called_once()
 
+class SherlockWrapperBatchTest(unittest.TestCase):
+
+    # repeated names share one row, solar system alerts give no position
+    def test_batch_name_table(self):
+        alerts = [ example_alert_ss, example_alert_no_ss, data[2], data[3], data[4] ]
+        batch = wrapper.AlertBatch(alerts)
+        self.assertEqual(batch.names, ['ZTF18aapubnx', 'ZTF18ablwvcl'])
+        self.assertEqual(batch.index, [0, 0, 1, 0, 0])
+        self.assertEqual(batch.ss, [True, False, False, False, False])
+        self.assertEqual(batch.ra[0], example_alert_no_ss['candidate']['ra'])
+        self.assertEqual(batch.to_classify(), [0, 1])
+
+    # names that only have solar system alerts or are cached are not classified
+    def test_batch_to_classify(self):
+        batch = wrapper.AlertBatch([ example_alert_ss, data[2] ])
+        self.assertEqual(batch.to_classify(), [1])
+        batch.mark_cached(['ZTF18ablwvcl', 'not_in_batch'])
+        self.assertEqual(batch.to_classify(), [])
+
 class SherlockWrapperProducerTest(unittest.TestCase):
     conf = {
         'broker':'',
@@ -0,0 +1,5 @@
+"""
+Dummy settings file for tests
+"""
+
+TNS_WATCHLIST_ID = 141
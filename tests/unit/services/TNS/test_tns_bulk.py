@@ -0,0 +1,84 @@
+import os, sys
+import unittest, unittest.mock
+import context
+python_path = '../../../../services/externalBrokers/TNS'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), python_path)))
+import tns_bulk
+
+
+def tns_row(name, **values):
+    """ A row of the TNS CSV as a dictionary, with htm16 added """
+    row = {'objid': '1', 'name_prefix': 'AT', 'name': name, 'ra': '10.5', 'declination': '-20.25',
+           'redshift': '', 'type': '', 'reporting_group': 'ZTF', 'source_group': 'ZTF',
+           'discoverydate': '2025-05-30 01:02:03.456', 'discoverymag': '18.9', 'filter': 'r',
+           'reporters': 'A. Author', 'internal_names': 'ZTF25abcdefg',
+           'lastmodified': '2025-06-01 00:00:00', 'htm16': 12345}
+    row.update(values)
+    return row
+
+
+class TNSBulkTest(unittest.TestCase):
+    def test_tns_values(self):
+        values = dict(zip(tns_bulk.COLUMNS, tns_bulk.tns_values(tns_row('2025abc'))))
+        self.assertEqual(values['ra'], 10.5)
+        self.assertEqual(values['decl'], -20.25)
+        self.assertEqual(values['tns_name'], '2025abc')
+        self.assertEqual(values['tns_prefix'], 'AT')
+        self.assertEqual(values['disc_mag'], '18.9')
+        # empty fields are NULL
+        self.assertIsNone(values['z'])
+        self.assertEqual(values['disc_int_name'], 'ZTF25abcdefg')
+        self.assertEqual(values['sender'], 'ZTF')
+        self.assertEqual(values['htm16'], 12345)
+        self.assertEqual(len(tns_bulk.COLUMNS), len(values))
+
+    def test_tns_values_cut(self):
+        """Long fields are cut down, and the unicode and quotes taken out"""
+        row = tns_row('2025abc', discoverymag='', redshift='0.05',
+            internal_names="O'Neill, " + 'x' * 80 + 'é',
+            reporting_group='A very long group name',
+            reporters="Å. O'Brien, " + 'y' * 80,
+            source_group='A source group longer than 16')
+        values = dict(zip(tns_bulk.COLUMNS, tns_bulk.tns_values(row)))
+        self.assertIsNone(values['disc_mag'])
+        self.assertEqual(values['z'], '0.05')
+        self.assertEqual(values['disc_int_name'], ('ONeill, ' + 'x' * 80)[:74] + '...')
+        self.assertEqual(values['sender'], 'A very long ...')
+        self.assertTrue(values['reporters'].startswith('?. OBrien, yyy'))
+        self.assertEqual(len(values['reporters']), 78)
+        self.assertEqual(values['source_group'], 'A source group l')
+
+    def test_tsv_field(self):
+        self.assertEqual(tns_bulk.tsv_field(None), '\\N')
+        self.assertEqual(tns_bulk.tsv_field(0.1), '0.1')
+        self.assertEqual(tns_bulk.tsv_field(123.456789012345678), repr(123.456789012345678))
+        self.assertEqual(tns_bulk.tsv_field(7), '7')
+        self.assertEqual(tns_bulk.tsv_field(''), '')
+        self.assertEqual(tns_bulk.tsv_field('a\tb\nc\rd\\e'), 'a\\tb\\nc\\rd\\\\e')
+        self.assertEqual(tns_bulk.tsv_field('é'), 'é')
+
+    def test_csv_dicts(self):
+        """The last row for a name is kept, in the order the names first came"""
+        rows = [tns_row('2025a', name_prefix='AT'), tns_row('2025b'), tns_row('2025a', name_prefix='SN')]
+        row_dicts = tns_bulk.csv_dicts(iter(rows))
+        self.assertEqual([r['name'] for r in row_dicts], ['2025a', '2025b'])
+        self.assertEqual(row_dicts[0]['name_prefix'], 'SN')
+        self.assertEqual(tns_bulk.csv_dicts([]), [])
+
+    def test_rebuild_drops_old_table(self):
+        """A crossmatch_tns_old left by a failed run is dropped before the RENAME"""
+        conn = unittest.mock.MagicMock()
+        cursor = conn.cursor.return_value
+        cursor.fetchall.return_value = []
+        with unittest.mock.patch('tns_bulk.add_htm16'), \
+                unittest.mock.patch('tns_bulk.run_crossmatch_optimised.match_objects', return_value=[]):
+            self.assertEqual(tns_bulk.rebuild(conn, [tns_row('2025a')], 3.0), (1, 0))
+        queries = [args[0][0] for args in cursor.execute.call_args_list]
+        drop = queries.index('DROP TABLE IF EXISTS crossmatch_tns_old')
+        self.assertTrue(queries[drop + 1].startswith('RENAME TABLE crossmatch_tns TO crossmatch_tns_old'))
+
+
+if __name__ == '__main__':
+    import xmlrunner
+    runner = xmlrunner.XMLTestRunner(output='test-reports')
+    unittest.main(testRunner=runner)
@@ -0,0 +1,79 @@
+import os, sys
+import unittest
+from datetime import datetime
+import context
+python_path = '../../../../services/externalBrokers/TNS'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), python_path)))
+import tns_delta
+
+
+def tns_row(name, prefix='AT', lastmodified='2025-06-01 00:00:00', ra='10.5', dec='-20.25'):
+    """ The fields of a row of the TNS CSV that changes looks at """
+    return {'name': name, 'name_prefix': prefix, 'lastmodified': lastmodified, 'ra': ra, 'declination': dec}
+
+
+class TNSDeltaTest(unittest.TestCase):
+    def test_same_time(self):
+        stored = datetime(2025, 6, 1)
+        self.assertTrue(tns_delta.same_time(stored, '2025-06-01 00:00:00'))
+        self.assertFalse(tns_delta.same_time(stored, '2025-06-01 00:00:01'))
+        self.assertFalse(tns_delta.same_time(stored, '2025-06-01 00:00:00.5'))
+
+    def test_same_time_none(self):
+        self.assertTrue(tns_delta.same_time(None, ''))
+        self.assertTrue(tns_delta.same_time(None, None))
+        self.assertFalse(tns_delta.same_time(None, '2025-06-01 00:00:00'))
+        self.assertFalse(tns_delta.same_time(datetime(2025, 6, 1), ''))
+
+    def test_same_time_fraction(self):
+        """A fraction of a second of any length is the microseconds kept by datetime(6)"""
+        stored = datetime(2025, 6, 1, 12, 30, 45, 120000)
+        self.assertTrue(tns_delta.same_time(stored, '2025-06-01 12:30:45.12'))
+        self.assertTrue(tns_delta.same_time(stored, '2025-06-01 12:30:45.120'))
+        self.assertTrue(tns_delta.same_time(stored, '2025-06-01 12:30:45.120000'))
+        self.assertTrue(tns_delta.same_time(stored, '2025-06-01 12:30:45.1200004'))
+        self.assertFalse(tns_delta.same_time(stored, '2025-06-01 12:30:45.121'))
+        self.assertFalse(tns_delta.same_time(stored, '2025-06-01 12:30:45'))
+        # rounded up into the next second
+        self.assertTrue(tns_delta.same_time(datetime(2025, 6, 1, 12, 30, 46), '2025-06-01 12:30:45.9999999'))
+
+    def test_same_time_unparsed(self):
+        """A time that does not parse is compared as text"""
+        self.assertFalse(tns_delta.same_time(datetime(2025, 6, 1), 'yesterday'))
+        self.assertTrue(tns_delta.same_time('yesterday', 'yesterday'))
+
+    def test_changes(self):
+        existing = {
+            '2025a': ('AT', datetime(2025, 6, 1), 10.5, -20.25),
+            '2025b': ('AT', datetime(2025, 6, 1), 10.5, -20.25),
+            '2025c': ('AT', datetime(2025, 6, 1), 10.5, -20.25),
+            '2025d': ('AT', datetime(2025, 6, 1), 10.5, -20.25),
+            '2025e': ('AT', datetime(2025, 6, 1, 0, 0, 0, 250000), 10.5, -20.25),
+            '2025f': ('AT', None, None, None),
+            '2025g': ('AT', datetime(2025, 6, 1), 10.5, -20.25),
+            '2025h': ('AT', None, 10.5, -20.25),
+        }
+        rows = [
+            tns_row('2026a'),                                           # new
+            tns_row('2025a'),                                           # unchanged
+            tns_row('2025b', prefix='SN'),                              # classified
+            tns_row('2025c', lastmodified='2025-06-02 00:00:00'),       # changed
+            tns_row('2025d', lastmodified='2025-06-02 00:00:00', ra='10.5001'),   # moved
+            tns_row('2025e', lastmodified='2025-06-01 00:00:00.25'),    # unchanged, to a fraction of a second
+            tns_row('2025f', lastmodified='2025-06-02 00:00:00'),       # no position stored
+            tns_row('2025g', lastmodified='2025-06-02 00:00:00', dec='-20.25000001'),  # too little to move
+            tns_row('2025h', lastmodified=''),                          # unchanged, with no time
+        ]
+        new, changed, moved = tns_delta.changes(rows, existing)
+        self.assertEqual([r['name'] for r in new], ['2026a'])
+        self.assertEqual([r['name'] for r in changed], ['2025b', '2025c', '2025d', '2025f', '2025g'])
+        self.assertEqual([r['name'] for r in moved], ['2025d', '2025f'])
+
+    def test_changes_empty(self):
+        self.assertEqual(tns_delta.changes([], {}), ([], [], []))
+
+
+if __name__ == '__main__':
+    import xmlrunner
+    runner = xmlrunner.XMLTestRunner(output='test-reports')
+    unittest.main(testRunner=runner)
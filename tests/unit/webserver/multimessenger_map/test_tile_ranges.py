@@ -0,0 +1,81 @@
+import context
+import random
+import unittest
+from bisect import bisect_right
+from gkhtm import _gkhtm as htmCircle
+from lasair.apps.multimessenger_map.utils import tile_ranges, in_tiles, TILE, NRA
+
+# positions drawn inside the tiles of each test
+NPOSITIONS = 3000
+
+
+def random_positions(tiles, n):
+    """ Positions drawn uniformly inside a list of histogram tiles """
+    positions = []
+    for k in range(n):
+        (i, j) = random.choice(tiles)
+        ra = random.uniform(TILE * i, TILE * (i + 1)) % 360
+        dec = random.uniform(90 - TILE * (j + 1), 90 - TILE * j)
+        positions.append([ra, dec])
+    return positions
+
+
+def in_ranges(ranges, htm16):
+    """ Whether an htm16 ID is in one of a sorted list of (lo, hi) ranges """
+    k = bisect_right(ranges, (htm16, float('inf'))) - 1
+    return k >= 0 and ranges[k][0] <= htm16 <= ranges[k][1]
+
+
+class MultimessengerTileRangesTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(42)
+
+    def assertCovered(self, tiles):
+        """ Every position inside the tiles has its htm16 in the ranges """
+        ranges = tile_ranges(tiles)
+        positions = random_positions(tiles, NPOSITIONS)
+        htm16s = htmCircle.htmIDBulk(16, positions)
+        missed = [p for (p, htm16) in zip(positions, htm16s) if not in_ranges(ranges, htm16)]
+        self.assertEqual(missed, [])
+        return ranges
+
+    def test_region(self):
+        """A block of tiles away from the poles and the seam"""
+        tiles = [(i, j) for i in range(20, 26) for j in range(10, 15)]
+        ranges = self.assertCovered(tiles)
+        # merged, sorted and apart
+        for (a, b) in zip(ranges, ranges[1:]):
+            self.assertLess(a[1] + 1, b[0])
+        # and nothing far from the tiles
+        positions = [[300.0, -40.0], [10.0, 80.0], [115.0, -60.0]]
+        for htm16 in htmCircle.htmIDBulk(16, positions):
+            self.assertFalse(in_ranges(ranges, htm16))
+
+    def test_poles(self):
+        """Tiles at both poles, some of each cap and all of the other"""
+        tiles = [(i, 0) for i in range(0, NRA, 3)] + [(i, 35) for i in range(NRA)]
+        self.assertCovered(tiles)
+
+    def test_seam(self):
+        """Tiles either side of RA 0 and 360"""
+        tiles = [(i, j) for i in (NRA - 2, NRA - 1, 0, 1) for j in range(12, 24)]
+        self.assertCovered(tiles)
+
+    def test_single_tile(self):
+        """One tile on the seam next to the equator"""
+        self.assertCovered([(NRA - 1, 17)])
+
+    def test_no_tiles(self):
+        self.assertEqual(tile_ranges([]), [])
+
+    def test_in_tiles(self):
+        tiles = {(0, 0), (NRA - 1, 35)}
+        self.assertTrue(in_tiles(tiles, 360.0, 89.0))
+        self.assertTrue(in_tiles(tiles, 359.0, -90.0))
+        self.assertFalse(in_tiles(tiles, 5.0, 89.0))
+
+
+if __name__ == '__main__':
+    import xmlrunner
+    runner = xmlrunner.XMLTestRunner(output='test-reports')
+    unittest.main(testRunner=runner)
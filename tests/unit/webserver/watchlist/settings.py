@@ -0,0 +1,6 @@
+"""
+Dummy settings file for tests
+"""
+
+
+pass
@@ -0,0 +1,101 @@
+import context
+import math
+import unittest, unittest.mock
+from lasair.apps.watchlist import utils
+from lasair.apps.watchlist.utils import parse_cone_chunk, parse_cones, upload_cones
+
+
+def connection():
+    """ A mock read-write database connection """
+    msl = unittest.mock.MagicMock()
+    return msl, msl.cursor.return_value
+
+
+class WatchlistUploadTest(unittest.TestCase):
+    def test_parse_cone_chunk(self):
+        cones, errors, renamed = parse_cone_chunk([
+            '10.5, -20.25, star1',
+            '0,90,star2,3.5',
+            '360|-90|star3|none',
+            '1,2,star4,',
+        ])
+        self.assertEqual(errors, [])
+        self.assertEqual(renamed, [])
+        self.assertEqual(cones['name'].tolist(), ['star1', 'star2', 'star3', 'star4'])
+        self.assertEqual(cones['ra'].tolist(), [10.5, 0, 360, 1])
+        self.assertEqual(cones['decl'].tolist(), [-20.25, 90, -90, 2])
+        radius = cones['radius'].tolist()
+        self.assertEqual(radius[1], 3.5)
+        # no radius, None or empty, is the default of the watchlist
+        self.assertTrue(math.isnan(radius[0]))
+        self.assertTrue(math.isnan(radius[2]))
+        self.assertTrue(math.isnan(radius[3]))
+
+    def test_parse_cone_chunk_bad(self):
+        """Lines out of range or that do not parse are errors, and the rest are kept"""
+        lines = [
+            '-0.1,10,low_ra',
+            '360.1,10,high_ra',
+            '10,-90.5,low_dec',
+            '10,90.5,high_dec',
+            'ten,10,not_a_number',
+            '10,10',
+            '10,10,',
+            '10,10, ,3',
+            '10,10,bad_radius,wide',
+            '10,10,good',
+        ]
+        cones, errors, renamed = parse_cone_chunk(lines)
+        self.assertEqual(errors, lines[:-1])
+        self.assertEqual(cones['name'].tolist(), ['good'])
+
+    def test_parse_cone_chunk_renamed(self):
+        cones, errors, renamed = parse_cone_chunk(['10,10,Étoile', '11,11,plain'])
+        self.assertEqual(renamed, [('Étoile', 'toile')])
+        self.assertEqual(cones['name'].tolist(), ['toile', 'plain'])
+
+    def test_parse_cones(self):
+        """Comments and blank lines are skipped, and the rest parsed a chunk at a time"""
+        lines = ['# ra,dec,name\n', '\n', '1,1,a\n', '2,2,b\n', '   \n', '3,3,c\n']
+        chunks = list(parse_cones(lines, chunk=2))
+        self.assertEqual([c['name'].tolist() for (c, e, r) in chunks], [['a', 'b'], ['c']])
+
+    def test_upload_cones(self):
+        msl, cursor = connection()
+        lines = ['1,1,a', '2,2,b,5', 'bad line']
+        with unittest.mock.patch.object(utils.db_connect, 'remote', return_value=msl):
+            count, errors, renamed = upload_cones(42, lines, 10)
+        self.assertEqual((count, errors, renamed), (2, ['bad line'], []))
+        query, rows = cursor.executemany.call_args[0]
+        self.assertIn('INSERT INTO watchlist_cones', query)
+        self.assertEqual(rows, [(42, 'a', 1.0, 1.0, None), (42, 'b', 2.0, 2.0, 5.0)])
+        msl.commit.assert_called_once()
+        msl.close.assert_called_once()
+
+    def test_upload_cones_messages_capped(self):
+        msl, cursor = connection()
+        lines = ['bad %d' % i for i in range(utils.MAX_CONE_MESSAGES + 10)]
+        lines += ['%d,%d,É%d' % (i, i, i) for i in range(utils.MAX_CONE_MESSAGES + 10)]
+        with unittest.mock.patch.object(utils.db_connect, 'remote', return_value=msl), \
+                unittest.mock.patch.object(utils, 'CONE_CHUNK', 7):
+            count, errors, renamed = upload_cones(42, lines, 1000)
+        self.assertEqual(count, utils.MAX_CONE_MESSAGES + 10)
+        self.assertEqual(errors, lines[:utils.MAX_CONE_MESSAGES])
+        self.assertEqual(len(renamed), utils.MAX_CONE_MESSAGES)
+
+    def test_upload_cones_too_many(self):
+        """More than max_cones rolls back what was inserted"""
+        msl, cursor = connection()
+        lines = ['%d,%d,s%d' % (i, i, i) for i in range(5)]
+        with unittest.mock.patch.object(utils.db_connect, 'remote', return_value=msl):
+            count, errors, renamed = upload_cones(42, lines, 4)
+        self.assertEqual(count, -1)
+        msl.rollback.assert_called_once()
+        msl.commit.assert_not_called()
+        msl.close.assert_called_once()
+
+
+if __name__ == '__main__':
+    import xmlrunner
+    runner = xmlrunner.XMLTestRunner(output='test-reports')
+    unittest.main(testRunner=runner)
@@ -2,7 +2,7 @@ import sys
 sys.path.append('../common')
 import settings
 from src import date_nid, db_connect
-from src.manage_status import manage_status
+from src.manage_status import status_for
 
 def main():
     msl = db_connect.readonly()
@@ -15,7 +15,7 @@ def main():
         countAnnotations = row['countAnnotations']
     cursor.close ()
 
-    ms = manage_status(settings.SYSTEM_STATUS)
+    ms = status_for(settings, db_connect.remote)
     nid = date_nid.nid_now()
     ms.set({'countAnnotations':countAnnotations}, nid)
 
@@ -0,0 +1,257 @@
+"""
+Backfills Sherlock classifications for Lasair. Takes a directory of shard files,
+each line being a whitespace separated triplet objectId, ra, dec, and classifies
+them with Sherlock in batches, writing the results straight into the
+sherlock_classifications table with bulk REPLACE statements.
+
+Objects already in the Sherlock cache table are not classified again, their
+cached classification is written instead. The cache is read and written in
+the same format as the Sherlock wrapper: the JSON of the best crossmatch, or
+NULL for an object with none. Each shard keeps a checkpoint file
+next to it with the number of lines done, so a killed run can be restarted
+with the same command and carries on where it left off.
+
+Usage:
+    backfill.py [--nprocess=NP] [--batch=N] [--cache_db=URL] [--sherlock_settings=S] (--in=IN) [--files=file_list]
+
+Options:
+  --nprocess=NP          Number of processes to use [default: 1]
+  --batch=N              Objects per Sherlock batch [default: 1000]
+  --cache_db=URL         Sherlock cache database, e.g. mysql://user:pw@host:3306/database
+  --sherlock_settings=S  Sherlock settings file [default: /opt/lasair/sherlock_settings.yaml]
+  --in=IN                Directory name for the shard files
+  --files=file_list      Comma separated shards to process, default is every shard in the directory
+"""
+import os, sys, time, json, logging
+sys.path.append('../..')
+sys.path.append('../../../common')
+import settings
+from src import db_connect
+from docopt import docopt
+from multiprocessing import Pool
+from urllib.parse import urlparse
+import pymysql.cursors
+from sherlock_batch import classify, sherlock_version
+
+sherlock_attributes = [
+    "classification",
+    "objectId",
+    "association_type",
+    "catalogue_table_name",
+    "catalogue_object_id",
+    "catalogue_object_type",
+    "raDeg",
+    "decDeg",
+    "separationArcsec",
+    "northSeparationArcsec",
+    "eastSeparationArcsec",
+    "physical_separation_kpc",
+    "direct_distance",
+    "distance",
+    "z",
+    "photoZ",
+    "photoZErr",
+    "Mag",
+    "MagFilter",
+    "MagErr",
+    "classificationReliability",
+    "major_axis_arcsec",
+    "annotator",
+    "additional_output",
+    "description",
+    "summary",
+]
+
+def read_checkpoint(filename):
+    """ Number of lines of the shard already done """
+    try:
+        return int(open(filename + '.checkpoint').read().strip())
+    except:
+        return 0
+
+def write_checkpoint(filename, ndone):
+    """ Write the checkpoint atomically so a kill never leaves it half written """
+    tmp = filename + '.checkpoint.tmp'
+    f = open(tmp, 'w')
+    f.write('%d\n' % ndone)
+    f.close()
+    os.replace(tmp, filename + '.checkpoint')
+
+def cache_connect(cache_db):
+    url = urlparse(cache_db)
+    return pymysql.connect(
+        host=url.hostname,
+        port=url.port or 3306,
+        user=url.username,
+        password=url.password,
+        db=url.path.lstrip('/'),
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor)
+
+def add_annotator(ann, name):
+    """ The annotator and additional_output of an annotation, as the Sherlock wrapper sets them """
+    ann['annotator'] = "https://github.com/thespacedoctor/sherlock/releases/tag/v{}".format(sherlock_version)
+    ann['additional_output'] = "http://lasair-ztf.lsst.ac.uk/api/sherlock/object/" + name
+
+def cache_lookup(cache_conn, names):
+    """ Fetch the cached annotations for a list of names, same format as the Sherlock wrapper.
+        An entry whose crossmatch is "NULL" is an object with no match, such as an orphan,
+        and gives just its classification """
+    annotations = {}
+    if not cache_conn or not names:
+        return annotations
+    query = "SELECT * FROM cache WHERE name IN (%s)" % ','.join(['%s'] * len(names))
+    with cache_conn.cursor() as cursor:
+        cursor.execute(query, names)
+        for result in cursor.fetchall():
+            if result.get('crossmatch') == 'NULL':
+                match = {}
+            else:
+                try:
+                    match = json.loads(result.get('crossmatch'))
+                except (TypeError, ValueError):
+                    continue
+            annotations[result['name']] = {'classification': result['class']}
+            for key, value in match.items():
+                if key != 'rank':
+                    annotations[result['name']][key] = value
+    return annotations
+
+def cache_update(cache_conn, objects):
+    """ Put freshly classified objects into the cache so that the wrapper and later runs use them.
+        Called before the annotations are changed for sherlock_classifications, as the
+        crossmatch is what Sherlock gave, with its transient_object_id, or "NULL" if none """
+    values = []
+    for obj in objects:
+        ann = obj['annotations']['sherlock'][0]
+        if 'transient_object_id' in ann:
+            crossmatch = json.dumps({k: v for k, v in ann.items()
+                if k not in ['classification', 'description', 'annotator', 'additional_output']})
+        else:
+            crossmatch = "NULL"
+        values.append((obj['objectId'], ann['classification'], crossmatch))
+    if not values:
+        return
+    query = "INSERT INTO cache VALUES (%s,%s,%s) "
+    query += "ON DUPLICATE KEY UPDATE class=VALUES(class), crossmatch=VALUES(crossmatch)"
+    with cache_conn.cursor() as cursor:
+        cursor.executemany(query, values)
+    cache_conn.commit()
+
+def insert_classifications(msl, annotations):
+    """ Bulk REPLACE of annotations into sherlock_classifications """
+    if not annotations:
+        return
+    query = 'REPLACE INTO sherlock_classifications (%s) VALUES (%s)'
+    query = query % (','.join(sherlock_attributes), ','.join(['%s'] * len(sherlock_attributes)))
+    rows = [tuple(ann.get(a) for a in sherlock_attributes) for ann in annotations]
+    cursor = msl.cursor()
+    cursor.executemany(query, rows)
+    cursor.close()
+    msl.commit()
+
+def read_shard(filename, skip):
+    """ Parse the shard, skipping lines already done """
+    objects = []
+    for i, line in enumerate(open(filename)):
+        if i < skip:
+            continue
+        try:
+            [objectId, ra, dec] = line.split()
+            objects.append({'objectId': objectId, 'ra': float(ra), 'dec': float(dec)})
+        except ValueError:
+            objects.append(None)   # keep line numbers aligned with the checkpoint
+    return objects
+
+def run_shard(runargs):
+    """ Classify one shard, return the number of objects written """
+    filename = runargs['filename']
+    batch_size = runargs['batch']
+    shard = os.path.basename(filename)
+    log = logging.getLogger('sherlock_backfill')
+
+    skip = read_checkpoint(filename)
+    objects = read_shard(filename, skip)
+    ntotal = len(objects)
+    if ntotal == 0:
+        print('%s: already done' % shard, flush=True)
+        return 0
+    print('%s: %d to do, %d done previously' % (shard, ntotal, skip), flush=True)
+
+    msl = db_connect.remote()
+    cache_conn = cache_connect(runargs['cache_db']) if runargs['cache_db'] else None
+
+    conf = {'sherlock_settings': runargs['sherlock_settings']}
+    ndone = nwritten = ncached = 0
+    t = time.time()
+    for i in range(0, ntotal, batch_size):
+        batch = [obj for obj in objects[i:i+batch_size] if obj]
+        names = [obj['objectId'] for obj in batch]
+
+        cached = cache_lookup(cache_conn, names)
+        annotations = []
+        for name, ann in cached.items():
+            ann.pop('transient_object_id', None)
+            ann['objectId'] = name
+            add_annotator(ann, name)
+            annotations.append(ann)
+        ncached += len(cached)
+
+        todo = [obj for obj in batch if obj['objectId'] not in cached]
+        if todo:
+            classify(conf, log, todo)
+            todo = [obj for obj in todo if 'annotations' in obj]
+            if cache_conn:
+                cache_update(cache_conn, todo)
+            for obj in todo:
+                ann = obj['annotations']['sherlock'][0]
+                ann.pop('transient_object_id', None)
+                ann['objectId'] = obj['objectId']
+                annotations.append(ann)
+
+        insert_classifications(msl, annotations)
+        nwritten += len(annotations)
+        ndone += len(objects[i:i+batch_size])
+        write_checkpoint(filename, skip + ndone)
+
+        elapsed = time.time() - t
+        rate = ndone / elapsed
+        eta = (ntotal - ndone) / rate if rate > 0 else 0
+        print('%s: %d of %d, %d from cache, %.1f objects/sec, ETA %.1f minutes' %
+            (shard, ndone, ntotal, ncached, rate, eta / 60), flush=True)
+
+    msl.close()
+    if cache_conn:
+        cache_conn.close()
+    return nwritten
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    logging.basicConfig(format='%(asctime)s:%(levelname)s:%(message)s', level=logging.WARNING)
+    indir = args['--in']
+    if args['--files']:
+        files = args['--files'].split(',')
+    else:
+        files = sorted(f for f in os.listdir(indir) if not '.checkpoint' in f)
+    nprocess = int(args['--nprocess'])
+    print('Running %d shards on %d processes' % (len(files), nprocess))
+
+    runargs_list = []
+    for f in files:
+        runargs_list.append({
+            'filename': os.path.join(indir, f),
+            'batch': int(args['--batch']),
+            'cache_db': args['--cache_db'],
+            'sherlock_settings': args['--sherlock_settings'],
+        })
+
+    tstart = time.time()
+    nwritten = 0
+    with Pool(nprocess) as pool:
+        for ishard, n in enumerate(pool.imap_unordered(run_shard, runargs_list)):
+            nwritten += n
+            elapsed = time.time() - tstart
+            remaining = elapsed / (ishard+1) * (len(files) - ishard - 1)
+            print('%d of %d shards finished, %d objects written, %.1f objects/sec, ETA %.1f minutes' %
+                (ishard+1, len(files), nwritten, nwritten/elapsed, remaining/60), flush=True)
+    print('Finished in %.1f seconds' % (time.time() - tstart))
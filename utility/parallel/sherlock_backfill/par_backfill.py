@@ -0,0 +1,59 @@
+""" Head node for the Sherlock backfill.
+Splits an input file of objectId, ra, dec lines into shards in a shared directory,
+then runs backfill.py on the shards, either on this machine or across hosts with ssh_cluster.
+Shards already split are not split again, so a rerun picks up the checkpoints.
+
+Usage:
+    par_backfill.py [--nshard=NS] [--nprocess=NP] [--cache_db=URL] [--hosts=H] (--input=INPUT) (--workdir=WORKDIR)
+
+Options:
+  --nshard=NS     Number of shard files to split the input into [default: 32]
+  --nprocess=NP   Processes per host [default: 4]
+  --cache_db=URL  Sherlock cache database, e.g. mysql://user:pw@host:3306/database
+  --hosts=H       Comma separated worker hosts, default is to run on this machine
+  --input=INPUT   File of objectId ra dec lines
+  --workdir=WORKDIR  Shared directory (e.g. on cephfs) for the shards and checkpoints
+"""
+import os, sys, time
+sys.path.append('..')
+from docopt import docopt
+
+def split_input(infile, tasksdir, nshard):
+    """ Deal the input lines round robin into nshard files """
+    os.makedirs(tasksdir, exist_ok=True)
+    if os.listdir(tasksdir):
+        print('Using existing shards in %s' % tasksdir)
+        return sorted(f for f in os.listdir(tasksdir) if not '.checkpoint' in f)
+    names = ['shard%04d' % i for i in range(nshard)]
+    shards = [open(os.path.join(tasksdir, name), 'w') for name in names]
+    n = 0
+    for line in open(infile):
+        shards[n % nshard].write(line)
+        n += 1
+    for f in shards:
+        f.close()
+    print('Split %d objects into %d shards' % (n, nshard))
+    return names
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    tasksdir = os.path.join(args['--workdir'], 'tasks')
+    names = split_input(args['--input'], tasksdir, int(args['--nshard']))
+    nprocess = int(args['--nprocess'])
+
+    options = '--in=%s --nprocess=%d' % (tasksdir, nprocess)
+    if args['--cache_db']:
+        options += ' --cache_db=%s' % args['--cache_db']
+
+    if not args['--hosts']:
+        os.system('python3 backfill.py %s' % options)
+        sys.exit()
+
+    from ssh_cluster import run_commands_on_hosts
+    hosts = args['--hosts'].split(',')
+    cmdlist = []
+    for i in range(0, len(names), nprocess):
+        cmd = 'cd /home/ubuntu/lasair4/utility/parallel/sherlock_backfill; '
+        cmd += 'python3 backfill.py %s --files=%s' % (options, ','.join(names[i:i+nprocess]))
+        cmdlist.append(cmd)
+    run_commands_on_hosts(cmdlist, hosts)
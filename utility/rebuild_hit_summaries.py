@@ -0,0 +1,27 @@
+""" Remake watchlist_summary and area_summary from the hits tables,
+for all watchlists and watchmaps or the ones given. Run once when the
+summary tables are created, and whenever they are thought to have drifted.
+
+Usage: python3 rebuild_hit_summaries.py [watchlist|area] [id ...]
+"""
+import sys
+sys.path.append('../common')
+import settings
+sys.path.append('../common/src')
+import db_connect, hit_summary
+
+if __name__ == "__main__":
+    kinds = sys.argv[1:2] or ['watchlist', 'area']
+    msl = db_connect.remote()
+    cursor = msl.cursor(buffered=True, dictionary=True)
+    for kind in kinds:
+        if kind not in hit_summary.KINDS:
+            print(__doc__)
+            sys.exit()
+        ids = [int(id) for id in sys.argv[2:]]
+        if not ids:
+            table = {'watchlist': 'watchlists', 'area': 'areas'}[kind]
+            cursor.execute('SELECT %s AS id FROM %s' % (hit_summary.KINDS[kind]['id'], table))
+            ids = [row['id'] for row in cursor.fetchall()]
+        hit_summary.rebuild(msl, kind, ids)
+        print('%d %s summaries rebuilt' % (len(ids), kind))
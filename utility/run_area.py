@@ -3,7 +3,7 @@ from mocpy import MOC
 sys.path.append('../common')
 import settings
 sys.path.append('../common/src')
-import db_connect, lasairLogging
+import db_connect, lasairLogging, hit_summary
 sys.path.append('../pipeline/filter')
 from check_alerts_areas import check_alerts_against_area
 from check_alerts_areas import fetch_alerts, insert_area_hits
@@ -39,6 +39,8 @@ def run_area(msl, ar_id):
         insert_area_hits(msl, hits)
         print('Inserted into database')
 
+    hit_summary.rebuild(msl, 'area', [ar_id])
+
 if __name__ == "__main__":
     lasairLogging.basicConfig(stream=sys.stdout)
     log = lasairLogging.getLogger("filter")
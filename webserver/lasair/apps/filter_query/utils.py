@@ -2,6 +2,7 @@ from lasair.query_builder import check_query, build_query
 from src import db_connect
 from lasair.apps.db_schema.utils import get_schema, get_schema_dict, get_schema_for_query_selected
 from lasair.utils import datetime_converter
+from lasair.query_cache import cached
 import settings
 import os
 import json
@@ -74,13 +75,16 @@ def run_filter(
     else:
         topic = False
 
-    try:
+    def run():
         cursor.execute(sqlquery_limit)
+        return cursor.fetchall()
+
+    try:
+        table = cached('filter', sqlquery_real, limit, offset, run)
     except Exception as e:
         error = 'Your query:<br/><b>' + sqlquery_limit + '</b><br/>returned the error<br/><i>' + str(e) + '</i>'
         return None, None, None, None, error
 
-    table = cursor.fetchall()
     count = len(table)
 
     # if count == limit:
@@ -200,12 +204,13 @@ def topic_refresh(real_sql, topic, limit=10):
              % (timeout, real_sql, limit))
     msl = db_connect.readonly()
     cursor = msl.cursor(buffered=True, dictionary=True)
-    query_results = []
-    try:
+
+    def run():
         cursor.execute(query)
-        for record in cursor:
-            recorddict = dict(record)
-            query_results.append(recorddict)
+        return [dict(record) for record in cursor]
+
+    try:
+        query_results = cached('topic', real_sql, int(limit), 0, run)
     except Exception as e:
         message += "SQL error for %s: %s" % (topic, str(e))
         return message
@@ -0,0 +1,32 @@
+"""Run the background job workers.
+
+Usage: python3 manage.py run_jobs --settings lasair.settings [--workers N] [--once]
+"""
+import multiprocessing
+from django.core.management.base import BaseCommand
+from django.db import connections
+import settings as lasair_settings
+from lasair.apps.jobs.utils import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Run workers for the background job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(lasair_settings, 'JOBS_WORKERS', 2),
+                            help='number of worker processes')
+        parser.add_argument('--once', action='store_true',
+                            help='stop when the queue has nothing to run')
+
+    def handle(self, *args, **options):
+        if options['workers'] <= 1:
+            run_worker(once=options['once'])
+            return
+        # each process makes its own database connection
+        connections.close_all()
+        workers = [multiprocessing.Process(target=run_worker, kwargs={'once': options['once']})
+                   for i in range(options['workers'])]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
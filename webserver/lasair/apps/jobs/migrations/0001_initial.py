@@ -0,0 +1,46 @@
+# Generated by Django 4.0.4 on 2026-10-19 12:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('job_id', models.AutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=32)),
+                ('target', models.CharField(blank=True, max_length=64, null=True)),
+                ('args', models.TextField(blank=True, null=True)),
+                ('state', models.CharField(default='queued', max_length=16)),
+                ('progress', models.FloatField(default=0)),
+                ('message', models.TextField(blank=True, null=True)),
+                ('worker', models.CharField(blank=True, max_length=64, null=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True, null=True)),
+                ('date_started', models.DateTimeField(blank=True, null=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, db_column='user', null=True, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'jobs',
+                'managed': True,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['state', 'job_id'], name='jobs_state'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['target', 'kind'], name='jobs_target'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import models
+from django.contrib.auth.models import User
+
+# A JOB IS WORK FROM A WEB ACTION THAT TAKES TOO LONG FOR THE REQUEST
+# IT IS QUEUED BY THE VIEW AND RUN BY A WORKER PROCESS (manage.py run_jobs)
+# THE TARGET NAMES WHAT IT WORKS ON, E.G. watchlist:12, SO PAGES CAN SHOW ITS STATE
+
+
+class Job(models.Model):
+    """Job.
+    """
+
+    job_id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, models.DO_NOTHING, db_column='user', blank=True, null=True)
+    kind = models.CharField(max_length=32)
+    target = models.CharField(max_length=64, blank=True, null=True)
+    args = models.TextField(blank=True, null=True)
+    state = models.CharField(max_length=16, default='queued')
+    progress = models.FloatField(default=0)
+    message = models.TextField(blank=True, null=True)
+    worker = models.CharField(max_length=64, blank=True, null=True)
+    date_created  = models.DateTimeField(auto_now_add=True, editable=False, blank=True, null=True)
+    date_started  = models.DateTimeField(blank=True, null=True)
+    date_finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        """Meta.
+        """
+        managed = True
+        db_table = 'jobs'
+        indexes = [
+            models.Index(fields=['state', 'job_id'], name='jobs_state'),
+            models.Index(fields=['target', 'kind'], name='jobs_target'),
+        ]
+
+    def __str__(self):
+        return '%d %s %s: %s' % (self.job_id, self.kind, self.target, self.state)
@@ -0,0 +1,52 @@
+"""The kinds of job run by the workers, registered with @handler.
+"""
+from src import db_connect
+from lasair.utils import bytes2string, string2bytes
+from .utils import handler
+
+
+@handler('watchlist_crossmatch')
+def watchlist_crossmatch(job, progress, wl_id, radius, wlMax=False):
+    """*match a watchlist against all objects, replacing its hits*"""
+    import src.run_crossmatch_optimised as run_crossmatch
+
+    def objects_done(done, total):
+        progress(done / total, '%d of about %d objects matched' % (done, total))
+
+    msl = db_connect.remote()
+    try:
+        hits, message = run_crossmatch.run_crossmatch(msl, radius, wl_id, wlMax=wlMax, progress=objects_done)
+    finally:
+        msl.close()
+    if int(hits) == -1:
+        raise Exception(message)
+    return message
+
+
+@handler('watchlist_copy')
+def watchlist_copy(job, progress, from_wl_id, to_wl_id):
+    """*copy the cones of one watchlist into another*"""
+    msl = db_connect.remote()
+    cursor = msl.cursor(buffered=True)
+    try:
+        cursor.execute('INSERT INTO watchlist_cones (wl_id, name, ra, decl, radius) '
+                       'SELECT %s, name, ra, decl, radius FROM watchlist_cones WHERE wl_id=%s',
+                       (to_wl_id, from_wl_id))
+        msl.commit()
+        n = cursor.rowcount
+    finally:
+        msl.close()
+    return '%d sources copied to the watchlist' % n
+
+
+@handler('watchmap_image')
+def watchmap_image(job, progress, ar_id):
+    """*draw the sky plot of a watchmap*"""
+    from lasair.apps.watchmap.models import Watchmap
+    from lasair.apps.watchmap.utils import make_image_of_MOC
+    wm = Watchmap.objects.get(ar_id=ar_id)
+    png_bytes = make_image_of_MOC(string2bytes(wm.moc), request=None)
+    if not isinstance(png_bytes, bytes):
+        raise Exception('Cannot make MOC from given file')
+    Watchmap.objects.filter(ar_id=ar_id).update(mocimage=bytes2string(png_bytes))
+    return 'The sky map has been drawn'
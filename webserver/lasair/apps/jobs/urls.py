@@ -0,0 +1,6 @@
+from . import views
+from django.urls import path
+
+urlpatterns = [
+    path('jobs/<int:job_id>/', views.job_status, name='job_status'),
+]
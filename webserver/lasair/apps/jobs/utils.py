@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import socket
+import datetime
+from django.utils import timezone
+from django.db import connection, transaction
+from django.db.models import Count
+import settings as lasair_settings
+from .models import Job
+
+# jobs one user may have running at once, the rest wait in the queue
+JOBS_PER_USER = getattr(lasair_settings, 'JOBS_PER_USER', 1)
+
+# seconds an idle worker waits before looking at the queue again
+JOBS_POLL = getattr(lasair_settings, 'JOBS_POLL', 2)
+
+# seconds after which a running job is taken to have died with its worker
+JOBS_TIMEOUT = getattr(lasair_settings, 'JOBS_TIMEOUT', 6 * 3600)
+
+ACTIVE = ['queued', 'running']
+
+# kinds of job run on the services host by the service itself, not by these workers
+SERVICE_KINDS = ['watchlist_files']
+
+# the database lock held by a worker while it claims, so the count of a user's running jobs cannot change meanwhile
+CLAIM_LOCK = 'lasair_jobs_claim'
+
+# kind of job -> function(job, progress, **args) returning a message, filled by @handler
+HANDLERS = {}
+
+
+def handler(kind):
+    """*register the function that runs a kind of job*
+
+    The function is called with the job, a progress function of (fraction, message),
+    and the arguments given to `enqueue`, and returns a message for the user.
+
+    **Key Arguments:**
+
+    - `kind` -- name of the kind of job
+
+    **Usage:**
+
+    ```python
+    @handler('watchmap_image')
+    def watchmap_image(job, progress, ar_id):
+        ...
+        return 'The sky map has been drawn'
+    ```
+    """
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def enqueue(
+        kind,
+        user,
+        target=None,
+        **args):
+    """*put a job on the queue and return it, for a worker to run*
+
+    **Key Arguments:**
+
+    - `kind` -- the kind of job, registered with `handler`
+    - `user` -- the user the job is for, whose jobs are limited to JOBS_PER_USER at once
+    - `target` -- what the job works on, e.g. `watchlist:12`, for `latest_job`
+    - `args` -- keyword arguments for the handler, which must go into JSON
+
+    **Usage:**
+
+    ```python
+    from lasair.apps.jobs.utils import enqueue
+    job = enqueue('watchlist_crossmatch', request.user, 'watchlist:%d' % wl_id, wl_id=wl_id)
+    ```
+    """
+    if user is not None and not user.is_authenticated:
+        user = None
+    return Job.objects.create(kind=kind, user=user, target=target, args=json.dumps(args))
+
+
+def latest_job(kind, target):
+    """*return the most recent job of this kind for the target, or None*
+
+    **Key Arguments:**
+
+    - `kind` -- the kind of job
+    - `target` -- what the job works on, as given to `enqueue`
+    """
+    return Job.objects.filter(kind=kind, target=target).order_by('-job_id').first()
+
+
+def active_job(kind, target):
+    """*return a queued or running job of this kind for the target, or None*
+
+    **Key Arguments:**
+
+    - `kind` -- the kind of job
+    - `target` -- what the job works on, as given to `enqueue`
+    """
+    return Job.objects.filter(kind=kind, target=target, state__in=ACTIVE).order_by('-job_id').first()
+
+
+def claim(worker):
+    """*take the oldest queued job whose user is below JOBS_PER_USER running jobs, or None*
+
+    Workers claim one at a time, holding the database lock CLAIM_LOCK around
+    the count of each user's running jobs and the claim, so two workers
+    cannot both take a job for the same user.
+
+    **Key Arguments:**
+
+    - `worker` -- name of the worker, recorded on the job
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT GET_LOCK(%s, %s)', [CLAIM_LOCK, JOBS_POLL])
+        if cursor.fetchone()[0] != 1:
+            return None
+    try:
+        now = timezone.now()
+        # jobs whose worker died
+        Job.objects.filter(state='running', date_started__lt=now - datetime.timedelta(seconds=JOBS_TIMEOUT)) \
+            .update(state='failed', message='The job did not finish in time', date_finished=now)
+
+        with transaction.atomic():
+            busy = Job.objects.filter(state='running', user__isnull=False).exclude(kind__in=SERVICE_KINDS) \
+                .values('user').annotate(n=Count('job_id')).filter(n__gte=JOBS_PER_USER)
+            job = Job.objects.select_for_update(skip_locked=True) \
+                .filter(state='queued').exclude(kind__in=SERVICE_KINDS) \
+                .exclude(user__in=[b['user'] for b in busy]) \
+                .order_by('job_id').first()
+            if job is None:
+                return None
+            job.state = 'running'
+            job.worker = worker
+            job.date_started = now
+            job.save(update_fields=['state', 'worker', 'date_started'])
+        return job
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT RELEASE_LOCK(%s)', [CLAIM_LOCK])
+
+
+def run_job(job):
+    """*run a claimed job with its handler and record how it ended*
+
+    **Key Arguments:**
+
+    - `job` -- the job from `claim`
+    """
+    from . import tasks
+
+    def progress(fraction, message):
+        Job.objects.filter(job_id=job.job_id).update(progress=fraction, message=message)
+
+    try:
+        function = HANDLERS[job.kind]
+        message = function(job, progress, **json.loads(job.args or '{}'))
+        (state, fraction) = ('done', 1.0)
+    except Exception as e:
+        (state, fraction, message) = ('failed', job.progress, 'The job failed: %s' % str(e))
+    # not if the job was failed meanwhile for taking too long
+    Job.objects.filter(job_id=job.job_id, state='running', worker=job.worker).update(
+        state=state, progress=fraction, message=message, date_finished=timezone.now())
+
+
+def run_worker(name=None, once=False):
+    """*run jobs from the queue until stopped*
+
+    **Key Arguments:**
+
+    - `name` -- name of this worker, default the host and process ID
+    - `once` -- return when the queue has nothing to run
+    """
+    name = name or '%s:%d' % (socket.gethostname(), os.getpid())
+    while True:
+        job = claim(name)
+        if job:
+            run_job(job)
+        elif once:
+            return
+        else:
+            time.sleep(JOBS_POLL)
@@ -0,0 +1,38 @@
+from django.http import JsonResponse, Http404
+from django.shortcuts import get_object_or_404
+from .models import Job
+
+
+def job_status(request, job_id):
+    """*return the state of a background job as JSON, for pages to poll*
+
+    **Key Arguments:**
+
+    - `request` -- the original request
+    - `job_id` -- the job ID from `enqueue`
+
+    **Usage:**
+
+    ```python
+    urlpatterns = [
+        ...
+        path('jobs/<int:job_id>/', views.job_status, name='job_status'),
+        ...
+    ]
+    ```
+    """
+    job = get_object_or_404(Job, job_id=job_id)
+    # ONLY THE OWNER MAY SEE A JOB
+    if job.user is None or not request.user.is_authenticated or request.user.id != job.user.id:
+        raise Http404('No such job')
+    return JsonResponse({
+        'job_id': job.job_id,
+        'kind': job.kind,
+        'target': job.target,
+        'state': job.state,
+        'progress': job.progress,
+        'message': job.message,
+        'date_created': job.date_created,
+        'date_started': job.date_started,
+        'date_finished': job.date_finished,
+    })
@@ -1 +1,192 @@
+"""Candidate search within the credible region of a multimessenger skymap.
 
+The credible region is the `histogram` of the skymap JSON, a list of the 5 degree
+tiles it touches. The region is covered with HTM trixels, whole trixels where they
+are inside the tiles and the smallest trixels down to MMA_HTM_LEVEL along the
+edges, and each trixel is a range of htm16 IDs. The merged ranges go into one
+query on the htm16 index of `objects`, and the rows are then checked against the
+tiles exactly. The ranges are cached per skymap version, and the candidates per
+skymap version and JD window if there are not too many, in the Django cache
+called 'mma' if it is configured, otherwise the default cache.
+"""
+import math
+import hashlib
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from src.htm_ranges import merge_ranges
+from src import db_connect
+import settings as lasair_settings
+
+# deepest HTM level of the trixels along the edge of the region
+MMA_HTM_LEVEL = getattr(lasair_settings, 'MMA_HTM_LEVEL', 6)
+
+# seconds the candidates of a skymap and JD window are kept, as new alerts may add to them
+MMA_CACHE_TTL = getattr(lasair_settings, 'MMA_CACHE_TTL', 600)
+
+# lists of more candidates than this are not cached
+MMA_CACHE_MAX_ROWS = getattr(lasair_settings, 'MMA_CACHE_MAX_ROWS', 10000)
+
+# size of the tiles in the skymap histogram, degrees
+TILE = 5.0
+NRA = 72
+NDEC = 36
+
+# the eight level 0 trixels, with their HTM IDs
+VERTICES = [(0, 0, 1), (1, 0, 0), (0, 1, 0), (-1, 0, 0), (0, -1, 0), (0, 0, -1)]
+BASE = [
+    (8, (1, 5, 2)), (9, (2, 5, 3)), (10, (3, 5, 4)), (11, (4, 5, 1)),
+    (12, (1, 0, 4)), (13, (4, 0, 3)), (14, (3, 0, 2)), (15, (2, 0, 1)),
+]
+
+
+def get_cache():
+    try:
+        return caches['mma']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def unit(v):
+    n = math.sqrt(v[0] * v[0] + v[1] * v[1] + v[2] * v[2])
+    return (v[0] / n, v[1] / n, v[2] / n)
+
+
+def midpoint(a, b):
+    return unit((a[0] + b[0], a[1] + b[1], a[2] + b[2]))
+
+
+def children(id, v0, v1, v2):
+    """*the four children of a trixel, numbered as in the HTM library*"""
+    w0 = midpoint(v1, v2)
+    w1 = midpoint(v0, v2)
+    w2 = midpoint(v0, v1)
+    return [
+        (4 * id, v0, w2, w1),
+        (4 * id + 1, v1, w0, w2),
+        (4 * id + 2, v2, w1, w0),
+        (4 * id + 3, w0, w1, w2),
+    ]
+
+
+def bounding_box(v0, v1, v2):
+    """*RA and Dec limits of a cap around a trixel, degrees, with RA limits None if it covers a pole*"""
+    centre = unit((v0[0] + v1[0] + v2[0], v0[1] + v1[1] + v2[1], v0[2] + v1[2] + v2[2]))
+    cosr = min(centre[0] * v[0] + centre[1] * v[1] + centre[2] * v[2] for v in (v0, v1, v2))
+    r = math.degrees(math.acos(max(-1.0, min(1.0, cosr))))
+    dec = math.degrees(math.asin(max(-1.0, min(1.0, centre[2]))))
+    ra = math.degrees(math.atan2(centre[1], centre[0])) % 360
+    declo = dec - r
+    dechi = dec + r
+    if dechi >= 90 or declo <= -90:
+        return None, None, max(declo, -90), min(dechi, 90)
+    alpha = math.degrees(math.asin(min(1.0, math.sin(math.radians(r)) / math.cos(math.radians(dec)))))
+    return ra - alpha, ra + alpha, declo, dechi
+
+
+def box_tiles(ralo, rahi, declo, dechi):
+    """*the histogram tiles (i, j) that an RA and Dec box touches*"""
+    jlo = max(0, int(math.floor((90 - dechi) / TILE)))
+    jhi = min(NDEC - 1, int(math.floor((90 - declo) / TILE)))
+    if ralo is None or rahi - ralo >= 360:
+        ilist = range(NRA)
+    else:
+        ilist = [i % NRA for i in range(int(math.floor(ralo / TILE)), int(math.floor(rahi / TILE)) + 1)]
+    return [(i, j) for i in ilist for j in range(jlo, jhi + 1)]
+
+
+def tile_ranges(tilelist, level=MMA_HTM_LEVEL):
+    """*merged htm16 ranges that cover a list of histogram tiles*
+
+    **Key Arguments:**
+
+    - `tilelist` -- list of (i, j) tiles, covering RA 5i to 5i+5 and Dec 90-5j-5 to 90-5j
+    - `level` -- deepest level of the trixels along the edges
+
+    **Usage:**
+
+    ```python
+    ranges = tile_ranges(skymap_data['meta']['histogram'])
+    where = ' OR '.join(['htm16 BETWEEN %d AND %d' % r for r in ranges])
+    ```
+    """
+    tiles = set((int(i), int(j)) for (i, j) in tilelist)
+    ranges = []
+    stack = [(id,) + tuple(VERTICES[i] for i in corners) + (0,) for (id, corners) in BASE]
+    while stack:
+        (id, v0, v1, v2, depth) = stack.pop()
+        touched = box_tiles(*bounding_box(v0, v1, v2))
+        wanted = [t for t in touched if t in tiles]
+        if not wanted:
+            continue
+        if len(wanted) == len(touched) or depth == level:
+            shift = 2 * (16 - depth)
+            ranges.append((id << shift, ((id + 1) << shift) - 1))
+        else:
+            stack += [child + (depth + 1,) for child in children(id, v0, v1, v2)]
+    return merge_ranges(ranges)
+
+
+def in_tiles(tiles, ra, dec):
+    """*whether a position is in one of a set of histogram tiles*"""
+    i = int(math.floor((ra % 360) / TILE)) % NRA
+    j = min(NDEC - 1, int(math.floor((90 - dec) / TILE)))
+    return (i, j) in tiles
+
+
+def skymap_candidates(skymap_id_version, tilelist, jd1, jd2):
+    """*objects in the credible region of a skymap that were detected around a JD window, and the query used*
+
+    An object is taken if its detections span some of the window, from `jdmin` and
+    `jdmax` in `objects`.
+
+    **Key Arguments:**
+
+    - `skymap_id_version` -- name of the skymap with its version, whose region does not change
+    - `tilelist` -- the `histogram` tiles of the skymap
+    - `jd1` -- start of the window, JD
+    - `jd2` -- end of the window, JD
+
+    **Return:**
+
+    - `candidates` -- list of dictionaries with objectId, jd of the first detection, ra, dec, gmag and rmag
+    - `query` -- the SQL
+    - `cached` -- True if the candidates came from the cache
+    """
+    cache = get_cache()
+    key = 'mma_ranges:%s:%d' % (skymap_id_version, MMA_HTM_LEVEL)
+    ranges = cache.get(key)
+    if ranges is None:
+        ranges = tile_ranges(tilelist)
+        cache.set(key, ranges, None)
+
+    query = 'SELECT objectId, jdmin, jdmax, ramean, decmean, gmag, rmag FROM objects WHERE ('
+    query += ' OR '.join(['htm16 BETWEEN %d AND %d' % r for r in ranges]) or 'FALSE'
+    query += ') AND jdmax >= %f AND jdmin <= %f' % (jd1, jd2)
+
+    text = '%s\n%d\n%.5f\n%.5f' % (skymap_id_version, MMA_HTM_LEVEL, jd1, jd2)
+    key = 'mma_candidates:' + hashlib.sha256(text.encode()).hexdigest()
+    candidates = cache.get(key)
+    if candidates is not None:
+        return candidates, query, True
+
+    msl = db_connect.readonly()
+    cursor = msl.cursor(buffered=True, dictionary=True)
+    cursor.execute(query)
+    tiles = set((int(i), int(j)) for (i, j) in tilelist)
+    candidates = []
+    for row in cursor:
+        if in_tiles(tiles, row['ramean'], row['decmean']):
+            candidates.append({
+                'objectId': row['objectId'],
+                'jd': row['jdmin'],
+                'ra': row['ramean'],
+                'dec': row['decmean'],
+                'gmag': row['gmag'],
+                'rmag': row['rmag'],
+            })
+    cursor.close()
+    msl.close()
+    candidates.sort(key=lambda c: c['objectId'])
+    if len(candidates) <= MMA_CACHE_MAX_ROWS:
+        cache.set(key, candidates, MMA_CACHE_TTL)
+    return candidates, query, False
@@ -4,7 +4,8 @@ import math
 import dateutil.parser as dp
 import json
 from subprocess import Popen, PIPE
-from src import date_nid
+from src import date_nid, db_connect
+from .utils import skymap_candidates
 import settings
 from django.db import connection
 from django.template.context_processors import csrf
@@ -32,6 +33,7 @@ def mm_map_detail(request, skymap_id_version):
     ]
     ```           
     """
+    t = time.time()
     json_text = open("/mnt/lasair-head-data/ztf/skymap/%s.json" % skymap_id_version).read()
     skymap_data = json.loads(json_text)
     isodate = skymap_data['meta']['DATE-OBS']
@@ -87,35 +89,18 @@ def mm_map_detail(request, skymap_id_version):
     nid1 = date_nid.date_to_nid(niddate1)
     nid2 = date_nid.date_to_nid(niddate2)
 
-    msl = db_connect.readonly()
-    cursor = msl.cursor(buffered=True, dictionary=True)
-
-# ZTF candidates
+# ZTF candidates, from the htm16 index within the credible region
     ztf_data = []
-    ztfquery = "SELECT objectId,jd,ra,decl,fid,magpsf "
-    ztfquery += "FROM candidates WHERE jd BETWEEN %f and %f AND \n(" % (jd + jd1delta, jd + jd2delta)
-    constraint_list = []
-    for tile in tilelist:
-        constraint = "(ra BETWEEN %.1f and %.1f AND decl BETWEEN %.1f AND %.1f)\n"
-        constraint = constraint % (5 * tile[0], 5 * tile[0] + 5, 90 - 5 * tile[1] - 5, 90 - 5 * tile[1])
-        constraint_list.append(constraint)
-    ztfquery += " OR ".join(constraint_list) + ") ORDER BY objectId"
-
+    ztfquery = ''
+    ztf_cached = False
     if ztf_wanted:
-        cursor.execute(ztfquery)
-        for row in cursor:
-            ztf_data.append({
-                'objectId': row['objectId'],
-                'jd': row['jd'],
-                'ra': row['ra'],
-                'dec': row['decl'],
-                'fid': row['fid'],
-                'magpsf': row['magpsf'],
-            })
+        ztf_data, ztfquery, ztf_cached = skymap_candidates(skymap_id_version, tilelist, jd + jd1delta, jd + jd2delta)
 
 # Coverage
     coverage = []
     if coverage_wanted:
+        msl = db_connect.readonly()
+        cursor = msl.cursor(buffered=True, dictionary=True)
         query = "SELECT field,fid,ra,decl,SUM(n) as sum "
         query += "FROM coverage WHERE nid BETWEEN %d and %d GROUP BY field,fid,ra,decl" % (nid1, nid2)
 
@@ -140,7 +125,9 @@ def mm_map_detail(request, skymap_id_version):
                    'ztf_wanted': ztf_wanted,
                    'ztfquery': ztfquery,
                    'nztf': len(ztf_data), 'ztf_data': json.dumps(ztf_data),
-                   'galaxies_wanted': galaxies_wanted})
+                   'ztf_cached': ztf_cached,
+                   'galaxies_wanted': galaxies_wanted,
+                   'page_time': time.time() - t})
 
 
 def mm_map_index(request):
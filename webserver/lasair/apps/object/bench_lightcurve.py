@@ -0,0 +1,89 @@
+"""Benchmark of the lightcurve work done by object_detail, before and after
+the plots moved to the browser.
+
+Before: two Plotly figures built with pandas and rendered with to_html, and the
+detection table from the merged dataframe, as object_detail did. The renderers
+are taken from utils.py as it was at BEFORE, with git show, rather than kept
+here. After: the detection table from detection_table and the JSON from
+lightcurve_columns, which the page fetches separately. Synthetic objects with a
+few hundred detections and a growing number of forced photometry points, as for
+a long-lived object. Run it from this directory in a git checkout.
+
+Usage: python3 bench_lightcurve.py [n_forcedphot ...]
+"""
+import os
+import sys
+import json
+import time
+import types
+import random
+import subprocess
+from datetime import datetime, timedelta
+from utils import lightcurve_columns, detection_table
+
+# the last commit with the Plotly renderers in utils.py
+BEFORE = '0e600e3'
+
+
+def load_before(commit=BEFORE):
+    """*the object utils module as it was at a commit*
+
+    **Key Arguments:**
+
+    - `commit` -- the git commit
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    source = subprocess.run(['git', 'show', commit + ':./utils.py'],
+        cwd=here, capture_output=True, text=True, check=True).stdout
+    module = types.ModuleType('utils_before')
+    exec(compile(source, 'utils.py@' + commit, 'exec'), module.__dict__)
+    return module
+
+
+def make_object(nforced, ndet=300, nnon=600):
+    candidates = []
+    forcedphot = []
+    mjd0 = datetime(1858, 11, 17)
+    for i in range(ndet + nnon):
+        mjd = 58300 + random.uniform(0, 1500)
+        cand = {'jd': mjd + 2400000.5, 'mjd': mjd, 'fid': random.choice([1, 2])}
+        if i < ndet:
+            cand.update({'candid': 1000000 + i, 'magpsf': random.uniform(17, 20),
+                'sigmapsf': random.uniform(0.02, 0.2), 'isdiffpos': random.choice(['t', 't', 'f']),
+                'utc': (mjd0 + timedelta(mjd)).strftime("%Y-%m-%d %H:%M:%S")})
+        else:
+            cand['diffmaglim'] = cand['magpsf'] = random.uniform(19, 21)
+        candidates.append(cand)
+    for i in range(nforced):
+        mjd = 58300 + random.uniform(0, 1500)
+        forcedphot.append({'jd': mjd + 2400000.5, 'mjd': mjd, 'fid': random.choice([1, 2]),
+            'forcediffimflux': random.gauss(100, 80), 'forcediffimfluxunc': random.uniform(5, 40),
+            'magzpsci': 26.0, 'procstatus': '0', 'scisigpix': 10.0, 'sciinpseeing': 2.0})
+    return {'objectId': 'ZTF18bench', 'candidates': candidates, 'forcedphot': forcedphot}
+
+
+def before(old, data):
+    lightcurveHtml, mergedDF = old.object_difference_lightcurve(data)
+    fplightcurveHtml, mergedDF = old.object_difference_lightcurve_forcedphot(data)
+    return mergedDF.to_dict('records'), len(lightcurveHtml) + len(fplightcurveHtml)
+
+
+def after(data):
+    lcData = detection_table(data)
+    return lcData, len(json.dumps(lightcurve_columns(data)))
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [100, 1000, 5000]
+    old = load_before()
+    print('%10s %12s %12s %12s %12s' % ('forcedphot', 'before ms', 'after ms', 'before bytes', 'after bytes'))
+    for n in sizes:
+        data = make_object(n)
+        t = time.perf_counter()
+        rows_before, nbytes_before = before(old, json.loads(json.dumps(data)))
+        t_before = 1000 * (time.perf_counter() - t)
+        t = time.perf_counter()
+        rows_after, nbytes_after = after(json.loads(json.dumps(data)))
+        t_after = 1000 * (time.perf_counter() - t)
+        assert len(rows_before) == len(rows_after)
+        print('%10d %12.1f %12.1f %12d %12d' % (n, t_before, t_after, nbytes_before, nbytes_after))
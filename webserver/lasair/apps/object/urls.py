@@ -5,5 +5,6 @@ from django.views.generic import RedirectView
 
 urlpatterns = [
     path('objects/<slug:objectId>/', views.object_detail, name='object_detail'),
+    path('objects/<slug:objectId>/lightcurve/', views.object_lightcurve, name='object_lightcurve'),
     path('object/<slug:objectId>/', RedirectView.as_view(pattern_name='object_detail', permanent=False))
 ]
@@ -9,6 +9,7 @@ from django.db.models import Q
 from django.views.decorators.csrf import csrf_exempt
 from django.template.context_processors import csrf
 from django.shortcuts import render, get_object_or_404, HttpResponse
+from django.http import JsonResponse
 from src import db_connect
 from src.objectStore import objectStore
 import settings
@@ -16,7 +17,8 @@ import os
 import sys
 from astropy.time import Time
 from lasair.utils import mjd_now, ecliptic, rasex, decsex, objjson
-from .utils import object_difference_lightcurve, object_difference_lightcurve_forcedphot
+from lasair.render_cache import cached, object_version
+from .utils import lightcurve_columns, detection_table
 sys.path.append('../common')
 
 
@@ -38,7 +40,13 @@ def object_detail(request, objectId):
     ]
     ```           
     """
-    data = objjson(objectId, full=True)
+    # a new detection changes jdmax, so cached pages are never out of date
+    version = object_version(objectId)
+    if version is None:
+        return render(request, 'error.html',
+                      {'message': 'Object %s not in database' % objectId})
+    data = cached('objjson', objectId, version,
+                  lambda: objjson(objectId, full=True), variant='full')
 
     if not data:
         return render(request, 'error.html',
@@ -55,18 +63,41 @@ def object_detail(request, objectId):
     if 'sherlock' in data2:
         data2.pop('sherlock')
 
-    lightcurveHtml, mergedDF = object_difference_lightcurve(data)
-    fplightcurveHtml, mergedDF = object_difference_lightcurve_forcedphot(data)
-    if mergedDF is not None:
-        lcData = mergedDF.to_dict('records')
-    else:
-        lcData = data["candidates"]
+    # the lightcurve plots are drawn in the browser from object_lightcurve
+    lcData = detection_table(data)
 
     return render(request, 'object/object_detail.html', {
         'data': data,
         'json_data': json.dumps(data2),
         'authenticated': request.user.is_authenticated,
-        'lightcurveHtml': lightcurveHtml,
-        'fplightcurveHtml': fplightcurveHtml,
         'lcData': lcData
     })
+
+
+def object_lightcurve(request, objectId):
+    """*return the lightcurve of an object as compact JSON columns, for the plots on the object page*
+
+    **Key Arguments:**
+
+    - `request` -- the original request
+    - `objectId` -- the UUID of the object requested
+
+    **Usage:**
+
+    ```python
+    urlpatterns = [
+        ...
+        path('objects/<slug:objectId>/lightcurve/', views.object_lightcurve, name='object_lightcurve'),
+        ...
+    ]
+    ```
+    """
+    version = object_version(objectId)
+    data = None
+    if version is not None:
+        # same cache entry as object_detail, so the page has usually just filled it
+        data = cached('objjson', objectId, version,
+                      lambda: objjson(objectId, full=True), variant='full')
+    if not data:
+        return JsonResponse({'error': 'Object %s not in database' % objectId}, status=404)
+    return JsonResponse(lightcurve_columns(data))
@@ -1,6 +1,11 @@
 from django.db import connection
 import settings
 import math
+from bisect import bisect_left, bisect_right
+from src.htm_ranges import htm16_ranges, merge_ranges
+
+# positions per query in a batch cone search
+CONE_BATCH = 200
 
 
 def conesearch_impl(cone):
@@ -44,27 +49,88 @@ def conesearch_impl(cone):
         ra = d['ra']
         dec = d['dec']
         radius = d['radius']
-        dra = radius / (3600 * math.cos(dec * math.pi / 180))
-        dde = radius / 3600
-        cursor = connection.cursor()
-        query = 'SELECT objectId,ramean,decmean FROM objects WHERE ramean BETWEEN %f and %f AND decmean BETWEEN %f and %f' % (ra - dra, ra + dra, dec - dde, dec + dde)
-#        query = 'SELECT DISTINCT objectId FROM candidates WHERE ra BETWEEN %f and %f AND decl BETWEEN %f and %f' % (ra-dra, ra+dra, dec-dde, dec+dde)
-        cursor.execute(query)
-        hits = cursor.fetchall()
-        for hit in hits:
-            #            dist = distance(ra, dec, hit[1], hit[2]) * 3600.0
-            #            if dist < radius:
-            #                hitdict[hit[0]] = (hit[1], hit[2], dist)
-            hitlist.append(hit[0])
+        hits = cone_hits([(ra, dec, radius)])[0]
+        hitlist = [hit[0] for hit in hits]
         message = d['message'] + '<br/>%d objects found in cone' % len(hitlist)
         data = {'ra': ra, 'dec': dec, 'radius': radius, 'cone': cone,
-                'hitlist': hitlist, 'message': message}
+                'hitlist': hitlist, 'hits': hits, 'message': message}
         return data
     else:
         data = {'cone': cone, 'message': d['message']}
         return data
 
 
+def angular_separation(ra1, de1, ra2, de2):
+    """*great circle distance in degrees between 2 points, correct at the poles and across RA=0*
+
+    **Key Arguments:**
+
+    - `ra1` -- position 1 RA
+    - `de1` -- position 1 Dec
+    - `ra2` -- position 2 RA
+    - `de2` -- position 2 Dec
+    """
+    d1 = math.radians(de1)
+    d2 = math.radians(de2)
+    sdde = math.sin((d2 - d1) / 2)
+    sdra = math.sin(math.radians(ra2 - ra1) / 2)
+    h = sdde * sdde + math.cos(d1) * math.cos(d2) * sdra * sdra
+    return math.degrees(2 * math.asin(min(1.0, math.sqrt(h))))
+
+
+def cone_hits(positions, batch=CONE_BATCH):
+    """*objects inside each of a list of cones, nearest first*
+
+    The HTM ranges of up to `batch` cones are merged and go in one query, then
+    each row is checked with the exact great circle distance against the
+    cones whose Dec is close enough, found by bisection.
+
+    **Key Arguments:**
+
+    - `positions` -- list of (ra, dec, radius) with radius in arcsec
+    - `batch` -- number of cones per database round trip
+
+    **Usage:**
+
+    ```python
+    from lasair.apps.search.utils import cone_hits
+    for hits in cone_hits([(ra, dec, 5.0), (ra2, dec2, 10.0)]):
+        for (objectId, ramean, decmean, arcsec) in hits:
+            ...
+    ```
+    """
+    results = []
+    cursor = connection.cursor()
+    for i in range(0, len(positions), batch):
+        chunk = positions[i:i + batch]
+        ranges = []
+        for (ra, dec, radius) in chunk:
+            ranges += htm16_ranges(ra, dec, radius)
+        if not ranges:
+            results += [[] for j in chunk]
+            continue
+        where = ' OR '.join(['htm16 BETWEEN %d AND %d' % r for r in merge_ranges(ranges)])
+        cursor.execute('SELECT objectId, ramean, decmean FROM objects WHERE ' + where)
+        rows = cursor.fetchall()
+
+        order = sorted(range(len(chunk)), key=lambda j: chunk[j][1])
+        decs = [chunk[j][1] for j in order]
+        maxRadius = max([radius for (ra, dec, radius) in chunk]) / 3600
+        hits = [[] for j in chunk]
+        for (objectId, ramean, decmean) in rows:
+            for k in range(bisect_left(decs, decmean - maxRadius), bisect_right(decs, decmean + maxRadius)):
+                j = order[k]
+                (ra, dec, radius) = chunk[j]
+                arcsec = 3600 * angular_separation(ra, dec, ramean, decmean)
+                if arcsec <= radius:
+                    hits[j].append((objectId, ramean, decmean, arcsec))
+        for h in hits:
+            h.sort(key=lambda hit: hit[3])
+            results.append(h)
+    cursor.close()
+    return results
+
+
 def readcone(cone):
     """*parse conesearch request*
 
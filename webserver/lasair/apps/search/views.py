@@ -1,13 +1,11 @@
 from django.shortcuts import render
-from .utils import conesearch_impl, readcone, sexra, sexde
+from .utils import conesearch_impl, readcone, sexra, sexde, cone_hits
 import re
 import settings
 from src import db_connect
 from lasair.apps.db_schema.utils import get_schema_dict
 from astrocalc.coords import unit_conversion
 from fundamentals.logs import emptyLogger
-from django.db import connection
-from gkutils.commonutils import coneSearchHTM, FULL, QUICK, CAT_ID_RA_DEC_COLS, base26, Struct
 
 
 def search(
@@ -90,43 +88,27 @@ def do_search(
             cursor.execute(q)
             results += cursor.fetchall()
     else:
-        # ASSUME THIS COULD BE A CONE SEARCH
-        if "|" in query:
-            squery = query.split("|")
-            query = [q.strip() for q in squery]
-        else:
-            query = query.split()
-
-        if len(query) in (2, 3):
-            log = emptyLogger()
-            # ASTROCALC UNIT CONVERTER OBJECT
-            converter = unit_conversion(
-                log=log
-            )
-            try:
-                ra = converter.ra_sexegesimal_to_decimal(
-                    ra=query[0]
-                )
-                dec = converter.dec_sexegesimal_to_decimal(
-                    dec=query[1]
-                )
-            except:
+        # ASSUME THIS COULD BE A CONE SEARCH, OR SEVERAL SEPARATED BY ;
+        positions = []
+        for cone in query.split(';'):
+            if not cone.strip():
+                continue
+            position = parse_cone(cone)
+            if not position:
                 return [], []
-        else:
+            positions.append(position)
+        if not positions:
             return [], []
 
-        if len(query) == 3:
-            radius = float(query[2])
-        else:
-            radius = 5.
-
-        # Is there an object within RADIUS arcsec of this object? - KWS - need to fix the gkhtm code!!
-        message, matches = coneSearchHTM(ra, dec, radius, 'objects', queryType=QUICK, conn=connection, django=True, prefix='htm', suffix='')
-        objectIds = [o[1]['objectId'] for o in matches]
-        objectIds = "','".join(objectIds)
-        query = f"select {objectColumns} from objects o where o.objectId in ('{objectIds}')"
-        cursor.execute(query)
-        results += cursor.fetchall()
+        # NEAREST FIRST, THEN THE NEXT CONE
+        objectIds = []
+        for hits in cone_hits(positions):
+            objectIds += [hit[0] for hit in hits]
+        if objectIds:
+            placeholders = ','.join(['%s'] * len(objectIds))
+            cursor.execute(f"select {objectColumns} from objects o where o.objectId in ({placeholders})", tuple(objectIds))
+            rows = {row['objectId']: row for row in cursor.fetchall()}
+            results += [rows[objectId] for objectId in objectIds if objectId in rows]
 
     # MAKE UNIQUE
     try:
@@ -136,5 +118,43 @@ def do_search(
 
     return results, schema
 
+
+def parse_cone(
+    cone
+):
+    """*parse one cone, `ra dec [radius]` or `ra|dec[|radius]`, decimal or sexagesimal, radius in arcsec*
+
+    **Key Arguments:**
+
+    - `cone` -- the text of one cone
+
+    **Return:**
+
+    - (ra, dec, radius) in degrees, degrees and arcsec, or None if it cannot be parsed
+    """
+    if "|" in cone:
+        tok = [q.strip() for q in cone.split("|")]
+    else:
+        tok = cone.split()
+    if len(tok) not in (2, 3):
+        return None
+
+    log = emptyLogger()
+    # ASTROCALC UNIT CONVERTER OBJECT
+    converter = unit_conversion(
+        log=log
+    )
+    try:
+        ra = converter.ra_sexegesimal_to_decimal(
+            ra=tok[0]
+        )
+        dec = converter.dec_sexegesimal_to_decimal(
+            dec=tok[1]
+        )
+        radius = float(tok[2]) if len(tok) == 3 else 5.
+    except:
+        return None
+    return (float(ra), float(dec), radius)
+
 # use the tab-trigger below for new function
 # xt-def-simple-function-template
@@ -1,7 +1,10 @@
-import json
 from django.shortcuts import render
 import src.date_nid as date_nid
+from src import db_connect
+from src.manage_status import status_for
 import settings
+from lasair.render_cache import stats as render_cache_stats
+from lasair.query_cache import stats as query_cache_stats
 from astropy.time import Time
 import datetime
 
@@ -46,16 +49,13 @@ def status(request, nid):
     ```           
     """
     web_domain = settings.WEB_DOMAIN
+    # one query on the status table, or one read of the status file
+    ms = status_for(settings, db_connect.readonly)
     try:
-        filename = '%s_%d.json' % (settings.SYSTEM_STATUS, nid)
-        jsonstr = open(filename).read()
-    except:
-        jsonstr = ''
-
-    try:
-        status = json.loads(jsonstr)
+        status = ms.read(nid)
     except:
         status = None
+    ms.close()
 
     if status and 'today_filter' in status:
         status['today_singleton'] = \
@@ -89,6 +89,18 @@ def status(request, nid):
     if status:
         statusTable[:] = [(statusSchema[s][0], status[s], statusSchema[s][1]) for s in statusOrder]
 
+    # the caches are in the memory of each web server process
+    for namespace, st in render_cache_stats().items():
+        if st['hit_rate'] is not None:
+            statusTable.append(('Object cache hit rate (%s), this web server process' % namespace,
+                                '%.1f%%' % (100 * st['hit_rate']),
+                                '%d hits, %d misses since the process started' % (st['hits'], st['misses'])))
+    for namespace, st in query_cache_stats().items():
+        if st['hit_rate'] is not None:
+            statusTable.append(('Query cache hit rate (%s), this web server process' % namespace,
+                                '%.1f%%' % (100 * st['hit_rate']),
+                                '%d hits, %d misses since the process started' % (st['hits'], st['misses'])))
+
     date = date_nid.nid_to_date(nid)
 
     d0 = datetime.date(2017, 1, 1)
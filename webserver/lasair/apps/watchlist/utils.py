@@ -1,19 +1,138 @@
+import codecs
+import numpy as np
+import pandas as pd
+from src import db_connect, hit_summary
 
+# lines parsed and loaded at a time when a watchlist is uploaded
+CONE_CHUNK = 50000
 
-def handle_uploaded_file(f):
-    """*handle the upload of a watchlist*
+# at most this many messages about bad lines or renamed sources
+MAX_CONE_MESSAGES = 20
+
+
+def cone_lines(f):
+    """*iterate over the lines of an uploaded cones file without reading it all into memory*
 
     **Key Arguments:**
 
-    - `f` -- the upoloaded file
+    - `f` -- the uploaded file
 
     **Usage:**
 
     ```python
-    cones = handle_uploaded_file(request.FILES['cones_file'])
-    ```           
+    lines = cone_lines(request.FILES['cones_file'])
+    ```
+    """
+    return codecs.iterdecode(f, 'utf-8', errors='replace')
+
+
+def parse_cones(
+        lines,
+        chunk=CONE_CHUNK):
+    """*parse lines of `RA,Dec,Name<,radius>` a chunk at a time*
+
+    Blank lines and lines starting with # are skipped, and | may be used in place of the comma.
+
+    **Key Arguments:**
+
+    - `lines` -- iterable of lines of text
+    - `chunk` -- number of lines in each chunk
+
+    **Return:**
+
+    - generator of (cones, errors, renamed), where cones is a dataframe with columns name, ra, decl, radius (NaN if not given),
+      errors the bad lines and renamed the (name, ascii name) pairs where non-ascii characters were removed
+    """
+    buf = []
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0 or line[0] == '#':
+            continue
+        buf.append(line)
+        if len(buf) >= chunk:
+            yield parse_cone_chunk(buf)
+            buf = []
+    if buf:
+        yield parse_cone_chunk(buf)
+
+
+def parse_cone_chunk(lines):
+    """*parse and validate a list of non-empty cone lines with vectorised pandas operations*
+
+    **Key Arguments:**
+
+    - `lines` -- list of lines of text
+    """
+    tok = pd.Series(lines).str.replace('|', ',', regex=False).str.split(',', n=4, expand=True)
+    # a column missing from every line is all NaN, which has no .str
+    tok = tok.reindex(columns=range(4)).fillna('')
+    ra = pd.to_numeric(tok[0], errors='coerce')
+    decl = pd.to_numeric(tok[1], errors='coerce')
+    name = tok[2].astype(str).str.strip()
+    radius_text = tok[3].astype(str).str.strip()
+    no_radius = (radius_text == '') | (radius_text.str.lower() == 'none')
+    radius = pd.to_numeric(radius_text.where(~no_radius), errors='coerce')
+
+    bad = (name == '') | ra.isna() | decl.isna() | (~no_radius & radius.isna()) \
+        | (ra < 0) | (ra > 360) | (decl < -90) | (decl > 90)
+    errors = [lines[i] for i in np.nonzero(bad.to_numpy())[0]]
+
+    ascii_name = name.str.encode('ascii', 'ignore').str.decode('ascii')
+    changed = ~bad & (ascii_name != name)
+    renamed = list(zip(name[changed], ascii_name[changed]))
+
+    cones = pd.DataFrame({'name': ascii_name, 'ra': ra, 'decl': decl, 'radius': radius})[~bad]
+    return cones, errors, renamed
+
+
+def upload_cones(
+        wl_id,
+        lines,
+        max_cones):
+    """*parse the cones of a new watchlist and load them with multi-row inserts, in one transaction*
+
+    **Key Arguments:**
+
+    - `wl_id` -- the watchlist ID, already saved
+    - `lines` -- iterable of lines of text, as from `cone_lines`
+    - `max_cones` -- most cones allowed in a watchlist
+
+    **Return:**
+
+    - (number of cones loaded, or -1 if more than max_cones, bad lines, renamed sources),
+      with at most MAX_CONE_MESSAGES bad lines and renamed sources
+
+    **Usage:**
+
+    ```python
+    count, errors, renamed = upload_cones(wl.pk, cone_lines(request.FILES['cones_file']), settings.WATCHLIST_MAX)
+    ```
     """
-    return f.read().decode('utf-8')
+    query = 'INSERT INTO watchlist_cones (wl_id, name, ra, decl, radius) VALUES (%s, %s, %s, %s, %s)'
+    msl = db_connect.remote()
+    cursor = msl.cursor(buffered=True)
+    count = 0
+    errors = []
+    renamed = []
+    try:
+        for cones, chunk_errors, chunk_renamed in parse_cones(lines):
+            errors += chunk_errors[:MAX_CONE_MESSAGES - len(errors)]
+            renamed += chunk_renamed[:MAX_CONE_MESSAGES - len(renamed)]
+            count += len(cones)
+            if count > max_cones:
+                msl.rollback()
+                return -1, errors, renamed
+            radius = cones['radius'].astype(object).where(cones['radius'].notna(), None)
+            rows = list(zip([wl_id] * len(cones), cones['name'].tolist(), cones['ra'].tolist(),
+                            cones['decl'].tolist(), radius.tolist()))
+            # mysql.connector sends each chunk as one multi-row INSERT
+            if rows:
+                cursor.executemany(query, rows)
+        msl.commit()
+    finally:
+        cursor.close()
+        msl.close()
+    return count, errors, renamed
 
 
 def add_watchlist_metadata(
@@ -47,3 +166,101 @@ def add_watchlist_metadata(
             updatedWatchlists.append(wlDict)
             dupCheck.append(uuid)
     return updatedWatchlists
+
+
+def recent_hits(
+        msl,
+        wl_id):
+    """*return the number of hits of a watchlist and a table of the most recent, from the watchlist summary*
+
+    The summary is kept up to date by the filter, so this costs the same however
+    many hits the watchlist has.
+
+    **Key Arguments:**
+
+    - `msl` -- database connection
+    - `wl_id` -- the watchlist ID
+
+    **Return:**
+
+    - `count` -- the number of hits
+    - `table` -- list of rows for the most recent hits, newest first
+    """
+    summary = hit_summary.read(msl, 'watchlist', [wl_id])[wl_id]
+    recent = summary['recent']
+    objects = {}
+    if recent:
+        cursor = msl.cursor(buffered=True, dictionary=True)
+        objectIds = list(set(hit['objectId'] for hit in recent))
+        query = 'SELECT objectId, ramean, decmean, rmag, gmag, jdnow()-jdmax AS since FROM objects WHERE objectId IN (%s)'
+        cursor.execute(query % ', '.join(['%s'] * len(objectIds)), objectIds)
+        for row in cursor:
+            objects[row['objectId']] = row
+
+    table = []
+    for hit in recent:
+        o = objects.get(hit['objectId'])
+        if o:
+            table.append({
+                'Catalogue ID': hit['name'],
+                'separation (arcsec)': hit['arcsec'],
+                'cone_id': hit['cone_id'],
+                'objectId': o['objectId'],
+                'ramean': o['ramean'],
+                'decmean': o['decmean'],
+                'rmag': o['rmag'],
+                'gmag': o['gmag'],
+                'last detected (days ago)': o['since'],
+            })
+    return summary['n_hits'], table
+
+
+def crossmatch_progress(wl_id):
+    """*return the latest full crossmatch job of a watchlist, or None if none has been run*
+
+    **Key Arguments:**
+
+    - `wl_id` -- the watchlist ID
+
+    **Return:**
+
+    - the job, with `state` (queued, running, done or failed), `progress` and `message`
+    """
+    from lasair.apps.jobs.utils import latest_job
+    return latest_job('watchlist_crossmatch', 'watchlist:%d' % wl_id)
+
+
+def start_crossmatch(
+        wl_id,
+        radius,
+        user,
+        wlMax=False):
+    """*queue a full crossmatch of a watchlist against all objects*
+
+    The rematch takes minutes for large watchlists, so it is run by a job worker
+    and the watchlist page shows the progress from `crossmatch_progress`.
+
+    **Key Arguments:**
+
+    - `wl_id` -- the watchlist ID
+    - `radius` -- the default radius of the watchlist in arcsec
+    - `user` -- the user asking for it
+    - `wlMax` -- refuse watchlists with more cones than this
+
+    **Return:**
+
+    - False if a crossmatch of this watchlist is already queued or running, else True
+
+    **Usage:**
+
+    ```python
+    from lasair.apps.watchlist.utils import start_crossmatch
+    started = start_crossmatch(watchlist.wl_id, watchlist.radius, request.user)
+    ```
+    """
+    from lasair.apps.jobs.utils import enqueue, active_job
+    target = 'watchlist:%d' % wl_id
+    if active_job('watchlist_crossmatch', target):
+        return False
+    enqueue('watchlist_crossmatch', user, target, wl_id=wl_id, radius=radius, wlMax=wlMax)
+    return True
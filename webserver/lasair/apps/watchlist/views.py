@@ -1,5 +1,6 @@
 from django.contrib.auth.decorators import login_required
 from .forms import WatchlistForm, UpdateWatchlistForm, DuplicateWatchlistForm
+import io
 import time
 import random
 import json
@@ -11,14 +12,15 @@ from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
 from django.template.context_processors import csrf
 from django.shortcuts import render, get_object_or_404, redirect
-import src.run_crossmatch_optimised as run_crossmatch
 from django.conf import settings
 from django.contrib import messages
-from src import db_connect
+from django.utils import timezone
+from src import db_connect, hit_summary
 import sys
 import copy
 from lasair.apps.db_schema.utils import get_schema_dict
-from .utils import handle_uploaded_file, add_watchlist_metadata
+from .utils import cone_lines, upload_cones, add_watchlist_metadata, start_crossmatch, crossmatch_progress, recent_hits
+from lasair.apps.jobs.utils import enqueue
 
 sys.path.append('../common')
 
@@ -61,57 +63,41 @@ def watchlist_index(request):
                 active = False
 
             d_radius = request.POST.get('radius')
-            cones = request.POST.get('cones_textarea')
             if 'cones_file' in request.FILES:
-                cones = handle_uploaded_file(request.FILES['cones_file'])
+                lines = cone_lines(request.FILES['cones_file'])
+            else:
+                lines = io.StringIO(request.POST.get('cones_textarea'))
             try:
                 default_radius = float(d_radius)
             except:
                 messages.error(request, f'Cannot parse default radius {d_radius}')
 
-            coneLines = cones.split('\n')
-            count = len(coneLines)
+            expire = datetime.datetime.now() + datetime.timedelta(days=settings.ACTIVE_EXPIRE)
+            wl = Watchlist(user=request.user, name=name, description=description, active=active, public=public, radius=default_radius, date_expire=expire)
+            wl.save()
 
-            if count > settings.WATCHLIST_MAX:
+            # PARSE AND LOAD THE CONES A CHUNK AT A TIME
+            try:
+                count, errors, renamed = upload_cones(wl.pk, lines, settings.WATCHLIST_MAX)
+            except Exception as e:
+                wl.delete()
+                messages.error(request, f'Cannot load the watchlist sources: {str(e)}')
+                return redirect(f'watchlist_index')
+            if count < 0:
+                wl.delete()
                 messages.error(request, f"The watchlist can't contain more than {settings.WATCHLIST_MAX} sources. Please reduce the size of your watchlist and try again.")
                 return redirect(f'watchlist_index')
+            for line in errors:
+                messages.error(request, f'Bad line (not RA,Dec,Name<,radius>): {line}\n')
+            for (oldname, newname) in renamed:
+                messages.info(request, 'Non-ascii characters removed from name %s --> %s<br/>' % (oldname, newname))
 
-            cone_list = []
-            for line in coneLines:
-                if len(line) == 0:
-                    continue
-                if line[0] == '#':
-                    continue
-                line = line.replace('|', ',')
-                tok = line.split(',')
-                if len(tok) < 3:
-                    messages.error(request, f'Bad line (not RA,Dec,Name): {line}\n')
-                    continue
-                try:
-                    ra = float(tok[0])
-                    dec = float(tok[1])
-                    objectId = tok[2].strip()
-                    if len(tok) >= 4 and len(tok[3].strip()) > 0 and tok[3].strip().lower() != "none":
-                        radius = float(tok[3])
-                    else:
-                        radius = None
-                    cone_list.append([objectId, ra, dec, radius])
-                except Exception as e:
-                    messages.error(request, f'Bad line {len(cone_list)}: {line}\n{str(e)}')
+            # THE CONES ARE IN, SO THE NEXT make_watchlist_files RUN BUILDS THE FILES THE FILTER USES,
+            # EVEN IF ONE RAN WHILE THEY WERE LOADING
+            Watchlist.objects.filter(pk=wl.pk).update(date_modified=timezone.now())
 
-            expire = datetime.datetime.now() + datetime.timedelta(days=settings.ACTIVE_EXPIRE)
-            wl = Watchlist(user=request.user, name=name, description=description, active=active, public=public, radius=default_radius, date_expire=expire)
-            wl.save()
-            cones = []
-            for cone in cone_list:
-                name = cone[0].encode('ascii', 'ignore').decode()
-                if name != cone[0]:
-                    messages.info(request, 'Non-ascii characters removed from name %s --> %s<br/>' % (cone[0], name))
-                wlc = WatchlistCone(wl=wl, name=name, ra=cone[1], decl=cone[2], radius=cone[3])
-                cones.append(wlc)
-            chunks = 1 + int(len(cones) / 50000)
-            for i in range(chunks):
-                WatchlistCone.objects.bulk_create(cones[(i * 50000): ((i + 1) * 50000)])
+            # AND make_watchlist_files.py --jobs ON THE SERVICES HOST BUILDS THEM NOW
+            enqueue('watchlist_files', request.user, f'watchlist:{wl.pk}', wl_id=wl.pk)
 
             watchlistname = form.cleaned_data.get('name')
             messages.success(request, f"The '{watchlistname}' watchlist containing {count} sources has been successfully created")
@@ -206,11 +192,10 @@ def watchlist_detail(request, wl_id, action=False):
                 messages.success(request, f'Your watchlist has been successfully updated')
         # REQUEST TO REFRESH THE WATCHLIST MATCHES
         elif action == 'run':
-            hits, message = run_crossmatch.run_crossmatch(msl, watchlist.radius, watchlist.wl_id, wlMax=settings.WATCHLIST_MAX_CROSSMATCH)
-            if int(hits) == -1:
-                messages.error(request, f'{message}')
+            if start_crossmatch(watchlist.wl_id, watchlist.radius, request.user, wlMax=settings.WATCHLIST_MAX_CROSSMATCH):
+                messages.success(request, 'The watchlist is being matched against all Lasair sources. Reload this page to see the progress.')
             else:
-                messages.success(request, f'{message}')
+                messages.error(request, 'The watchlist is already being matched against all Lasair sources.')
             duplicateForm = DuplicateWatchlistForm(instance=watchlist, request=request)
             form = UpdateWatchlistForm(instance=watchlist, request=request)
 
@@ -241,22 +226,12 @@ def watchlist_detail(request, wl_id, action=False):
             newWl.save()
             wl = newWl
 
-            # COPY ALL CONES
-            query = f"""CREATE TEMPORARY TABLE watchlist{wl_id} AS SELECT * FROM watchlist_cones  WHERE wl_id = {wl_id};
-                ALTER TABLE watchlist{wl_id} MODIFY cone_id INT DEFAULT 0;
-                UPDATE watchlist{wl_id} SET cone_id=NULL, wl_id={wl.pk};
-                INSERT INTO watchlist_cones SELECT * FROM watchlist{wl_id};
-                drop TEMPORARY table if exists watchlist{wl_id};"""
-
-            queries = cursor.execute(query, multi=True)
-            # ITERATE OVER QUERIES
-            for i in queries:
-                pass
-            msl.commit()
+            # COPY ALL CONES IN THE BACKGROUND
+            enqueue('watchlist_copy', request.user, f'watchlist:{wl.pk}', from_wl_id=wl_id, to_wl_id=wl.pk)
 
             wl_id = wl.pk
 
-            messages.success(request, f'You have successfully copied the "{oldName}" watchlist to My Watchlists. The results table is initially empty, but should start to fill as new transient detections match against sources in your watchlist.')
+            messages.success(request, f'You have successfully copied the "{oldName}" watchlist to My Watchlists. The sources are being copied in the background. The results table is initially empty, but should start to fill as new transient detections match against sources in your watchlist.')
             return redirect(f'watchlist_detail', wl_id)
     else:
         duplicateForm = DuplicateWatchlistForm(instance=watchlist, request=request)
@@ -273,38 +248,16 @@ def watchlist_detail(request, wl_id, action=False):
     else:
         rematchAllowed = True
 
-    resultCap = 1000
-
-    # GRAB ALL WATCHLIST MATCHES
-    query_hit = f"""
-SELECT
-h.name as "Catalogue ID", h.arcsec as "separation (arcsec)",c.cone_id, o.objectId, o.ramean,o.decmean, o.rmag, o.gmag, jdnow()-o.jdmax as "last detected (days ago)"
-FROM watchlist_cones AS c
-NATURAL JOIN watchlist_hits as h
-NATURAL JOIN objects AS o
-WHERE c.wl_id={wl_id} limit {resultCap}
-"""
-
-    cursor.execute(query_hit)
-    table = cursor.fetchall()
-    count = len(table)
-
-    if count == resultCap:
-        limit = resultCap
-        # countQuery = f"""
-        # SELECT count(*) as count
-        # FROM objects AS o, watchlist_hits as h
-        # WHERE h.wl_id={wl_id}
-        # AND o.objectId=h.objectId
-        # """
-        # cursor.execute(countQuery)
-        # count = cursor.fetchone()["count"]
+    # THE MOST RECENT WATCHLIST MATCHES, FROM THE SUMMARY THE FILTER KEEPS
+    count, table = recent_hits(msl, wl_id)
 
+    if count > len(table):
+        limit = len(table)
         if settings.DEBUG:
             apiUrl = "https://lasair.readthedocs.io/en/develop/core_functions/rest-api.html"
         else:
             apiUrl = "https://lasair.readthedocs.io/en/main/core_functions/rest-api.html"
-        messages.info(request, f"We are only displaying the first <b>{resultCap}</b> objects matched against this watchlist. But don't worry! You can access results via the <a class='alert-link' href='{apiUrl}' target='_blank'>Lasair API</a>.")
+        messages.info(request, f"We are only displaying the <b>{limit}</b> objects most recently matched against this watchlist. But don't worry! You can access results via the <a class='alert-link' href='{apiUrl}' target='_blank'>Lasair API</a>.")
     else:
         limit = False
 
@@ -329,6 +282,7 @@ WHERE c.wl_id={wl_id} limit {resultCap}
         'number_cones': number_cones,
         'limit': limit,
         'rematchAllowed': rematchAllowed,
+        'crossmatchProgress': crossmatch_progress(wl_id),
         'maxCrossmatchSize': str(settings.WATCHLIST_MAX_CROSSMATCH)
     })
 
@@ -414,6 +368,7 @@ def watchlist_delete(request, wl_id):
         query = 'DELETE from watchlist_hits WHERE wl_id=%d' % wl_id
         cursor.execute(query)
         msl.commit()
+        hit_summary.delete(msl, 'watchlist', wl_id)
         # DELETE THE WATCHLIST
         watchlist.delete()
         messages.success(request, f'The "{name}" watchlist has been successfully deleted')
@@ -2,7 +2,7 @@ import io
 import base64
 from mocpy import MOC, WCS
 import matplotlib.pyplot as plt
-from src import db_connect
+from src import db_connect, hit_summary
 import astropy.units as u
 from django.shortcuts import render
 
@@ -24,8 +24,10 @@ def add_watchmap_metadata(
     ```           
     """
 
+    # HIT COUNTS OF ALL THE WATCHMAPS FROM THEIR SUMMARIES, IN ONE QUERY
     msl = db_connect.readonly()
-    cursor = msl.cursor(buffered=True, dictionary=True)
+    summaries = hit_summary.read(msl, 'area', [wl.ar_id for wl in watchlists])
+    msl.close()
 
     updatedWatchlists = []
     mocFiles = []
@@ -39,13 +41,38 @@ def add_watchmap_metadata(
             wlDict['profile_image'] = wl.user.profile.image_b64
             updatedWatchlists.append(wlDict)
             mocFiles.append(wlDict["moc"])
-
-            cursor.execute(f'SELECT count(*) AS count FROM area_hits WHERE ar_id={wlDict["ar_id"]}')
-            for row in cursor:
-                wlDict['count'] = row['count']
+            wlDict['count'] = summaries[wlDict['ar_id']]['n_hits']
     return updatedWatchlists
 
 
+def recent_hits(
+        msl,
+        ar_id):
+    """*return the number of hits of a watchmap and a table of the most recent, from the area summary*
+
+    **Key Arguments:**
+
+    - `msl` -- database connection
+    - `ar_id` -- the watchmap ID
+
+    **Return:**
+
+    - `count` -- the number of hits
+    - `table` -- list of rows for the most recent hits, newest first
+    """
+    summary = hit_summary.read(msl, 'area', [ar_id])[ar_id]
+    objectIds = [hit['objectId'] for hit in summary['recent']]
+    objects = {}
+    if objectIds:
+        cursor = msl.cursor(buffered=True, dictionary=True)
+        query = 'SELECT objectId, ramean, decmean, rmag, gmag, jdnow()-jdmax AS "last detected (days ago)" FROM objects WHERE objectId IN (%s)'
+        cursor.execute(query % ', '.join(['%s'] * len(objectIds)), objectIds)
+        for row in cursor:
+            objects[row['objectId']] = row
+    table = [objects[objectId] for objectId in objectIds if objectId in objects]
+    return summary['n_hits'], table
+
+
 def make_image_of_MOC(fits_bytes, request):
     """*generate a skyplot of the MOC file*
 
@@ -19,11 +19,12 @@ from django.views.decorators.csrf import csrf_exempt
 from django.template.context_processors import csrf
 from django.shortcuts import render, get_object_or_404, redirect
 from lasair.apps.db_schema.utils import get_schema_dict
-from src import db_connect
+from src import db_connect, hit_summary
 import copy
 import sys
 from .forms import WatchmapForm, UpdateWatchmapForm, DuplicateWatchmapForm
-from .utils import make_image_of_MOC, add_watchmap_metadata
+from .utils import add_watchmap_metadata, recent_hits
+from lasair.apps.jobs.utils import enqueue
 from lasair.utils import bytes2string, string2bytes
 sys.path.append('../common')
 from src import bad_fits
@@ -75,14 +76,14 @@ def watchmap_index(request):
 
                 fits_bytes = fits_stream.read()
                 fits_string = bytes2string(fits_bytes)
-                png_bytes = make_image_of_MOC(fits_bytes, request=request)
-                png_string = bytes2string(png_bytes)
 
                 expire = datetime.datetime.now() + datetime.timedelta(days=settings.ACTIVE_EXPIRE)
 
                 wm = Watchmap(user=request.user, name=name, description=description,
-                    moc=fits_string, mocimage=png_string, active=active, public=public, date_expire=expire)
+                    moc=fits_string, mocimage=None, active=active, public=public, date_expire=expire)
                 wm.save()
+                # THE SKY PLOT TAKES A WHILE, SO IT IS DRAWN BY A JOB WORKER
+                enqueue('watchmap_image', request.user, f'watchmap:{wm.pk}', ar_id=wm.pk)
                 watchmapname = form.cleaned_data.get('name')
                 messages.success(request, f"The '{watchmapname}' watchmap has been successfully created")
                 return redirect(f'watchmap_detail', wm.pk)
@@ -131,8 +132,6 @@ def watchmap_detail(request, ar_id):
     cursor = msl.cursor(buffered=True, dictionary=True)
     watchmap = get_object_or_404(Watchmap, ar_id=ar_id)
 
-    resultCap = 1000
-
     # IS USER ALLOWED TO SEE THIS RESOURCE?
     is_owner = (request.user.is_authenticated) and (request.user.id == watchmap.user.id)
     is_public = (watchmap.public and watchmap.public > 0)
@@ -200,36 +199,16 @@ def watchmap_detail(request, ar_id):
         form = UpdateWatchmapForm(instance=watchmap, request=request)
         duplicateForm = DuplicateWatchmapForm(instance=watchmap, request=request)
 
-    # GRAB ALL WATCHMAP MATCHES
-    query_hit = f"""
-SELECT
-o.objectId, o.ramean,o.decmean, o.rmag, o.gmag, jdnow()-o.jdmax as "last detected (days ago)"
-FROM area_hits as h, objects AS o
-WHERE h.ar_id={ar_id}
-AND o.objectId=h.objectId
-limit {resultCap}
-"""
-
-    cursor.execute(query_hit)
-    table = cursor.fetchall()
-    count = len(table)
-
-    if count == resultCap:
-        limit = resultCap
-        # countQuery = f"""
-        # SELECT count(*) as count
-        # FROM area_hits as h, objects AS o
-        # WHERE h.ar_id={ar_id}
-        # AND o.objectId=h.objectId
-        # """
-        # cursor.execute(countQuery)
-        # count = cursor.fetchone()["count"]
+    # THE MOST RECENT WATCHMAP MATCHES, FROM THE SUMMARY THE FILTER KEEPS
+    count, table = recent_hits(msl, ar_id)
 
+    if count > len(table):
+        limit = len(table)
         if settings.DEBUG:
             apiUrl = "https://lasair.readthedocs.io/en/develop/core_functions/rest-api.html"
         else:
             apiUrl = "https://lasair.readthedocs.io/en/main/core_functions/rest-api.html"
-        messages.info(request, f"We are only displaying the first <b>{resultCap}</b> objects matched against this watchmap. But don't worry! You can access all results via the <a class='alert-link' href='{apiUrl}' target='_blank'>Lasair API</a>.")
+        messages.info(request, f"We are only displaying the <b>{limit}</b> objects most recently found within this watchmap. But don't worry! You can access all results via the <a class='alert-link' href='{apiUrl}' target='_blank'>Lasair API</a>.")
     else:
         limit = False
 
@@ -294,12 +273,11 @@ def watchmap_create(request):
             if 'watchmap_file' in request.FILES:
                 fits_bytes = (request.FILES['watchmap_file']).read()
                 fits_string = bytes2string(fits_bytes)
-                png_bytes = make_image_of_MOC(fits_bytes, request=request)
-                png_string = bytes2string(png_bytes)
-
                 wm = Watchmap(user=request.user, name=name, description=description,
-                              moc=fits_string, mocimage=png_string, active=active, public=public)
+                              moc=fits_string, mocimage=None, active=active, public=public)
                 wm.save()
+                # THE SKY PLOT TAKES A WHILE, SO IT IS DRAWN BY A JOB WORKER
+                enqueue('watchmap_image', request.user, f'watchmap:{wm.pk}', ar_id=wm.pk)
                 watchmapname = form.cleaned_data.get('name')
                 messages.success(request, f"The '{watchmapname}' watchmap has been successfully created")
                 return redirect(f'watchmap_detail', wm.pk)
@@ -366,16 +344,17 @@ def watchmap_delete(request, ar_id):
     ]
     ```
     """
-    msl = db_connect.readonly()
-    cursor = msl.cursor(buffered=True, dictionary=True)
+    msl = db_connect.remote()
     watchmap = get_object_or_404(Watchmap, ar_id=ar_id)
     name = watchmap.name
 
     # DELETE WATCHMAP
     if request.method == 'POST' and request.user.is_authenticated and watchmap.user.id == request.user.id and request.POST.get('action') == "delete":
+        hit_summary.delete(msl, 'area', ar_id)
         watchmap.delete()
         messages.success(request, f'The "{name}" watchmap has been successfully deleted')
     else:
         messages.error(request, f'You must be the owner to delete this watchmap')
+    msl.close()
 
     return redirect('watchmap_index')
@@ -0,0 +1,97 @@
+"""Benchmark of the objjson candidate post-processing against lightcurve length.
+
+Compares the per-candidate loop with a pandas summary, as objjson did before,
+with the columnar version in objjson_build, with and without the per-candidate
+JSON strings. Synthetic lightcurves, two thirds detections. Needs the same
+environment as the web server, run from this directory.
+
+Usage: python3 bench_objjson.py [npoints ...]
+"""
+import sys
+import json
+import time
+import random
+from datetime import datetime, timedelta
+import pandas as pd
+sys.path.append('..')
+sys.path.append('../../common')
+import settings
+from src import objectStore
+from utils import objjson_build, mjd_now
+
+
+def make_bundle(n):
+    candidates = []
+    for i in range(n):
+        cand = {'jd': 2458300.5 + random.uniform(0, 1500), 'fid': random.choice([1, 2])}
+        if i % 3:
+            cand.update({'candid': 2000000000000000000 + i, 'magpsf': random.uniform(17, 20),
+                'sigmapsf': random.uniform(0.02, 0.2), 'isdiffpos': random.choice(['t', 't', 'f']),
+                'ra': 150.0, 'dec': 20.0, 'nid': 1200, 'ssnamenr': 'null', 'drb': 0.99})
+        else:
+            cand['diffmaglim'] = random.uniform(19, 21)
+        candidates.append(cand)
+    return {'objectId': 'ZTF18bench', 'candidates': candidates, 'forcedphot': []}
+
+
+def before(bundle, image_store):
+    "candidate post-processing as done by objjson up to now"
+    now = mjd_now()
+    objectData = {}
+    candidates = bundle['candidates']
+    for cand in candidates:
+        json_formatted_str = json.dumps(cand, indent=2)
+        cand['json'] = json_formatted_str[1:-1]
+        cand['mjd'] = mjd = float(cand['jd']) - 2400000.5
+        cand['imjd'] = int(mjd)
+        cand['since_now'] = mjd - now
+        if 'candid' in cand:
+            candid = cand['candid']
+            date = datetime.strptime("1858/11/17", "%Y/%m/%d")
+            date += timedelta(mjd)
+            cand['utc'] = date.strftime("%Y-%m-%d %H:%M:%S")
+            cand['image_urls'] = {}
+            for cutoutType in ['Science', 'Template', 'Difference']:
+                candid_cutoutType = '%s_cutout%s' % (candid, cutoutType)
+                filename = image_store.getFileName(candid_cutoutType, int(mjd))
+                url = filename.replace(
+                    '/mnt/cephfs/lasair',
+                    f'https://{settings.LASAIR_URL}/lasair/static')
+                cand['image_urls'][cutoutType] = url
+        else:
+            cand['magpsf'] = cand['diffmaglim']
+    candidates.sort(key=lambda c: c['mjd'], reverse=True)
+    df = pd.DataFrame(candidates)
+    df.sort_values(['mjd'], ascending=[True], inplace=True)
+    detections = df.loc[(df['candid'] > 0)]
+    objectData["discMag"] = f"{detections['magpsf'].values[0]:.2f}±{detections['sigmapsf'].values[0]:.2f}"
+    objectData["latestMag"] = f"{detections['magpsf'].values[-1]:.2f}±{detections['sigmapsf'].values[-1]:.2f}"
+    peakMag = detections[detections['magpsf'] == detections['magpsf'].min()]
+    objectData["peakMag"] = f"{peakMag['magpsf'].values[0]:.2f}±{peakMag['sigmapsf'].values[0]:.2f}"
+    return objectData, candidates
+
+
+def after(bundle, image_store, candidate_json):
+    data = objjson_build('ZTF18bench', {}, {}, [], bundle, image_store, candidate_json=candidate_json)
+    return data['objectData'], data['candidates']
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [10, 1000, 10000]
+    image_store = objectStore.objectStore(suffix='fits', fileroot=settings.IMAGEFITS)
+    print('%8s %12s %12s %14s' % ('points', 'before ms', 'after ms', 'no json ms'))
+    for n in sizes:
+        bundle = make_bundle(n)
+        times = []
+        for run in [lambda b: before(b, image_store),
+                    lambda b: after(b, image_store, True),
+                    lambda b: after(b, image_store, False)]:
+            copy = json.loads(json.dumps(bundle))
+            t = time.perf_counter()
+            objectData, candidates = run(copy)
+            times.append(1000 * (time.perf_counter() - t))
+            if len(times) == 1:
+                expected = objectData
+            assert objectData['peakMag'] == expected['peakMag']
+            assert objectData['discMag'] == expected['discMag']
+        print('%8d %12.1f %12.1f %14.1f' % (n, times[0], times[1], times[2]))
@@ -1,5 +1,10 @@
+import os
 import json
 import sys
+import time
+import atexit
+import threading
+from collections import deque
 from cassandra.cluster import Cluster
 from cassandra.query import dict_factory
 
@@ -9,16 +14,107 @@ class lightcurve_fetcher_error(Exception):
         self.message = message
 
 
+CANDIDATES_QUERY = "SELECT candid, jd, ra, dec, fid, nid, magpsf, sigmapsf, " \
+                   "magnr,sigmagnr, magzpsci, " \
+                   "isdiffpos, ssdistnr, ssnamenr, drb " \
+                   "from candidates where objectId = ?"
+CANDIDATES_FULL_QUERY = "SELECT * from candidates where objectId = ?"
+NONCANDIDATES_QUERY = "SELECT jd, fid, diffmaglim from noncandidates where objectId = ?"
+FORCEDPHOT_QUERY = "SELECT objectid, jd, ranr, decnr, fid, forcediffimflux, forcediffimfluxunc, magzpsci " \
+                   "from forcedphot where objectId = ?"
+FORCEDPHOT_FULL_QUERY = "SELECT * from forcedphot where objectId = ?"
+
+
+class cassandra_session_manager():
+    """Process-wide Cassandra session, created lazily on first use.
+
+    Building a Cluster and connecting takes hundreds of milliseconds, so one
+    session is shared by every fetcher in the process. WSGI servers fork their
+    workers, and a driver connection must not cross a fork, so the session
+    remembers the pid that made it and a child process builds its own.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.hosts = None
+        self.cluster = None
+        self.session = None
+        self.prepared = {}
+
+    def get_session(self, cassandra_hosts):
+        pid = os.getpid()
+        hosts = list(cassandra_hosts)
+        if self.session is not None and self.pid == pid and self.hosts == hosts:
+            return self.session
+        with self.lock:
+            if self.session is None or self.pid != pid or self.hosts != hosts:
+                # the parent's cluster belongs to the parent, only shut down our own
+                if self.cluster is not None and self.pid == pid:
+                    self.cluster.shutdown()
+                self.cluster = Cluster(hosts)
+                session = self.cluster.connect()
+                # Set the row_factory to dict_factory, otherwise
+                # the data returned will be in the form of object properties.
+                session.row_factory = dict_factory
+                session.set_keyspace('lasair')
+                self.prepared = {}
+                self.hosts = hosts
+                self.pid = pid
+                self.session = session
+        return self.session
+
+    def prepare(self, query):
+        """ Prepared statement for a query, prepared once per session """
+        stmt = self.prepared.get(query)
+        if stmt is None:
+            with self.lock:
+                stmt = self.prepared.get(query)
+                if stmt is None:
+                    stmt = self.session.prepare(query)
+                    self.prepared[query] = stmt
+        return stmt
+
+    def after_fork(self):
+        """ In a forked child, forget the parent's cluster and lock without touching them """
+        self.lock = threading.Lock()
+        self.pid = None
+        self.cluster = None
+        self.session = None
+        self.prepared = {}
+
+    def shutdown(self):
+        if self.cluster is not None and self.pid == os.getpid():
+            self.cluster.shutdown()
+        self.cluster = None
+        self.session = None
+        self.prepared = {}
+
+
+session_manager = cassandra_session_manager()
+atexit.register(session_manager.shutdown)
+os.register_at_fork(after_in_child=session_manager.after_fork)
+
+
+def candidate_rows(rows):
+    """ Candidates with isdiffpos in the t/f convention """
+    candidates = []
+    for cand in rows:
+        if cand['isdiffpos'] == '1':
+            cand['isdiffpos'] = 't'
+        if cand['isdiffpos'] == '0':
+            cand['isdiffpos'] = 'f'
+        candidates.append(cand)
+    return candidates
+
+
 class lightcurve_fetcher():
     def __init__(self, cassandra_hosts=None, fileroot=None):
         if cassandra_hosts is not None:
             self.using_cassandra = True
-            self.cluster = Cluster(cassandra_hosts)
-            self.session = self.cluster.connect()
-            # Set the row_factory to dict_factory, otherwise
-            # the data returned will be in the form of object properties.
-            self.session.row_factory = dict_factory
-            self.session.set_keyspace('lasair')
+            # borrow the shared session, the fetcher does not own a cluster
+            self.session = session_manager.get_session(cassandra_hosts)
+            self.latency_ms = None
         elif fileroot is not None:
             self.using_cassandra = False
             self.fileroot = fileroot
@@ -26,30 +122,84 @@ class lightcurve_fetcher():
         else:
             raise lightcurve_fetcher_error('Must give either cassandra_hosts or fileroot')
 
+    def execute(self, query, objectId):
+        return self.session.execute(session_manager.prepare(query), (objectId,))
+
+    def execute_async(self, query, objectId):
+        return self.session.execute_async(session_manager.prepare(query), (objectId,))
+
+    def submit(self, objectId, full=False, forcedphot=True):
+        """ Start the partition reads for one object, all three at once """
+        if full:
+            queries = [CANDIDATES_FULL_QUERY, NONCANDIDATES_QUERY, FORCEDPHOT_FULL_QUERY]
+        else:
+            queries = [CANDIDATES_QUERY, NONCANDIDATES_QUERY, FORCEDPHOT_QUERY]
+        if not forcedphot:
+            queries = queries[:2]
+        t = time.perf_counter()
+        return (objectId, t, [self.execute_async(q, objectId) for q in queries])
+
+    def collect(self, pending):
+        """ Wait for the reads started by submit and build the lightcurve bundle """
+        (objectId, t, futures) = pending
+        candidates = candidate_rows(futures[0].result())
+        candidates += list(futures[1].result())
+        bundle = {'objectId': objectId, 'candidates': candidates}
+        if len(futures) > 2:
+            bundle['forcedphot'] = list(futures[2].result())
+        bundle['latency_ms'] = 1000 * (time.perf_counter() - t)
+        self.latency_ms = bundle['latency_ms']
+        return bundle
+
+    def fetch_bundle(self, objectId, full=False):
+        """ Candidates, noncandidates and forced photometry for one object, read concurrently.
+
+        Returns a dictionary with objectId, candidates (detections then non-detections,
+        as fetch), forcedphot, and latency_ms, the wall time for the three reads.
+        """
+        if not self.using_cassandra:
+            raise lightcurve_fetcher_error('fetch_bundle needs cassandra')
+        return self.collect(self.submit(objectId, full=full))
+
+    def fetch_many(self, objectIds, full=False, forcedphot=True, max_in_flight=16, errors=False):
+        """ Generator of lightcurve bundles for many objects, in the order given.
+
+        At most max_in_flight objects (three reads each) are outstanding at once.
+        With errors, an object whose reads fail gives {'objectId', 'error'} in
+        its place, rather than raising, so the rest still come.
+        """
+        if not self.using_cassandra:
+            raise lightcurve_fetcher_error('fetch_many needs cassandra')
+
+        def submit(objectId):
+            try:
+                return self.submit(objectId, full=full, forcedphot=forcedphot)
+            except Exception as e:
+                if not errors:
+                    raise
+                return (objectId, None, e)
+
+        def collect(pending):
+            try:
+                if isinstance(pending[2], Exception):
+                    raise pending[2]
+                return self.collect(pending)
+            except Exception as e:
+                if not errors:
+                    raise
+                return {'objectId': pending[0], 'error': str(e)}
+
+        pending = deque()
+        for objectId in objectIds:
+            if len(pending) >= max_in_flight:
+                yield collect(pending.popleft())
+            pending.append(submit(objectId))
+        while pending:
+            yield collect(pending.popleft())
+
     def fetch(self, objectId, full=False):
         if self.using_cassandra:
-            if full:
-                query = "SELECT * "
-            else:
-                query = "SELECT candid, jd, ra, dec, fid, nid, magpsf, sigmapsf, "
-                query += "magnr,sigmagnr, magzpsci, "
-                query += "isdiffpos, ssdistnr, ssnamenr, drb "
-            query += "from candidates where objectId = '%s'" % objectId
-            ret = self.session.execute(query)
-            candidates = []
-            for cand in ret:
-                if cand['isdiffpos'] == '1':
-                    cand['isdiffpos'] = 't'
-                if cand['isdiffpos'] == '0':
-                    cand['isdiffpos'] = 'f'
-                candidates.append(cand)
-
-            query = "SELECT jd, fid, diffmaglim "
-            query += "from noncandidates where objectId = '%s'" % objectId
-            ret = self.session.execute(query)
-            for cand in ret:
-                candidates.append(cand)
-            return candidates
+            return self.collect(self.submit(objectId, full=full, forcedphot=False))['candidates']
         else:
             #            store = objectStore(suffix='json', fileroot=self.fileroot, double=True)
             store = objectStore(suffix='json', fileroot=self.fileroot)
@@ -66,8 +216,8 @@ class lightcurve_fetcher():
                 raise lightcurve_fetcher_error('Cannot parse json for object %s' % objectId)
 
     def close(self):
-        if self.session:
-            self.cluster.shutdown()
+        # the session is shared by the process, so just let go of it
+        self.session = None
 
 
 class forcedphot_lightcurve_fetcher(lightcurve_fetcher):
@@ -75,12 +225,12 @@ class forcedphot_lightcurve_fetcher(lightcurve_fetcher):
     def fetch(self, objectId, full=False):
         if self.using_cassandra:
             if full:
-                query = "SELECT * "
+                query = FORCEDPHOT_FULL_QUERY
             else:
-                query = "SELECT objectid, jd, ranr, decnr, fid, forcediffimflux, forcediffimfluxunc, magzpsci "
-            query += "from forcedphot where objectId = '%s'" % objectId
-            ret = self.session.execute(query)
-            candidates = [c for c in ret]
+                query = FORCEDPHOT_QUERY
+            t = time.perf_counter()
+            candidates = [c for c in self.execute(query, objectId)]
+            self.latency_ms = 1000 * (time.perf_counter() - t)
             return candidates
 
 
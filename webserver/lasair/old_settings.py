@@ -40,8 +40,26 @@ QUERY_CACHE = LASAIR_ROOT + 'query_cache'
 
 BLOB_STORE_ROOT = '/mnt/cephfs/lasair'
 SYSTEM_STATUS   = '/mnt/cephfs/lasair/system_status/status'
+SYSTEM_STATUS_DB = False     # keep the system status in the lasair_status table rather than the files
+METRICS_DIR = '/var/lib/prometheus/node-exporter'   # textfile collector directory for the Prometheus metrics
+METRICS_INTERVAL = 15        # seconds between writes of the metrics textfile of a long running process
 
 SHERLOCK_SERVICE = 'lasair-ztf-sherlock-0'
+SHERLOCK_CACHE_TTL = 86400   # seconds to keep full Sherlock API responses
+RENDER_CACHE_TTL = 600       # seconds to keep object page data and lightcurve plots
+RENDER_CACHE_ENTRIES = 500   # object page entries kept by each web server process
+RENDER_CACHE_MAX_BYTES = 262144   # larger object page entries are not cached
+QUERY_RESULT_CACHE_TTL = 300       # seconds to keep query results, if no filter batch comes first
+QUERY_RESULT_CACHE_ENTRIES = 200     # query results kept by each web server process
+QUERY_RESULT_CACHE_MAX_ROWS = 1000   # larger query results are not cached
+MMA_HTM_LEVEL = 6            # deepest HTM level along the edge of a skymap region
+MMA_CACHE_TTL = 600          # seconds to keep the ZTF candidates of a skymap and JD window
+MMA_CACHE_ENTRIES = 100      # skymap ranges and candidate lists kept by each web server process
+MMA_CACHE_MAX_ROWS = 10000   # larger candidate lists are not cached
+THROTTLE_TIER_TTL = 300      # seconds to keep the API user class of a token
+JOBS_PER_USER = 1     # background jobs one user may have running at once
+JOBS_WORKERS = 2      # worker processes started by manage.py run_jobs
+BULK_CONE_MAX_POSITIONS = 10000   # most positions in one /api/cone/bulk/ request
 
 TNS_WATCHLIST_ID = 141
 CSRF_TRUSTED_ORIGINS = ['https://lasair-ztf.lsst.ac.uk']
@@ -65,6 +83,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'lasair',
     'lasairapi',
+    'lasair.apps.jobs',
     'django.contrib.admin',
     'rest_framework',
     'rest_framework.authtoken',
@@ -78,6 +97,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'lasairapi.metrics.APIMetricsMiddleware',
 ]
 
 # 2020-07-07 KWS Added token authentication class
@@ -88,22 +108,21 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
     ],
     'DEFAULT_THROTTLE_CLASSES': (
-        'rest_framework.throttling.UserRateThrottle',
-        'lasairapi.throttle.UserClassRateThrottle'
+        'lasairapi.throttle.UserClassRateThrottle',
     ),
-    'DEFAULT_THROTTLE_RATES': { 'user': '1000000/hour', },
+    'DEFAULT_THROTTLE_RATES': { 'user': '1000000/hour', 'positions': '100000000/hour', },
 
     # direct them to the dox to get more
     'EXCEPTION_HANDLER': 'lasairapi.throttle.custom_exception_handler',
 
     # this is for the 'dummy' user key in the api dox
-    'ANON_THROTTLE_RATES'   : { 'user': '10/hour', },
+    'ANON_THROTTLE_RATES'   : { 'user': '10/hour', 'positions': '1000/hour', },
 
     # for somebody who has made their own token
-    'USER_THROTTLE_RATES'   : { 'user': '100/hour', },
+    'USER_THROTTLE_RATES'   : { 'user': '100/hour', 'positions': '100000/hour', },
 
     # for somebody with a token in the 'powerapi' group
-    'POWER_THROTTLE_RATES'  : { 'user': '10000/hour', },
+    'POWER_THROTTLE_RATES'  : { 'user': '10000/hour', 'positions': '10000000/hour', },
 }
 
 ROOT_URLCONF = 'lasair.urls'
@@ -127,6 +146,35 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'lasair.wsgi.application'
 
+# Each web server process has these caches in its own memory. The query results,
+# object pages and skymap candidates have caches of their own, so they cannot
+# push the API throttle state out of the default cache. The local memory cache
+# has no limit in bytes, so each holds at most MAX_ENTRIES of the largest entry
+# that is cached: 200 x 1000 rows of query results, 500 x 256 kB of object pages,
+# and 100 x 10000 skymap candidates.
+CACHES = {
+    'default': {
+        'BACKEND':  'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+        'OPTIONS':  {'MAX_ENTRIES': 10000},
+    },
+    'query': {
+        'BACKEND':  'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'query',
+        'OPTIONS':  {'MAX_ENTRIES': QUERY_RESULT_CACHE_ENTRIES},
+    },
+    'render': {
+        'BACKEND':  'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'render',
+        'OPTIONS':  {'MAX_ENTRIES': RENDER_CACHE_ENTRIES},
+    },
+    'mma': {
+        'BACKEND':  'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'mma',
+        'OPTIONS':  {'MAX_ENTRIES': MMA_CACHE_ENTRIES},
+    },
+}
+
 CASSANDRA_HEAD          = ['lasair-ztf-cassandranodes-0', 'lasair-ztf-cassandranodes-1', 'lasair-ztf-cassandranodes-2', 'lasair-ztf-cassandranodes-3', 'lasair-ztf-cassandranodes-4']
 
 DATABASES = {
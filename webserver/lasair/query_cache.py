@@ -0,0 +1,121 @@
+"""Result cache for the SQL built from user queries.
+
+The filter page, topic_refresh and /api/query/ run whatever build_query makes,
+and a popular public filter is run by many people and polling scripts at once.
+Results are keyed on the SQL with its whitespace normalised, the limit and
+offset, and the time of the last filter batch commit, which the filter writes
+to the system status. A new batch changes the key, so a cached result is
+never older than the last committed batch; annotations and other writes
+between batches are covered by the TTL. Large results are not cached, and
+storage is the Django cache called 'query' if it is configured, otherwise the
+default cache; settings.CACHES gives it a number of entries, so with the row
+limit here it holds a bounded number of rows. The cache is local to each web
+server process, and so are the hits and misses counted for the status page.
+"""
+import re
+import hashlib
+from collections import Counter
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+import src.date_nid as date_nid
+from src import db_connect
+from src.manage_status import status_for
+import settings as lasair_settings
+
+# seconds a result is kept, if no batch comes in first
+QUERY_RESULT_CACHE_TTL = getattr(lasair_settings, 'QUERY_RESULT_CACHE_TTL', 300)
+
+# results with more rows than this are not cached
+QUERY_RESULT_CACHE_MAX_ROWS = getattr(lasair_settings, 'QUERY_RESULT_CACHE_MAX_ROWS', 1000)
+
+NAMESPACES = ['filter', 'topic', 'api']
+
+# quoted strings, whose whitespace is left alone
+QUOTED = re.compile(r'''('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")''', re.S)
+WHITESPACE = re.compile(r'\s+')
+
+# (namespace, 'hits' or 'misses') -> count, in this process
+COUNTS = Counter()
+
+
+def get_cache():
+    try:
+        return caches['query']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def normalise(sql):
+    """collapse runs of whitespace outside quoted strings, so trivially different SQL shares an entry
+
+     **Key Arguments:**
+
+    - `sql` -- the SQL from build_query
+    """
+    parts = QUOTED.split(sql.strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = WHITESPACE.sub(' ', parts[i])
+    return ''.join(parts)
+
+
+def batch_version():
+    """return the time of the last filter batch commit from the system status, or 0 if there is none tonight"""
+    nid = date_nid.nid_now()
+    ms = status_for(lasair_settings, db_connect.readonly)
+    try:
+        filter_commit = ms.get('filter_commit', nid, 0)
+    except Exception:
+        filter_commit = 0
+    ms.close()
+    return '%d:%s' % (nid, filter_commit)
+
+
+def count(namespace, outcome):
+    COUNTS[(namespace, outcome)] += 1
+
+
+def cached(namespace, sql, limit, offset, build):
+    """return cached rows for a query, or run it with `build()` and cache them
+
+     **Key Arguments:**
+
+    - `namespace` -- which caller, one of NAMESPACES
+    - `sql` -- the SQL from build_query, without LIMIT or OFFSET
+    - `limit` -- the row limit the query is run with
+    - `offset` -- the offset the query is run with
+    - `build` -- function of no arguments that runs the query and returns a list of rows
+
+    **Usage:**
+
+    ```python
+    from lasair.query_cache import cached
+    table = cached('filter', sqlquery_real, limit, offset, lambda: run(sqlquery_limit))
+    ```
+    """
+    cache = get_cache()
+    text = '%s\n%d\n%d\n%s' % (normalise(sql), limit, offset, batch_version())
+    key = 'query:' + hashlib.sha256(text.encode()).hexdigest()
+    rows = cache.get(key)
+    if rows is not None:
+        count(namespace, 'hits')
+        return rows
+    count(namespace, 'misses')
+    rows = build()
+    if len(rows) <= QUERY_RESULT_CACHE_MAX_ROWS:
+        cache.set(key, rows, QUERY_RESULT_CACHE_TTL)
+    return rows
+
+
+def stats():
+    """return hits, misses and hit rate for each namespace, in this web server process since it started"""
+    result = {}
+    for namespace in NAMESPACES:
+        hits = COUNTS[(namespace, 'hits')]
+        misses = COUNTS[(namespace, 'misses')]
+        total = hits + misses
+        result[namespace] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else None,
+        }
+    return result
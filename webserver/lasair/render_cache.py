@@ -0,0 +1,107 @@
+"""Render cache for object pages and the /api/object/ payload.
+
+Entries are keyed on the objectId and the jdmax of its row in `objects`, so a
+new detection changes the key and the old entry is simply never read again.
+The objjson data and the raw lightcurve bundle are cached as separate entries.
+Storage is the Django cache called 'render' if it is configured, otherwise the
+default cache; the local memory backend is LRU with a TTL. settings.CACHES gives
+it a number of entries, and entries larger than RENDER_CACHE_MAX_BYTES pickled
+are not cached, so it holds a bounded number of bytes. The cache is local to
+each web server process, and so are the hits and misses counted for the status
+page.
+"""
+import pickle
+from collections import Counter
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from src import db_connect
+import settings as lasair_settings
+
+# seconds an entry is kept; the "days ago" fields in objjson go stale by this much
+RENDER_CACHE_TTL = getattr(lasair_settings, 'RENDER_CACHE_TTL', 600)
+
+# entries larger than this, pickled, are not cached
+RENDER_CACHE_MAX_BYTES = getattr(lasair_settings, 'RENDER_CACHE_MAX_BYTES', 262144)
+
+NAMESPACES = ['objjson', 'lightcurve']
+
+# (namespace, 'hits' or 'misses') -> count, in this process
+COUNTS = Counter()
+
+
+def get_cache():
+    try:
+        return caches['render']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def object_version(objectId):
+    """return the jdmax of an object, which changes with every new detection, or None if not in the database
+
+     **Key Arguments:**
+
+    - `objectId` -- the object identifier
+    """
+    msl = db_connect.readonly()
+    cursor = msl.cursor(buffered=True, dictionary=True)
+    cursor.execute('SELECT jdmax FROM objects WHERE objectId=%s', (objectId,))
+    row = cursor.fetchone()
+    cursor.close()
+    msl.close()
+    if not row:
+        return None
+    return row['jdmax']
+
+
+def count(namespace, outcome):
+    COUNTS[(namespace, outcome)] += 1
+
+
+def cached(namespace, objectId, version, build, variant=''):
+    """return a cached value, or build it with `build()` and cache it
+
+     **Key Arguments:**
+
+    - `namespace` -- which kind of entry, one of NAMESPACES
+    - `objectId` -- the object identifier
+    - `version` -- the object version from `object_version`, None means do not cache
+    - `build` -- function of no arguments that computes the value
+    - `variant` -- anything else the value depends on, e.g. full or lite
+
+    **Usage:**
+
+    ```python
+    from lasair.render_cache import cached, object_version
+    version = object_version(objectId)
+    data = cached('objjson', objectId, version, lambda: objjson(objectId))
+    ```
+    """
+    if version is None:
+        return build()
+    cache = get_cache()
+    key = 'render:%s:%s:%s:%s' % (namespace, objectId, repr(version), variant)
+    value = cache.get(key)
+    if value is not None:
+        count(namespace, 'hits')
+        return value
+    count(namespace, 'misses')
+    value = build()
+    if value is not None and len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) <= RENDER_CACHE_MAX_BYTES:
+        cache.set(key, value, RENDER_CACHE_TTL)
+    return value
+
+
+def stats():
+    """return hits, misses and hit rate for each namespace, in this web server process since it started"""
+    result = {}
+    for namespace in NAMESPACES:
+        hits = COUNTS[(namespace, 'hits')]
+        misses = COUNTS[(namespace, 'misses')]
+        total = hits + misses
+        result[namespace] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else None,
+        }
+    return result
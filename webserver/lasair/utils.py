@@ -1,23 +1,24 @@
 from src import objectStore
 import sys
-import os
 from django.shortcuts import get_object_or_404
 from django.http import HttpResponse, HttpResponseRedirect
 from django.template.context_processors import csrf
 from django.http import JsonResponse
 import dateutil.parser as dp
-from datetime import datetime, timedelta
+from datetime import datetime
 import time
 import json
 import math
 import ephem
 import json
-import pandas as pd
+import hashlib
+import numpy as np
+from functools import lru_cache
 import base64
 from src import db_connect
 from datetime import date
 import settings
-from lasair.lightcurves import lightcurve_fetcher, forcedphot_lightcurve_fetcher
+from lasair.lightcurves import lightcurve_fetcher
 from astropy.time import Time
 sys.path.append('../../common')
 
@@ -116,7 +117,7 @@ def decsex(de):
         return '-%02d:%02d:%.3f' % (d, m, s)
 
 
-def objjson(objectId, full=False):
+def objjson(objectId, full=False, candidate_json=True):
     """return all data for an object as a json object (`objectId`,`objectData`,`candidates`,`count_isdiffpos`,`count_all_candidates`,`count_noncandidate`,`sherlock`,`TNS`)
 
     **Usage:**
@@ -126,19 +127,128 @@ def objjson(objectId, full=False):
     objectData = objjson(objID)
     ```  
     """
-    objectData = None
-    message = ''
+    for data in objjson_many([objectId], full=full, candidate_json=candidate_json):
+        return data
+
+
+def ordinal_suffix(day):
+    if 3 < day < 21 or 23 < day < 31:
+        return 'th'
+    else:
+        return {1: 'st', 2: 'nd', 3: 'rd'}[day % 10]
+
+
+def rows_by_objectId(cursor, query, objectIds):
+    """run a query with an `IN (...)` list of objectIds and return the rows grouped by objectId
+
+     **Key Arguments:**
+
+    - `cursor` -- a dictionary cursor
+    - `query` -- query with a single `%s` where the placeholder list goes
+    - `objectIds` -- list of objectIds
+    """
+    placeholders = ','.join(['%s'] * len(objectIds))
+    cursor.execute(query % placeholders, tuple(objectIds))
+    rows = {}
+    for row in cursor:
+        rows.setdefault(row['objectId'], []).append(row)
+    return rows
+
+
+def objjson_many(objectIds, full=False, catch_errors=False, chunk=500, candidate_json=True):
+    """generator of objjson results for many objects, in the order given
+
+    The objects, sherlock_classifications and TNS rows are fetched with one
+    `IN (...)` query each per chunk of objectIds, and the lightcurves are read
+    from Cassandra concurrently. Objects not in the database give None.
+
+     **Key Arguments:**
+
+    - `objectIds` -- list of objectIds
+    - `full` -- fetch all candidate attributes
+    - `catch_errors` -- yield `{'error': ...}` for an object that fails rather than raising
+    - `chunk` -- number of objectIds per database round trip
+    - `candidate_json` -- add the indented JSON of each candidate, as shown on the object page
+
+    **Usage:**
+
+    ```python
+    from lasair.utils import objjson_many
+    for data in objjson_many(objectIds):
+        ...
+    ```
+    """
     msl = db_connect.readonly()
     cursor = msl.cursor(buffered=True, dictionary=True)
-    query = 'SELECT ncand, ramean, decmean, glonmean, glatmean, jdmin, jdmax '
-    query += 'FROM objects WHERE objectId = "%s"' % objectId
-    cursor.execute(query)
-    for row in cursor:
-        objectData = row
+    LF = lightcurve_fetcher(cassandra_hosts=settings.CASSANDRA_HEAD)
+    image_store = objectStore.objectStore(suffix='fits', fileroot=settings.IMAGEFITS)
 
-    if not objectData:
-        return None
+    try:
+        for i in range(0, len(objectIds), chunk):
+            chunkIds = objectIds[i:i + chunk]
+
+            query = 'SELECT objectId, ncand, ramean, decmean, glonmean, glatmean, jdmin, jdmax '
+            query += 'FROM objects WHERE objectId IN (%s)'
+            objectRows = rows_by_objectId(cursor, query, chunkIds)
+
+            query = 'SELECT * from sherlock_classifications WHERE objectId IN (%s)'
+            sherlockRows = rows_by_objectId(cursor, query, chunkIds)
+
+            query = 'SELECT * '
+            query += 'FROM crossmatch_tns JOIN watchlist_hits ON crossmatch_tns.tns_name = watchlist_hits.name '
+            query += 'WHERE watchlist_hits.wl_id=%d ' % settings.TNS_WATCHLIST_ID
+            query += 'AND watchlist_hits.objectId IN (%s)'
+            tnsRows = rows_by_objectId(cursor, query, chunkIds)
+
+            # only read lightcurves for objects that exist
+            found = [objectId for objectId in chunkIds if objectId in objectRows]
+            bundles = None
+            nfetched = 0
+
+            for objectId in chunkIds:
+                if objectId not in objectRows:
+                    yield None
+                    continue
+                objectData = dict(objectRows[objectId][-1])
+                objectData.pop('objectId')
+                sherlock = sherlockRows.get(objectId, [{}])[-1]
+                try:
+                    if bundles is None:
+                        bundles = LF.fetch_many(found[nfetched:], full=full)
+                    nfetched += 1
+                    try:
+                        bundle = next(bundles)
+                    except Exception:
+                        # the generator ends with the error, so the rest are fetched anew
+                        bundles = None
+                        raise
+                    yield objjson_build(objectId, objectData, sherlock,
+                                        tnsRows.get(objectId, []), bundle, image_store,
+                                        candidate_json=candidate_json)
+                except Exception as e:
+                    if not catch_errors:
+                        raise
+                    yield {'error': str(e)}
+    finally:
+        LF.close()
+        cursor.close()
+        msl.close()
+
+
+def objjson_build(objectId, objectData, sherlock, tnsRows, bundle, image_store, candidate_json=True):
+    """build the objjson result for one object from its database rows and lightcurve bundle
 
+     **Key Arguments:**
+
+    - `objectId` -- the object identifier
+    - `objectData` -- the row from `objects`
+    - `sherlock` -- the row from `sherlock_classifications`, or an empty dictionary
+    - `tnsRows` -- list of `crossmatch_tns` rows joined to the TNS watchlist hits
+    - `bundle` -- lightcurve bundle from `lightcurve_fetcher.fetch_bundle`
+    - `image_store` -- objectStore for the cutout images
+    - `candidate_json` -- add the indented JSON of each candidate as `json`
+    """
+    message = ''
     now = mjd_now()
     if objectData:
         if objectData and 'annotation' in objectData and objectData['annotation']:
@@ -155,25 +265,8 @@ def objjson(objectId, full=False):
         objectData['mjdmin_ago'] = now - (objectData['jdmin'] - 2400000.5)
         objectData['mjdmax_ago'] = now - (objectData['jdmax'] - 2400000.5)
 
-    sherlock = {}
-    query = 'SELECT * from sherlock_classifications WHERE objectId = "%s"' % objectId
-    cursor.execute(query)
-    for row in cursor:
-        sherlock = row
-
     TNS = {}
-    query = 'SELECT * '
-    query += 'FROM crossmatch_tns JOIN watchlist_hits ON crossmatch_tns.tns_name = watchlist_hits.name '
-    query += 'WHERE watchlist_hits.wl_id=%d AND watchlist_hits.objectId="%s"' % (settings.TNS_WATCHLIST_ID, objectId)
-
-    def ordinal_suffix(day):
-        if 3 < day < 21 or 23 < day < 31:
-            return 'th'
-        else:
-            return {1: 'st', 2: 'nd', 3: 'rd'}[day % 10]
-
-    cursor.execute(query)
-    for row in cursor:
+    for row in tnsRows:
         for k, v in row.items():
             if isinstance(v, datetime):
                 suffix = ordinal_suffix(v.day)
@@ -186,105 +279,38 @@ def objjson(objectId, full=False):
             elif v:
                 TNS[k] = v
 
-    LF = lightcurve_fetcher(cassandra_hosts=settings.CASSANDRA_HEAD)
-    candidates = LF.fetch(objectId, full=full)
-    LF.close()
-
-    LF = forcedphot_lightcurve_fetcher(cassandra_hosts=settings.CASSANDRA_HEAD)
-    fpcandidates = LF.fetch(objectId, full=full)
+    candidates = bundle['candidates']
+    fpcandidates = bundle['forcedphot']
     for cand in fpcandidates:
-        cand['mjd'] = mjd = float(cand['jd']) - 2400000.5
+        cand['mjd'] = float(cand['jd']) - 2400000.5
 
-    LF.close()
-
-    count_isdiffpos = count_all_candidates = count_noncandidate = 0
-    image_store = objectStore.objectStore(suffix='fits', fileroot=settings.IMAGEFITS)
-    image_urls = {}
-    for cand in candidates:
-        json_formatted_str = json.dumps(cand, indent=2)
-        cand['json'] = json_formatted_str[1:-1]
-        cand['mjd'] = mjd = float(cand['jd']) - 2400000.5
-        cand['imjd'] = int(mjd)
-        cand['since_now'] = mjd - now
-        if 'candid' in cand:
-            count_all_candidates += 1
-            candid = cand['candid']
-            date = datetime.strptime("1858/11/17", "%Y/%m/%d")
-            date += timedelta(mjd)
-            cand['utc'] = date.strftime("%Y-%m-%d %H:%M:%S")
-
-            # ADD IMAGE URLS
-            cand['image_urls'] = {}
-            for cutoutType in ['Science', 'Template', 'Difference']:
-                candid_cutoutType = '%s_cutout%s' % (candid, cutoutType)
-                filename = image_store.getFileName(candid_cutoutType, int(mjd))
-                if 1 == 1 or os.path.exists(filename):
-                    url = filename.replace(
-                        '/mnt/cephfs/lasair',
-                        f'https://{settings.LASAIR_URL}/lasair/static')
-                    cand['image_urls'][cutoutType] = url
-
-            if 'ssnamenr' in cand:
-                ssnamenr = cand['ssnamenr']
-                if ssnamenr == 'null':
-                    ssnamenr = None
-            if cand['isdiffpos'] == 't' or cand['isdiffpos'] == '1':
-                count_isdiffpos += 1
-        else:
-            count_noncandidate += 1
-            cand['magpsf'] = cand['diffmaglim']
+    if candidate_json:
+        for cand in candidates:
+            cand['json'] = candidate_json_str(cand)
 
+    # COLUMNAR LIGHTCURVE, ONE ARRAY PER ATTRIBUTE
+    lc = lightcurve_arrays(candidates)
+    count_all_candidates = int(lc['detection'].sum())
+    count_noncandidate = len(candidates) - count_all_candidates
+    count_isdiffpos = int(lc['isdiffpos'].sum())
     if count_all_candidates == 0:
         return None
-
-    if not objectData:
-        ra = float(cand['ra'])
-        dec = float(cand['dec'])
-        objectData = {'ramean': ra, 'decmean': dec,
-                      'rasex': rasex(ra), 'decsex': decsex(dec),
-                      'ncand': len(candidates), 'MPCname': ssnamenr}
-        objectData['annotation'] = 'Unknown object'
-        if row['ssdistnr'] > 0 and row['ssdistnr'] < 10:
-            objectData['MPCname'] = ssnamenr
-
     message += 'Got %d candidates and %d noncandidates' % (count_all_candidates, count_noncandidate)
 
-    candidates.sort(key=lambda c: c['mjd'], reverse=True)
-
-    df = pd.DataFrame(candidates)
-    # SORT BY COLUMN NAME
-    df.sort_values(['mjd'],
-                   ascending=[True], inplace=True)
-
-    detections = df.loc[(df['candid'] > 0)]
+    utc = mjd_to_utc(lc['mjd'])
+    since_now = lc['mjd'] - now
+    for i, cand in enumerate(candidates):
+        cand['mjd'] = float(lc['mjd'][i])
+        cand['imjd'] = int(lc['imjd'][i])
+        cand['since_now'] = float(since_now[i])
+        if lc['detection'][i]:
+            cand['utc'] = utc[i]
+            cand['image_urls'] = image_store_urls(image_store, cand['candid'], cand['imjd'])
+        else:
+            cand['magpsf'] = cand['diffmaglim']
 
-    # DISC MAGS
-    objectData["discMjd"] = detections["mjd"].values[0]
-    objectData["discUtc"] = detections["utc"].values[0]
-    objectData["discMag"] = f"{detections['magpsf'].values[0]:.2f}±{detections['sigmapsf'].values[0]:.2f}"
-    if detections['fid'].values[0] == 1:
-        objectData["discFilter"] = "g"
-    else:
-        objectData["discFilter"] = "r"
-
-    # LATEST MAGS
-    objectData["latestMjd"] = detections["mjd"].values[-1]
-    objectData["latestUtc"] = detections["utc"].values[-1]
-    objectData["latestMag"] = f"{detections['magpsf'].values[-1]:.2f}±{detections['sigmapsf'].values[-1]:.2f}"
-    if detections['fid'].values[-1] == 1:
-        objectData["latestFilter"] = "g"
-    else:
-        objectData["latestFilter"] = "r"
-
-    # PEAK MAG
-    peakMag = detections[detections['magpsf'] == detections['magpsf'].min()]
-    objectData["peakMjd"] = peakMag["mjd"].values[0]
-    objectData["peakUtc"] = peakMag["utc"].values[0]
-    objectData["peakMag"] = f"{peakMag['magpsf'].values[0]:.2f}±{peakMag['sigmapsf'].values[0]:.2f}"
-    if peakMag['fid'].values[0] == 1:
-        objectData["peakFilter"] = "g"
-    else:
-        objectData["peakFilter"] = "r"
+    objectData.update(lightcurve_summary(lc, utc))
+    candidates.sort(key=lambda c: c['mjd'], reverse=True)
 
     data = {'objectId': objectId,
             'objectData': objectData,
@@ -295,11 +321,111 @@ def objjson(objectId, full=False):
             'count_noncandidate': count_noncandidate,
             'forcedphot': fpcandidates,
             'sherlock': sherlock,
-            'image_urls': image_urls,
+            'image_urls': {},
             'TNS': TNS, 'message': message}
     return data
 
 
+# attributes objjson adds to a candidate, left out of its JSON blob
+CANDIDATE_DERIVED = ['json', 'mjd', 'imjd', 'since_now', 'utc', 'image_urls', 'microjansky', 'microjanskyerr']
+
+
+def candidate_json_str(cand):
+    """the candidate as indented JSON without the enclosing braces, as shown on the object page
+
+     **Key Arguments:**
+
+    - `cand` -- a candidate dictionary
+    """
+    raw = {k: v for k, v in cand.items() if k not in CANDIDATE_DERIVED}
+    return json.dumps(raw, indent=2)[1:-1]
+
+
+def lightcurve_arrays(candidates):
+    """columnar view of a lightcurve: numpy arrays of mjd, imjd, magpsf, sigmapsf, fid and detection/isdiffpos flags
+
+     **Key Arguments:**
+
+    - `candidates` -- list of candidate and noncandidate dictionaries
+    """
+    n = len(candidates)
+    mjd = np.fromiter((c['jd'] for c in candidates), dtype=float, count=n) - 2400000.5
+    detection = np.fromiter(('candid' in c for c in candidates), dtype=bool, count=n)
+    isdiffpos = np.fromiter((c.get('isdiffpos') in ('t', '1') for c in candidates), dtype=bool, count=n)
+    magpsf = np.fromiter((c.get('magpsf') if c.get('magpsf') is not None else np.nan
+                          for c in candidates), dtype=float, count=n)
+    sigmapsf = np.fromiter((c.get('sigmapsf') if c.get('sigmapsf') is not None else np.nan
+                            for c in candidates), dtype=float, count=n)
+    fid = np.fromiter((c['fid'] for c in candidates), dtype=int, count=n)
+    return {
+        'mjd': mjd,
+        'imjd': mjd.astype(int),
+        'detection': detection,
+        'isdiffpos': isdiffpos & detection,
+        'magpsf': magpsf,
+        'sigmapsf': sigmapsf,
+        'fid': fid,
+    }
+
+
+def mjd_to_utc(mjd):
+    """array of MJD to a list of UTC strings `YYYY-MM-DD HH:MM:SS`, truncated to the second
+
+     **Key Arguments:**
+
+    - `mjd` -- numpy array of MJD
+    """
+    t = np.datetime64('1858-11-17') + (np.asarray(mjd) * 86400e6).astype('timedelta64[us]')
+    return [u.replace('T', ' ') for u in np.datetime_as_string(t, unit='s')]
+
+
+def image_store_urls(image_store, candid, imjd):
+    """web URLs of the three cutout images of a candidate
+
+    The part of the URL before the hash directory is the same for every candidate
+    of a night, so it is built once per image store and night.
+
+     **Key Arguments:**
+
+    - `image_store` -- objectStore for the cutout images
+    - `candid` -- the candidate identifier
+    - `imjd` -- integer MJD of the candidate
+    """
+    prefix = image_url_prefix(image_store.fileroot, imjd)
+    urls = {}
+    for cutoutType in ['Science', 'Template', 'Difference']:
+        name = '%s_cutout%s' % (candid, cutoutType)
+        h = hashlib.md5(name.encode()).hexdigest()[:3]
+        urls[cutoutType] = '%s%s/%s.%s' % (prefix, h, name, image_store.suffix)
+    return urls
+
+
+@lru_cache(maxsize=4096)
+def image_url_prefix(fileroot, imjd):
+    url_root = fileroot.replace('/mnt/cephfs/lasair', f'https://{settings.LASAIR_URL}/lasair/static')
+    return '%s/%d/' % (url_root, imjd)
+
+
+def lightcurve_summary(lc, utc):
+    """discovery, latest and peak magnitudes of the detections, in one pass over the lightcurve arrays
+
+     **Key Arguments:**
+
+    - `lc` -- arrays from `lightcurve_arrays`, with at least one detection
+    - `utc` -- list of UTC strings of the lightcurve points
+    """
+    det = np.flatnonzero(lc['detection'])
+    det = det[np.argsort(lc['mjd'][det], kind='stable')]
+    peak = det[np.argmin(lc['magpsf'][det])]
+    summary = {}
+    for name, i in [('disc', det[0]), ('latest', det[-1]), ('peak', peak)]:
+        summary[name + 'Mjd'] = float(lc['mjd'][i])
+        summary[name + 'Utc'] = utc[i]
+        summary[name + 'Mag'] = f"{lc['magpsf'][i]:.2f}±{lc['sigmapsf'][i]:.2f}"
+        summary[name + 'Filter'] = 'g' if lc['fid'][i] == 1 else 'r'
+    return summary
+
+
 def distance(ra1, de1, ra2, de2):
     """*calculate the distance in degrees between 2 points*
 
@@ -0,0 +1,90 @@
+"""Benchmark of the API throttle against the number of requests in the window.
+
+Before: the list of request times kept in the cache, as UserClassRateThrottle
+did up to now, which is read, trimmed and written back whole on every request.
+After: the sliding window counter. One user makes a request every 0.036 seconds
+of throttle time, which is 100000 an hour, against an allowance of 100000 an
+hour, and the time per request is reported as the window fills. The times are
+for the cache only, as set up in the web server settings; the database query
+for the user's groups that the old throttle also made every time is not included.
+Needs the same environment as the web server, run from this directory.
+
+Usage: python3 bench_throttle.py [nrequests]
+"""
+import os
+import sys
+import time
+sys.path.append('..')
+sys.path.append('../../common')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lasair.settings')
+import django
+django.setup()
+from lasairapi.throttle import UserClassRateThrottle
+
+RATE = '100000/hour'
+STEP = 3600 / 100000
+
+
+class User:
+    pk = 1
+    is_authenticated = True
+
+    def __str__(self):
+        return 'bench'
+
+
+class Request:
+    user = User()
+    auth = None
+
+
+class After(UserClassRateThrottle):
+    def get_rate(self, request=None):
+        return RATE
+
+
+class Before(After):
+    "the throttle as it was, with a list of times"
+    cache_format = 'throttle_bench_before_%(scope)s_%(ident)s'
+
+    def allow_request(self, request, view):
+        self.key = self.get_cache_key(request, view)
+        self.history = self.cache.get(self.key, [])
+        self.now = self.timer()
+        while self.history and self.history[-1] <= self.now - self.duration:
+            self.history.pop()
+        if len(self.history) >= self.num_requests:
+            return False
+        self.history.insert(0, self.now)
+        self.cache.set(self.key, self.history, self.duration)
+        return True
+
+
+def run(throttle_class, nrequests, report):
+    clock = [0.0]
+    throttle = throttle_class()
+    throttle.timer = lambda: clock[0]
+    throttle.cache.delete(throttle.cache_format % {'scope': throttle.scope, 'ident': 1})
+    request = Request()
+    times = {}
+    t = time.perf_counter()
+    for i in range(1, nrequests + 1):
+        throttle.allow_request(request, None)
+        clock[0] += STEP
+        if i in report:
+            now = time.perf_counter()
+            times[i] = now - t
+            t = now
+    return times
+
+
+if __name__ == '__main__':
+    nrequests = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    report = [n for n in (1000, 10000, 25000, 50000, 100000) if n <= nrequests]
+    before = run(Before, nrequests, report)
+    after = run(After, nrequests, report)
+    print('%10s %16s %16s' % ('requests', 'before us/req', 'after us/req'))
+    previous = 0
+    for n in report:
+        print('%10d %16.1f %16.1f' % (n, 1e6 * before[n] / (n - previous), 1e6 * after[n] / (n - previous)))
+        previous = n
@@ -0,0 +1,41 @@
+"""Prometheus metrics of the API: the time to answer each request, by route and status.
+
+Each web server process keeps its own metrics and writes them at most every
+METRICS_INTERVAL seconds with metrics.write_shared, which adds them to those of
+the other processes in one lasair_api.prom in the node exporter's textfile
+directory. For the streaming views the time is to the start of the response,
+not the end of the stream.
+"""
+import time
+from src import metrics
+
+API_SECONDS = metrics.histogram('lasair_api_request_seconds',
+    'Time to answer an API request', ('route', 'status'))
+
+
+class APIMetricsMiddleware:
+    """*time the requests to /api/*
+
+    **Usage:**
+
+    ```python
+    MIDDLEWARE = [
+        ...
+        'lasairapi.metrics.APIMetricsMiddleware',
+    ]
+    ```
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith('/api/'):
+            return self.get_response(request)
+        t = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        route = match.route if match else 'unknown'
+        API_SECONDS.observe(time.perf_counter() - t, route=route, status=response.status_code)
+        metrics.write_shared('lasair_api', every=True)
+        return response
@@ -4,9 +4,17 @@ import re
 import json
 from cassandra.cluster import Cluster
 from lasair.query_builder import check_query, build_query
-from lasair.utils import objjson
+from lasair.utils import objjson, objjson_many
+from lasairapi.sherlock_cache import sherlock_object
+from lasair.render_cache import cached, object_version
+from lasair.query_cache import cached as query_cached
+from lasair.apps.search.utils import cone_hits
+import csv
+import io
+import base64
+from rest_framework.utils.encoders import JSONEncoder
 import requests
-from lasair.lightcurves import lightcurve_fetcher, forcedphot_lightcurve_fetcher
+from lasair.lightcurves import lightcurve_fetcher
 from cassandra.query import dict_factory
 from django.db import IntegrityError
 from django.db import connection
@@ -75,9 +83,95 @@ class ConeSerializer(serializers.Serializer):
 
         return info
 
+
+# most positions in one bulk cone search request
+BULK_CONE_MAX_POSITIONS = getattr(lasair_settings, 'BULK_CONE_MAX_POSITIONS', 10000)
+
+
+def read_positions(text, radius):
+    """ Positions from a JSON list or CSV text, as a list of (ra, dec, radius, id).
+
+    JSON items are [ra, dec], [ra, dec, radius] or {"ra":, "dec":, "radius":, "id":}.
+    CSV lines are ra,dec[,radius], or have a header row naming ra, dec, radius, id.
+    The id, if given, is passed back with the result for that position.
+    """
+    text = text.strip()
+    items = []
+    if text.startswith('['):
+        for item in json.loads(text):
+            if isinstance(item, dict):
+                items.append((item['ra'], item['dec'], item.get('radius', radius), item.get('id')))
+            else:
+                items.append((item[0], item[1], item[2] if len(item) > 2 else radius, None))
+    else:
+        lines = [line for line in text.splitlines() if line.strip() and not line.startswith('#')]
+        if lines and 'ra' in [h.strip().lower() for h in lines[0].split(',')]:
+            lines[0] = lines[0].lower()
+            for row in csv.DictReader(io.StringIO('\n'.join(lines))):
+                row = {k.strip(): v for k, v in row.items() if k}
+                items.append((row['ra'], row['dec'], row.get('radius') or radius, row.get('id')))
+        else:
+            for row in csv.reader(lines):
+                items.append((row[0], row[1], row[2] if len(row) > 2 else radius, None))
+    return [(float(ra), float(dec), float(r), id) for (ra, dec, r, id) in items]
+
+
+class BulkConeSerializer(serializers.Serializer):
+    positions = serializers.CharField(required=False)
+    file = serializers.FileField(required=False)
+    radius = serializers.FloatField(required=False, default=5.0)
+    requestType = serializers.ChoiceField(choices=REQUEST_TYPE_CHOICES)
+
+    def validate(self, data):
+        if 'file' in data:
+            text = data['file'].read().decode('utf-8', errors='replace')
+        elif 'positions' in data:
+            text = data['positions']
+        else:
+            raise serializers.ValidationError('Give positions as a JSON list or CSV, or upload a CSV file')
+        try:
+            data['position_list'] = read_positions(text, data['radius'])
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise serializers.ValidationError('Cannot parse positions: %s' % str(e))
+        if len(data['position_list']) > BULK_CONE_MAX_POSITIONS:
+            raise serializers.ValidationError('Max number of positions is %d.' % BULK_CONE_MAX_POSITIONS)
+        for (ra, dec, radius, id) in data['position_list']:
+            if radius > 1000:
+                raise serializers.ValidationError('Max radius is 1000 arcsec.')
+            if not -90 <= dec <= 90:
+                raise serializers.ValidationError('Dec out of range: %f' % dec)
+        return data
+
+    def npositions(self):
+        return len(self.validated_data['position_list'])
+
+    def save(self):
+        """ One result per position, in the order given """
+        position_list = self.validated_data['position_list']
+        requestType = self.validated_data['requestType']
+
+        allhits = cone_hits([(ra % 360, dec, radius) for (ra, dec, radius, id) in position_list])
+
+        info = []
+        for (ra, dec, radius, id), hits in zip(position_list, allhits):
+            result = {'ra': ra, 'dec': dec, 'radius': radius}
+            if id is not None:
+                result['id'] = id
+            if requestType == "nearest":
+                if hits:
+                    result['object'] = hits[0][0]
+                    result['separation'] = hits[0][3]
+            if requestType == "all":
+                result['objects'] = [{"object": hit[0], "separation": hit[3]} for hit in hits]
+            if requestType == "count":
+                result['count'] = len(hits)
+            info.append(result)
+        return info
+
+
 class ObjectSerializer(serializers.Serializer):
     objectId = serializers.CharField(required=True)
-    lite = serializers.BooleanField()    # doesnt do anything right now
+    lite = serializers.BooleanField()    # leave out the per-candidate JSON strings
     lasair_added = serializers.BooleanField()
 
     def save(self):
@@ -91,42 +185,46 @@ class ObjectSerializer(serializers.Serializer):
         if request and hasattr(request, "user"):
             userId = request.user
 
+        # cached by objectId and jdmax, so a new detection is always seen
+        try:
+            version = object_version(objectId)
+        except Exception as e:
+            return {'error': str(e)}
+
         if lasair_added:
             try:
-                result = objjson(objectId)
+                result = cached('objjson', objectId, version,
+                                lambda: objjson(objectId, candidate_json=not lite), variant='lite%d' % lite)
             except Exception as e:
                 result = {'error': str(e)}
             return result
         else:
-            # Fetch the lightcurve, either from cassandra or file system
-            LF = lightcurve_fetcher(cassandra_hosts=lasair_settings.CASSANDRA_HEAD)
+            def fetch():
+                # Fetch the lightcurve and the forced photometry concurrently
+                LF = lightcurve_fetcher(cassandra_hosts=lasair_settings.CASSANDRA_HEAD)
+                try:
+                    bundle = LF.fetch_bundle(objectId)
+                finally:
+                    LF.close()
+                return {'objectId':objectId, 'candidates':bundle['candidates'], 'forcedphot': bundle['forcedphot']}
 
-            # 2024-01-31 KWS Add the forced photometry
-            FLF = forcedphot_lightcurve_fetcher(cassandra_hosts=lasair_settings.CASSANDRA_HEAD)
-
-            lightcurves = []
             try:
-                candidates = LF.fetch(objectId)
-                fpcandidates = FLF.fetch(objectId)
-                result = {'objectId':objectId, 'candidates':candidates, 'forcedphot': fpcandidates}
+                result = cached('lightcurve', objectId, version, fetch)
             except Exception as e:
                 result = {'error': str(e)}
-
-            LF.close()
-            FLF.close()
             return result
 
 
-class ObjectsSerializer(serializers.Serializer):    # DEPRECATED
+class ObjectsSerializer(serializers.Serializer):
     objectIds = serializers.CharField(required=True)
 
     def save(self):
+        """ Returns a generator of objjson results, one per objectId, for streaming """
         objectIds = self.validated_data['objectIds']
 
         olist = []
         for tok in objectIds.split(','):
             olist.append(tok.strip())
-#        olist = olist[:10] # restrict to 10
 
         # Get the authenticated user, if it exists.
         userId = 'unknown'
@@ -134,13 +232,7 @@ class ObjectsSerializer(serializers.Serializer):    # DEPRECATED
         if request and hasattr(request, "user"):
             userId = request.user
 
-        result = []
-        for objectId in olist:
-            try:
-                result.append(objjson(objectId))
-            except Exception as e:
-                result.append({'error': str(e)})
-        return result
+        return objjson_many(olist, catch_errors=True)
 
 
 class SherlockObjectSerializer(serializers.Serializer):
@@ -164,20 +256,8 @@ class SherlockObjectSerializer(serializers.Serializer):
         if not lasair_settings.SHERLOCK_SERVICE:
             return {"error": "This Lasair cluster does not have a Sherlock service"}
 
-        datadict = {}
-        data = {'lite': lite}
-        # sherlock service expects a comma-separated list
-        r = requests.post(
-            'http://%s/object/%s' % (lasair_settings.SHERLOCK_SERVICE, objectId),
-            headers={"Content-Type": "application/json"},
-            data=json.dumps(data)
-        )
-
-        if r.status_code == 200:
-            response = r.json()
-            return response
-        else:
-            return {"error": r.text}
+        # lite comes from the database, full responses are cached
+        return sherlock_object(objectId, lite=lite)
 
 class SherlockObjectsSerializer(serializers.Serializer):   # DEPRECATED
     objectIds = serializers.CharField(required=True)
@@ -255,6 +335,18 @@ class SherlockPositionSerializer(serializers.Serializer):
             return json.loads(r.text)
 
 
+def query_maxlimit(request):
+    """ Most rows a user may have from one query: 1000 for the dummy token, 10000 for users, 1000000 for powerapi """
+    maxlimit = 1000
+    if request and hasattr(request, "user"):
+        if str(request.user) != 'dummy':
+            maxlimit = 10000
+        for g in request.user.groups.all():
+            if g.name == 'powerapi':
+                maxlimit = 1000000
+    return maxlimit
+
+
 class QuerySerializer(serializers.Serializer):
     selected = serializers.CharField(max_length=4096, required=True)
     tables = serializers.CharField(max_length=1024, required=True)
@@ -274,16 +366,8 @@ class QuerySerializer(serializers.Serializer):
             offset = self.validated_data['offset']
 
         # Get the authenticated user, if it exists.
-        userId = 'unknown'
         request = self.context.get("request")
-        maxlimit = 1000
-        if request and hasattr(request, "user"):
-            userId = request.user
-            if str(userId) != 'dummy':
-                maxlimit = 10000
-            for g in request.user.groups.all():
-                if g.name == 'powerapi':
-                    maxlimit = 1000000
+        maxlimit = query_maxlimit(request)
 
         page = 0
         limitseconds = 300
@@ -308,20 +392,200 @@ class QuerySerializer(serializers.Serializer):
         except Exception as e:
             return {"error": str(e)}
 
-        sqlquery_real += ' LIMIT %d OFFSET %d' % (limit, offset)
+        sqlquery_limit = sqlquery_real + ' LIMIT %d OFFSET %d' % (limit, offset)
 
         msl = db_connect.readonly()
         cursor = msl.cursor(buffered=True, dictionary=True)
-        result = []
+
+        def run():
+            cursor.execute(sqlquery_limit)
+            return [row for row in cursor]
+
         try:
-            cursor.execute(sqlquery_real)
-            for row in cursor:
-                result.append(row)
-            return result
+            return query_cached('api', sqlquery_real, limit, offset, run)
         except Exception as e:
-            error = 'Your query:<br/><b>' + sqlquery_real + '</b><br/>returned the error<br/><i>' + str(e) + '</i>'
+            error = 'Your query:<br/><b>' + sqlquery_limit + '</b><br/>returned the error<br/><i>' + str(e) + '</i>'
             return {"error": error}
 
+# rows fetched from the server per round trip when streaming a query
+QUERY_STREAM_FETCH = 1000
+
+# single ORDER BY column at the end of the conditions, the only kind keyset pagination handles
+ORDER_BY = re.compile(r'^(.*?)\s*order\s+by\s+([\w\.]+)(?:\s+(asc|desc))?\s*$', re.IGNORECASE | re.DOTALL)
+
+# stands for the keyset condition while the query is built
+KEYSET_MARK = 'KEYSET__CONDITION'
+
+OUTPUT_CHOICES = (
+    ('ndjson', 'NDJSON'),
+    ('csv', 'CSV'),
+)
+
+
+def encode_page_token(value, objectId):
+    s = json.dumps([value, objectId], cls=JSONEncoder)
+    return base64.urlsafe_b64encode(s.encode()).decode()
+
+
+def decode_page_token(token):
+    return json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+
+
+def sql_literal(value):
+    """ A value from a page token as an SQL literal. Quotes are doubled, which is safe
+    whether or not the server treats backslash as an escape """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'%s'" % str(value).replace('\\', '\\\\').replace("'", "''")
+
+
+def keyset_condition(column, descending, token):
+    """ SQL condition selecting the rows after the page token.
+
+    Rows are ordered by the column then objectId, NULLs of the column first,
+    as MySQL sorts them ascending. The values are written into the SQL rather
+    than passed as parameters, because the user's conditions may contain %s.
+    """
+    [value, objectId] = decode_page_token(token)
+    v = sql_literal(value)
+    o = sql_literal(objectId)
+    if column is None:
+        return 'objects.objectId > %s' % o
+    if not descending:
+        if value is None:
+            return '((%s IS NULL AND objects.objectId > %s) OR %s IS NOT NULL)' % (column, o, column)
+        return '(%s > %s OR (%s = %s AND objects.objectId > %s))' % (column, v, column, v, o)
+    else:
+        if value is None:
+            return '(%s IS NULL AND objects.objectId < %s)' % (column, o)
+        return '(%s < %s OR (%s = %s AND objects.objectId < %s) OR %s IS NULL)' % (column, v, column, v, o, column)
+
+
+class QueryStreamSerializer(serializers.Serializer):
+    selected = serializers.CharField(max_length=4096, required=True)
+    tables = serializers.CharField(max_length=1024, required=True)
+    conditions = serializers.CharField(max_length=4096, required=True, allow_blank=True)
+    limit = serializers.IntegerField(max_value=1000000, required=False)
+    page_token = serializers.CharField(max_length=1024, required=False)
+    output = serializers.ChoiceField(choices=OUTPUT_CHOICES, required=False, default='ndjson')
+
+    def validate(self, data):
+        error = check_query(data['selected'], data['tables'], data['conditions'])
+        if error:
+            raise serializers.ValidationError(error)
+        if 'page_token' in data:
+            try:
+                decode_page_token(data['page_token'])
+            except Exception:
+                raise serializers.ValidationError('Cannot read page_token')
+        return data
+
+    def build(self):
+        """ The SQL for one page, its row limit, and whether a page token can be given back.
+
+        With no ORDER BY, or a single ORDER BY column, the page is ordered by
+        that column and objectId and the next page starts after the last row.
+        Other orderings, or grouping, are streamed as they are, with no page
+        token. build_query always joins the objects table, so objectId is there.
+        """
+        selected = self.validated_data['selected']
+        tables = self.validated_data['tables']
+        conditions = self.validated_data['conditions'].strip()
+        token = self.validated_data.get('page_token')
+        limit = min(query_maxlimit(self.context.get("request")), self.validated_data.get('limit', 1000))
+
+        column = None
+        descending = False
+        m = ORDER_BY.match(conditions)
+        lower = conditions.lower()
+        if 'group by' in lower or 'limit' in lower \
+                or ('order by' in lower and not m):
+            return (build_query(selected, tables, conditions) + ' LIMIT %d' % limit, limit, False)
+        if m:
+            (conditions, column, direction) = m.groups()
+            descending = (direction or '').lower() == 'desc'
+
+        where = []
+        if conditions:
+            where.append('(%s)' % conditions)
+        if token:
+            where.append(KEYSET_MARK)
+        selected += ', objects.objectId AS keyset_objectId'
+        if column:
+            selected += ', %s AS keyset_value' % column
+        sql = build_query(selected, tables, ' AND '.join(where))
+        if token:
+            # added after build_query, which would change the quotes
+            sql = sql.replace(KEYSET_MARK, keyset_condition(column, descending, token))
+        order = ' DESC' if descending else ''
+        if column:
+            sql += ' ORDER BY %s%s, objects.objectId%s' % (column, order, order)
+        else:
+            sql += ' ORDER BY objects.objectId'
+        sql += ' LIMIT %d' % limit
+        return (sql, limit, True)
+
+    def save(self):
+        """ Generator of text chunks, NDJSON or CSV, from an unbuffered cursor """
+        output = self.validated_data['output']
+        try:
+            (sql, limit, keyset) = self.build()
+        except Exception as e:
+            return iter([json.dumps({'error': str(e)}) + '\n'])
+        return self.stream(sql, limit, keyset, output)
+
+    def stream(self, sql, limit, keyset, output):
+        msl = db_connect.readonly()
+        cursor = msl.cursor(buffered=False, dictionary=True)
+        nrow = 0
+        last = None
+        try:
+            cursor.execute(sql)
+            columns = [c for c in cursor.column_names if not c.startswith('keyset_')]
+            if output == 'csv':
+                buf = io.StringIO()
+                csv.writer(buf).writerow(columns)
+                yield buf.getvalue()
+            while True:
+                rows = cursor.fetchmany(QUERY_STREAM_FETCH)
+                if not rows:
+                    break
+                nrow += len(rows)
+                last = rows[-1]
+                if output == 'csv':
+                    buf = io.StringIO()
+                    writer = csv.writer(buf)
+                    for row in rows:
+                        writer.writerow([row[c] for c in columns])
+                    yield buf.getvalue()
+                else:
+                    yield ''.join([json.dumps({c: row[c] for c in columns}, cls=JSONEncoder) + '\n' for row in rows])
+        except Exception as e:
+            yield json.dumps({'error': str(e)}) + '\n'
+            return
+        finally:
+            # the client may go away part way through, leaving rows unread
+            try:
+                cursor.close()
+            except Exception:
+                pass
+            msl.close()
+
+        # a full page means there may be more
+        token = None
+        if keyset and nrow == limit:
+            token = encode_page_token(last.get('keyset_value'), last['keyset_objectId'])
+        if output == 'csv':
+            if token:
+                yield '# next_page_token=%s\n' % token
+        else:
+            yield json.dumps({'next_page_token': token}) + '\n'
+
+
 class LightcurvesSerializer(serializers.Serializer):    # DEPRECATED
     objectIds = serializers.CharField(max_length=16384, required=True)
 
@@ -337,23 +601,18 @@ class LightcurvesSerializer(serializers.Serializer):    # DEPRECATED
         if request and hasattr(request, "user"):
             userId = request.user
 
-            # Fetch the lightcurve, either from cassandra or file system
+        # Fetch the lightcurves, many objects in flight at once
         LF = lightcurve_fetcher(cassandra_hosts=lasair_settings.CASSANDRA_HEAD)
 
-        # 2024-01-31 KWS Add the forced photometry
-        FLF = forcedphot_lightcurve_fetcher(cassandra_hosts=lasair_settings.CASSANDRA_HEAD)
-
+        # an object that fails gives its own error, as before, and the rest still come
         lightcurves = []
-        for objectId in olist:
-            try:
-                candidates = LF.fetch(objectId)
-                fpcandidates = FLF.fetch(objectId)
-                lightcurves.append({'objectId':objectId, 'candidates':candidates, 'forcedphot': fpcandidates})
-            except Exception as e:
-                lightcurves.append({'error': str(e)})
+        for bundle in LF.fetch_many(olist, errors=True):
+            if 'error' in bundle:
+                lightcurves.append({'error': bundle['error']})
+            else:
+                lightcurves.append({'objectId':bundle['objectId'], 'candidates':bundle['candidates'], 'forcedphot': bundle['forcedphot']})
 
         LF.close()
-        FLF.close()
         return lightcurves
 #################################### 
 
@@ -0,0 +1,112 @@
+"""Tiered cache for the Sherlock API endpoints.
+
+Tier 1: lite requests are answered straight from the sherlock_classifications
+row that the filter has already written for the object.
+Tier 2: full responses from the Sherlock service are held in the Django cache
+for SHERLOCK_CACHE_TTL seconds. The cache key includes a fingerprint of the
+sherlock_classifications row, so when the filter writes a new row for the
+object (new classification or moved position) the old entry is never read again.
+Tier 3: the Sherlock service itself.
+"""
+import json
+import hashlib
+import requests
+from django.core.cache import cache
+from src import db_connect
+import settings as lasair_settings
+
+# how long a full Sherlock response is kept, seconds
+SHERLOCK_CACHE_TTL = getattr(lasair_settings, 'SHERLOCK_CACHE_TTL', 86400)
+
+# columns of sherlock_classifications that are not part of the crossmatch
+NOT_CROSSMATCH = ['objectId', 'classification', 'description',
+                  'annotator', 'additional_output', 'summary']
+
+
+def sherlock_row(objectId):
+    """fetch the sherlock_classifications row for an object, or None
+
+     **Key Arguments:**
+
+    - `objectId` -- the object identifier
+    """
+    msl = db_connect.readonly()
+    cursor = msl.cursor(buffered=True, dictionary=True)
+    cursor.execute('SELECT * FROM sherlock_classifications WHERE objectId=%s', (objectId,))
+    row = cursor.fetchone()
+    cursor.close()
+    msl.close()
+    return row
+
+
+def row_fingerprint(row):
+    """short hash of a sherlock_classifications row, changes whenever the filter rewrites it
+
+     **Key Arguments:**
+
+    - `row` -- dictionary from sherlock_classifications, or None
+    """
+    if not row:
+        return 'none'
+    s = json.dumps(row, sort_keys=True, default=str)
+    return hashlib.md5(s.encode('utf-8')).hexdigest()[:16]
+
+
+def lite_from_row(row):
+    """build a lite Sherlock response, in the same shape as the service returns, from a database row
+
+     **Key Arguments:**
+
+    - `row` -- dictionary from sherlock_classifications
+    """
+    objectId = row['objectId']
+    classification = [row['classification']]
+    if row.get('description'):
+        classification.append(row['description'])
+
+    crossmatches = []
+    if row.get('catalogue_object_id'):
+        crossmatch = {'transient_object_id': objectId, 'rank': 1}
+        for k, v in row.items():
+            if k not in NOT_CROSSMATCH:
+                crossmatch[k] = v
+        crossmatches.append(crossmatch)
+
+    return {
+        'classifications': {objectId: classification},
+        'crossmatches': crossmatches,
+    }
+
+
+def cache_key(objectId, lite, fingerprint):
+    return 'sherlock:%s:%d:%s' % (objectId, int(lite), fingerprint)
+
+
+def sherlock_object(objectId, lite=True):
+    """return the Sherlock response for an object, using the cheapest tier that has it
+
+     **Key Arguments:**
+
+    - `objectId` -- the object identifier
+    - `lite` -- top ranked matches only
+    """
+    row = sherlock_row(objectId)
+    if lite and row:
+        return lite_from_row(row)
+
+    key = cache_key(objectId, lite, row_fingerprint(row))
+    response = cache.get(key)
+    if response is not None:
+        return response
+
+    r = requests.post(
+        'http://%s/object/%s' % (lasair_settings.SHERLOCK_SERVICE, objectId),
+        headers={"Content-Type": "application/json"},
+        data=json.dumps({'lite': lite})
+    )
+    if r.status_code != 200:
+        return {"error": r.text}
+
+    response = r.json()
+    cache.set(key, response, SHERLOCK_CACHE_TTL)
+    return response
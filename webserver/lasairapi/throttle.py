@@ -1,8 +1,21 @@
+"""Throttles for the API, by the class of user.
+
+Each user has a sliding window counter, the counts of the current and the
+previous window of the throttle duration, so the state in the cache is three
+numbers however many requests are allowed. The previous window is weighted by
+how much of it still overlaps the sliding window. The class of user, from the
+token and its groups, is cached per token for THROTTLE_TIER_TTL seconds.
+"""
 from rest_framework.throttling import UserRateThrottle
 from rest_framework.views import exception_handler
 from rest_framework.exceptions import Throttled
+from django.core.exceptions import ImproperlyConfigured
 import lasair.settings
 import datetime
+
+# seconds to keep the class of user of a token, so the groups are not read for every request
+THROTTLE_TIER_TTL = getattr(lasair.settings, 'THROTTLE_TIER_TTL', 300)
+
 def custom_exception_handler(exc, context):
     # Call REST framework's default exception handler first,
     # to get the standard error response.
@@ -17,26 +30,70 @@ def custom_exception_handler(exc, context):
 
 class UserClassRateThrottle(UserRateThrottle):
     scope = 'user'
+    # not the key of the UserRateThrottle, which keeps a list of times
+    cache_format = 'throttle_window_%(scope)s_%(ident)s'
 
     def __init__(self):
         super().__init__()
 
     def allow_request(self, request, view):
+        return self.consume(request, view, 1)
+
+    def consume(self, request, view, n):
+        """
+        Count n against the allowance if there is room for it, and return whether there was.
+        """
         self.key = self.get_cache_key(request, view)
 
         if self.key is None:
             return True
 
-        self.history = self.cache.get(self.key, [])
         self.now = self.timer()
+        (self.window, self.current, self.previous) = self.read_window()
+        self.wanted = n
+        if self.estimate() + n > self.num_requests:
+            return False
 
-        # Drop any requests from the history which have now passed the
-        # throttle duration
-        while self.history and self.history[-1] <= self.now - self.duration:
-            self.history.pop()
-        if len(self.history) >= self.num_requests:
-            return self.throttle_failure()
-        return self.throttle_success()
+        self.current += n
+        self.cache.set(self.key, (self.window, self.current, self.previous), 2 * self.duration)
+        return True
+
+    def read_window(self):
+        """
+        The current window and the counts in it and the one before, from the cache.
+        """
+        window = int(self.now // self.duration)
+        state = self.cache.get(self.key)
+        if not isinstance(state, tuple):
+            return (window, 0, 0)
+        (w, current, previous) = state
+        if w == window:
+            return (window, current, previous)
+        if w == window - 1:
+            return (window, 0, current)
+        return (window, 0, 0)
+
+    def estimate(self):
+        """
+        Count in the sliding window, taking the previous window as spread evenly over it.
+        """
+        elapsed = self.now / self.duration - self.window
+        return self.previous * (1 - elapsed) + self.current
+
+    def wait(self):
+        """
+        Seconds until there is room for the request that was refused.
+        """
+        elapsed = self.now / self.duration - self.window
+        room = self.num_requests - self.wanted
+        if room < 0:
+            return self.duration
+        if self.current <= room:
+            if self.previous == 0:
+                return 0
+            return max(0, (1 - (room - self.current) / self.previous) - elapsed) * self.duration
+        # not until the next window, when the current count becomes the previous one
+        return (1 - elapsed + max(0, 1 - room / self.current)) * self.duration
 
     def get_cache_key(self, request, view):
         if request.user.is_authenticated:
@@ -52,6 +109,22 @@ class UserClassRateThrottle(UserRateThrottle):
             'ident': ident
         }
 
+    def get_user_type(self, request):
+        """
+        The class of user, cached per user.
+        """
+        key = 'throttle_tier_%s' % request.user.pk
+        user_type = self.cache.get(key)
+        if user_type is None:
+            if str(request.user) == 'dummy':
+                user_type = "ANON_THROTTLE_RATES"
+            elif request.user.groups.filter(name='powerapi').exists():
+                user_type = "POWER_THROTTLE_RATES"
+            else:
+                user_type = "USER_THROTTLE_RATES"
+            self.cache.set(key, user_type, THROTTLE_TIER_TTL)
+        return user_type
+
     def get_rate(self, request=None):
         """
         Determine the string representation of the allowed request rate.
@@ -62,14 +135,7 @@ class UserClassRateThrottle(UserRateThrottle):
             raise ImproperlyConfigured(msg)
 
         if request:
-            if str(request.user) == 'dummy':
-                user_type = "ANON_THROTTLE_RATES"
-            else:
-                user_type = "USER_THROTTLE_RATES"
-
-            for g in request.user.groups.all():
-                if g.name == 'powerapi':
-                    user_type = "POWER_THROTTLE_RATES"
+            user_type = self.get_user_type(request)
         else:
             user_type = "DEFAULT_THROTTLE_RATES"
 
@@ -80,3 +146,13 @@ class UserClassRateThrottle(UserRateThrottle):
         except KeyError:
             msg = "No default throttle rate set for '%s' scope" % self.scope
             raise ImproperlyConfigured(msg)
+
+
+class PositionRateThrottle(UserClassRateThrottle):
+    """
+    Throttle for the bulk cone search, counting positions rather than requests.
+    """
+    scope = 'positions'
+
+    def allow_positions(self, request, view, npositions):
+        return self.consume(request, view, npositions)
@@ -7,15 +7,17 @@ from . import views
 urlpatterns = [
     path('api',  TemplateView.as_view(template_name='api.html')),
     path('api/cone/',                  views.ConeView.as_view()),
+    path('api/cone/bulk/',             views.BulkConeView.as_view()),
     path('api/query/',                 views.QueryView.as_view()),
+    path('api/query/stream/',          views.QueryStreamView.as_view()),
     path('api/object/',                views.ObjectView.as_view()),
     path('api/sherlock/object/',       views.SherlockObjectView.as_view()),
     path('api/sherlock/position/',     views.SherlockPositionView.as_view()),
     path('api/auth-token/',            obtain_auth_token, name='auth_token'),
     path('api/annotate/',              views.AnnotateView.as_view()),
+    path('api/objects/',               views.ObjectsView.as_view()),
 
     # DEPRECATED
-    path('api/objects/',               views.ObjectsView.as_view()),
     path('api/lightcurves/',           views.LightcurvesView.as_view()),
     path('api/sherlock/objects/',      views.SherlockObjectsView.as_view()),
 ]
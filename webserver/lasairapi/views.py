@@ -1,10 +1,14 @@
+import json
 from django.shortcuts import get_object_or_404, render
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
 from .serializers import ConeSerializer, QuerySerializer, ObjectsSerializer, ObjectSerializer
 from .serializers import LightcurvesSerializer, SherlockObjectsSerializer, SherlockObjectSerializer, SherlockPositionSerializer
-from .serializers import AnnotateSerializer
+from .serializers import AnnotateSerializer, BulkConeSerializer, QueryStreamSerializer
+from .throttle import PositionRateThrottle
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from .query_auth import QueryAuthentication
@@ -13,6 +17,15 @@ def retcode(message):
     if 'error' in message: return status.HTTP_400_BAD_REQUEST
     else:                  return status.HTTP_200_OK
 
+def stream_json_list(items):
+    """ Write an iterable as a JSON list one element at a time, so the whole list is never in memory """
+    yield '['
+    for i, item in enumerate(items):
+        if i > 0:
+            yield ','
+        yield json.dumps(item, cls=JSONEncoder)
+    yield ']'
+
 class ConeView(APIView):
     authentication_classes = [TokenAuthentication, QueryAuthentication]
     permission_classes = [IsAuthenticated]
@@ -31,6 +44,28 @@ class ConeView(APIView):
             return Response(message, status=retcode(message))
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class BulkConeView(APIView):
+    authentication_classes = [TokenAuthentication, QueryAuthentication]
+    permission_classes = [IsAuthenticated]
+    # throttled by the number of positions, in bulk_cone
+    throttle_classes = []
+
+    def bulk_cone(self, request, data):
+        serializer = BulkConeSerializer(data=data, context={'request': request})
+        if serializer.is_valid():
+            throttle = PositionRateThrottle()
+            if not throttle.allow_positions(request, self, serializer.npositions()):
+                self.throttled(request, throttle.wait())
+            message = serializer.save()
+            return Response(message, status=retcode(message))
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def get(self, request):
+        return self.bulk_cone(request, request.GET)
+
+    def post(self, request, format=None):
+        return self.bulk_cone(request, request.data)
+
 class QueryView(APIView):
     authentication_classes = [TokenAuthentication, QueryAuthentication]
     permission_classes = [IsAuthenticated]
@@ -49,6 +84,26 @@ class QueryView(APIView):
             return Response(message, status=retcode(message))
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class QueryStreamView(APIView):
+    authentication_classes = [TokenAuthentication, QueryAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def stream(self, request, data):
+        serializer = QueryStreamSerializer(data=data, context={'request': request})
+        if serializer.is_valid():
+            if serializer.validated_data['output'] == 'csv':
+                content_type = 'text/csv'
+            else:
+                content_type = 'application/x-ndjson'
+            return StreamingHttpResponse(serializer.save(), content_type=content_type)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def get(self, request):
+        return self.stream(request, request.GET)
+
+    def post(self, request, format=None):
+        return self.stream(request, request.data)
+
 class ObjectView(APIView):
     authentication_classes = [TokenAuthentication, QueryAuthentication]
     permission_classes = [IsAuthenticated]
@@ -66,22 +121,20 @@ class ObjectView(APIView):
             message = serializer.save()
             return Response(message, status=retcode(message))
 
-class ObjectsView(APIView):    # DEPRECATED
+class ObjectsView(APIView):
     authentication_classes = [TokenAuthentication, QueryAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         serializer = ObjectsSerializer(data=request.GET, context={'request': request})
         if serializer.is_valid():
-            message = serializer.save()
-            return Response(message, status=retcode(message))
+            return StreamingHttpResponse(stream_json_list(serializer.save()), content_type='application/json')
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def post(self, request, format=None):
         serializer = ObjectsSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
-            message = serializer.save()
-            return Response(message, status=retcode(message))
+            return StreamingHttpResponse(stream_json_list(serializer.save()), content_type='application/json')
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class LightcurvesView(APIView):    # DEPRECATED